@@ -0,0 +1,5 @@
+"""Offline benchmarks for the exhook's hot paths.
+
+Run a benchmark with python -m emqx_deepstack_exhook.benchmark.<name>. The
+load benchmark drives the whole exhook over gRPC against the Frigate and
+CodeProject.AI stand-ins in upstream, so no real services are needed."""
@@ -0,0 +1,96 @@
+"""Memory and allocation benchmark of FrigateEvent against a plain dataclass.
+
+Replays a stream of Frigate event messages, by default synthetic ones from
+the load benchmark. Pass --stream with a file of recorded messages, one JSON
+payload per line, for example captured with
+
+    mosquitto_sub -t frigate/events > events.jsonl
+"""
+
+import json
+import time
+import tracemalloc
+from dataclasses import field, fields, make_dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import click
+
+from emqx_deepstack_exhook.benchmark.load import event_lifecycles
+from emqx_deepstack_exhook.cpai.types import EVENT_FIELDS, FrigateEvent
+
+# The event type as it was before it was slotted: one __dict__ per event and
+# a TypeError on unknown keys.
+DictFrigateEvent = make_dataclass(
+    "DictFrigateEvent",
+    [
+        (f.name, f.type, field(default=f.default, default_factory=f.default_factory))
+        for f in fields(FrigateEvent)
+        if f.name in EVENT_FIELDS
+    ],
+)
+
+
+def dict_event(after: Dict[str, Any]) -> Any:
+    return DictFrigateEvent(**{k: v for k, v in after.items() if k in EVENT_FIELDS})
+
+
+def measure(
+    build: Callable[[Dict[str, Any]], Any],
+    encode: Callable[[Any], Dict[str, Any]],
+    stream: List[Dict[str, Any]],
+) -> Dict[str, float]:
+    """Retained bytes and allocations per event, and build/encode time."""
+    afters = [json.loads(json.dumps(m["after"])) for m in stream]
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    events = [build(after) for after in afters]
+    retained, _ = tracemalloc.get_traced_memory()
+    blocks = sum(
+        stat.count_diff
+        for stat in tracemalloc.take_snapshot().compare_to(snapshot, "filename")
+    )
+    tracemalloc.stop()
+    start = time.perf_counter()
+    events = [build(after) for after in afters]
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    for event in events:
+        json.dumps(encode(event))
+    encoded = time.perf_counter() - start
+    return {
+        "bytes": (retained - before) / len(afters),
+        "blocks": blocks / len(afters),
+        "build_us": built / len(afters) * 1e6,
+        "encode_us": encoded / len(afters) * 1e6,
+    }
+
+
+@click.command()
+@click.option("--stream", type=click.Path(exists=True, dir_okay=False))
+@click.option("--events", default=20000, show_default=True)
+def main(stream: Optional[str], events: int):
+    if stream is not None:
+        with open(stream, "r") as f:
+            messages = [json.loads(line) for line in f if line.strip() != ""]
+        messages = [m for m in messages if isinstance(m.get("after", None), dict)]
+    else:
+        messages = list(event_lifecycles(events, 8, 6, 0))
+    click.echo(f"{len(messages)} events")
+    click.echo(
+        f"{'type':<16} {'bytes/event':>12} {'allocs/event':>13} "
+        f"{'build us':>9} {'encode us':>10}"
+    )
+    for name, build, encode in (
+        ("dataclass", dict_event, lambda e: e.__dict__),
+        ("FrigateEvent", FrigateEvent.from_dict, lambda e: e.to_dict()),
+    ):
+        result = measure(build, encode, messages)
+        click.echo(
+            f"{name:<16} {result['bytes']:>12.0f} {result['blocks']:>13.1f} "
+            f"{result['build_us']:>9.2f} {result['encode_us']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Micro-benchmark of event filters: jq vs. the native fast path."""
+
+import timeit
+
+import click
+import jq
+
+from emqx_deepstack_exhook.cpai.filter import EventFilter
+
+EXPRESSIONS = [
+    '.label == "person"',
+    ".score > 0.7 and .area < 40000",
+    '.label | IN("person", "dog", "cat")',
+    '(.label == "car" or .label == "truck") and .score >= 0.8',
+]
+EVENT = {
+    "id": "1720827466.247425-pw97yy",
+    "camera": "doorbell",
+    "label": "person",
+    "score": 0.84,
+    "top_score": 0.86,
+    "area": 23104,
+    "box": [412, 180, 560, 336],
+    "region": [0, 0, 640, 640],
+    "current_zones": ["porch"],
+    "entered_zones": ["porch", "walkway"],
+    "attributes": {},
+    "current_attributes": [],
+    "has_snapshot": True,
+}
+
+
+@click.command()
+@click.option("--number", default=20000, show_default=True)
+@click.option("--repeat", default=5, show_default=True)
+def main(number: int, repeat: int):
+    click.echo(f"{'expression':<58} {'jq us/op':>9} {'native us/op':>13} speedup")
+    for expression in EXPRESSIONS:
+        program = jq.compile(expression)
+        event_filter = EventFilter(expression)
+        assert event_filter.native
+        assert program.input_value(EVENT).first() == event_filter.matches(EVENT)
+        jq_t = min(
+            timeit.repeat(
+                lambda: program.input_value(EVENT).first(),
+                number=number,
+                repeat=repeat,
+            )
+        )
+        native = min(
+            timeit.repeat(
+                lambda: event_filter.matches(EVENT), number=number, repeat=repeat
+            )
+        )
+        click.echo(
+            f"{expression:<58} {jq_t / number * 1e6:>9.2f} "
+            f"{native / number * 1e6:>13.2f} {jq_t / native:>6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""Load generator driving the exhook over gRPC with synthetic Frigate events.
+
+By default the exhook and the Frigate and CodeProject.AI stand-ins all run in
+this process; pass --target to load an exhook started separately (its config
+must point at the stand-ins on --upstream-port). Messages are sent open-loop
+at --rate per second, so a slow exhook shows up as latency rather than as a
+lower offered load.
+
+Reports throughput, hook latency percentiles and upstream call counts, and
+can save the report as a baseline or compare against one:
+
+    python -m emqx_deepstack_exhook.benchmark.load --save-baseline base.json
+    python -m emqx_deepstack_exhook.benchmark.load --baseline base.json
+"""
+
+import asyncio
+import json
+import random
+import sys
+import time
+from concurrent import futures
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+import click
+import grpc
+import grpc.aio as g_aio
+
+from emqx_deepstack_exhook.benchmark.upstream import (
+    CAMERAS,
+    Latency,
+    Upstream,
+    start_upstream,
+)
+from emqx_deepstack_exhook.config import Config
+from emqx_deepstack_exhook.config.schema import SCHEMA_CONFIG
+from emqx_deepstack_exhook.cpai import CPAIProcess
+from emqx_deepstack_exhook.hook_provider import HookProvider
+from emqx_deepstack_exhook.interceptors import MetricsInterceptor
+from emqx_deepstack_exhook.pb2.exhook_pb2 import (
+    Message,
+    MessagePublishRequest,
+    ValuedResponse,
+)
+from emqx_deepstack_exhook.pb2.exhook_pb2_grpc import (
+    HookProviderStub,
+    add_HookProviderServicer_to_server,
+)
+
+TOPIC = "frigate/events"
+LABELS = ["person", "car"]
+# Keys compared against a baseline: 1 if higher is worse, -1 if lower is.
+COMPARED = {"throughput": -1, "p50": 1, "p95": 1, "p99": 1}
+
+
+def benchmark_config(host: str, port: int, servers: int = 1) -> Config:
+    """Exhook config pointing every upstream at the stand-ins."""
+    names = [f"cpai{n}" for n in range(servers)]
+    return Config.load(
+        SCHEMA_CONFIG(
+            {
+                "frigate": f"http://{host}:{port}",
+                "servers": {name: {"host": host, "port": port} for name in names},
+                "pools": {"cpai": {"servers": names}} if servers > 1 else {},
+                "pipelines": {
+                    "delivery": {
+                        "type": "object",
+                        "server": "cpai" if servers > 1 else names[0],
+                        "model": "ipcam-general",
+                        "filter": '.label == "car"',
+                    },
+                    "face": {
+                        "type": "face_detect",
+                        "server": "cpai" if servers > 1 else names[0],
+                        "filter": '.label == "person"',
+                    },
+                    "recognize": {
+                        "type": "face_recognize",
+                        "server": "cpai" if servers > 1 else names[0],
+                        "filter": '.label == "person"',
+                        "depends_on": "face",
+                    },
+                },
+                "topics": [
+                    {
+                        "subscribe": TOPIC,
+                        "pipeline": "delivery",
+                        "filter": '.label == "car"',
+                    },
+                    {
+                        "subscribe": TOPIC,
+                        "pipeline": ["face", "recognize"],
+                        "filter": '.label == "person"',
+                    },
+                ],
+            }
+        )
+    )
+
+
+def event_lifecycles(
+    count: int, concurrent: int, updates: int, seed: int
+) -> Iterator[Dict[str, Any]]:
+    """Payloads of count messages from interleaved Frigate event lifecycles.
+
+    Each event starts with a new message, gets up to updates update messages,
+    some with a fresh snapshot, and ends with an end message. concurrent
+    events are active at once."""
+    rng = random.Random(seed)
+    active: List[Dict[str, Any]] = []
+    sent = 0
+    started = 0
+    while sent < count:
+        while len(active) < concurrent:
+            now = time.time()
+            active.append(
+                {
+                    "id": f"{now:.6f}-{started:06d}",
+                    "camera": rng.choice(CAMERAS),
+                    "label": rng.choice(LABELS),
+                    "start_time": now,
+                    "frame_time": now,
+                    "snapshot_time": now,
+                    "score": round(rng.uniform(0.6, 0.9), 3),
+                    "box": [100, 100, 300, 500],
+                    "region": [0, 0, 640, 640],
+                    "has_snapshot": True,
+                    "updates": rng.randint(0, updates),
+                    "type": "new",
+                }
+            )
+            started += 1
+        event = active[rng.randrange(len(active))]
+        before = {k: v for k, v in event.items() if k not in ("updates", "type")}
+        message_type = event["type"]
+        if message_type == "end":
+            active.remove(event)
+            event["end_time"] = time.time()
+        elif event["updates"] == 0:
+            event["type"] = "end"
+        else:
+            event["type"] = "update"
+            event["updates"] -= 1
+        after = {k: v for k, v in event.items() if k not in ("updates", "type")}
+        yield {"type": message_type, "before": before, "after": after}
+        sent += 1
+        event["frame_time"] = time.time()
+        if rng.random() < 0.3:
+            event["snapshot_time"] = event["frame_time"]
+            event["score"] = round(min(1.0, event["score"] + 0.02), 3)
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if len(values) == 0:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+async def start_exhook(
+    config: Config, threads: int, session: aiohttp.ClientSession
+) -> Tuple[g_aio.Server, CPAIProcess, str]:
+    server = g_aio.server(
+        futures.ThreadPoolExecutor(max_workers=threads),
+        interceptors=[MetricsInterceptor()],
+    )
+    cpai = CPAIProcess(config, session)
+    cpai.start()
+    add_HookProviderServicer_to_server(HookProvider(cpai=cpai), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    return server, cpai, f"127.0.0.1:{port}"
+
+
+async def generate_load(
+    target: str, payloads: List[bytes], rate: float, deadline: float
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    responses: Dict[str, int] = {}
+    errors: Dict[str, int] = {}
+
+    async with g_aio.insecure_channel(target) as channel:
+        stub = HookProviderStub(channel)
+
+        async def publish(payload: bytes) -> None:
+            start = time.perf_counter()
+            try:
+                response = await stub.OnMessagePublish(
+                    MessagePublishRequest(
+                        message=Message(topic=TOPIC, payload=payload)
+                    ),
+                    timeout=deadline,
+                )
+            except grpc.RpcError as exc:
+                code = exc.code().name if hasattr(exc, "code") else "UNKNOWN"
+                errors[code] = errors.get(code, 0) + 1
+                return
+            latencies.append(time.perf_counter() - start)
+            name = ValuedResponse.ResponsedType.Name(response.type)
+            responses[name] = responses.get(name, 0) + 1
+
+        tasks = []
+        start = time.perf_counter()
+        for n, payload in enumerate(payloads):
+            delay = start + n / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(publish(payload)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "messages": len(payloads),
+        "rate": rate,
+        "elapsed": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 2),
+        "p50": round(percentile(latencies, 50), 4),
+        "p95": round(percentile(latencies, 95), 4),
+        "p99": round(percentile(latencies, 99), 4),
+        "max": round(latencies[-1] if len(latencies) > 0 else 0.0, 4),
+        "responses": responses,
+        "errors": errors,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float):
+    """Lines describing report against baseline, and whether it regressed."""
+    lines = []
+    regressed = False
+    for key, direction in COMPARED.items():
+        old, new = baseline.get(key, None), report[key]
+        if old is None or old == 0:
+            continue
+        change = (new - old) / old
+        worse = change * direction > tolerance
+        regressed |= worse
+        lines.append(
+            f"{key:>10} {old:>10} -> {new:<10} {change:+.1%}"
+            + ("  REGRESSION" if worse else "")
+        )
+    return lines, regressed
+
+
+@click.command()
+@click.option("--rate", default=50.0, show_default=True, help="Messages per second")
+@click.option("--duration", default=10.0, show_default=True, help="Seconds of load")
+@click.option("--events", default=8, show_default=True, help="Concurrent events")
+@click.option("--updates", default=6, show_default=True, help="Max updates per event")
+@click.option("--servers", default=1, show_default=True)
+@click.option("--threads", default=10, show_default=True)
+@click.option("--deadline", default=5.0, show_default=True, help="gRPC timeout")
+@click.option("--frigate-latency", default="uniform:0.01,0.03", show_default=True)
+@click.option("--cpai-latency", default="lognormal:0.05,0.5", show_default=True)
+@click.option("--upstream-port", default=18080, show_default=True)
+@click.option("--target", default=None, help="host:port of an exhook to load")
+@click.option("--seed", default=0, show_default=True)
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False))
+@click.option("--save-baseline", type=click.Path(dir_okay=False))
+@click.option("--tolerance", default=0.1, show_default=True)
+@click.option("--json", "as_json", is_flag=True, help="Print the report as JSON")
+def main(
+    rate: float,
+    duration: float,
+    events: int,
+    updates: int,
+    servers: int,
+    threads: int,
+    deadline: float,
+    frigate_latency: str,
+    cpai_latency: str,
+    upstream_port: int,
+    target: Optional[str],
+    seed: int,
+    baseline: Optional[str],
+    save_baseline: Optional[str],
+    tolerance: float,
+    as_json: bool,
+):
+    rng = random.Random(seed)
+    upstream = Upstream(
+        Latency(frigate_latency, rng), Latency(cpai_latency, rng), seed=seed
+    )
+    payloads = [
+        json.dumps(payload).encode("utf-8")
+        for payload in event_lifecycles(int(rate * duration), events, updates, seed)
+    ]
+
+    async def run() -> Dict[str, Any]:
+        runner = await start_upstream(upstream, "127.0.0.1", upstream_port)
+        exhook = None
+        session = aiohttp.ClientSession()
+        try:
+            address = target
+            if address is None:
+                exhook = await start_exhook(
+                    benchmark_config("127.0.0.1", upstream_port, servers),
+                    threads,
+                    session,
+                )
+                address = exhook[2]
+            report = await generate_load(address, payloads, rate, deadline)
+            if exhook is not None:
+                # Let queued write-back finish so its calls are counted.
+                await exhook[1].close(timeout=5)
+        finally:
+            if exhook is not None:
+                await exhook[0].stop(None)
+            await session.close()
+            await runner.cleanup()
+        report["upstream_calls"] = dict(sorted(upstream.calls.items()))
+        report["config"] = {
+            "events": events,
+            "updates": updates,
+            "servers": servers,
+            "frigate_latency": frigate_latency,
+            "cpai_latency": cpai_latency,
+        }
+        return report
+
+    report = asyncio.run(run())
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+    else:
+        click.echo(
+            f"{report['messages']} messages in {report['elapsed']}s: "
+            f"{report['throughput']} msg/s (offered {rate})"
+        )
+        click.echo(
+            f"hook latency p50 {report['p50']}s p95 {report['p95']}s "
+            f"p99 {report['p99']}s max {report['max']}s"
+        )
+        click.echo(f"responses {report['responses']} errors {report['errors']}")
+        click.echo(f"upstream calls {report['upstream_calls']}")
+    if save_baseline is not None:
+        with open(save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    if baseline is not None:
+        with open(baseline, "r") as f:
+            lines, regressed = compare(report, json.load(f), tolerance)
+        click.echo("\n".join(lines))
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
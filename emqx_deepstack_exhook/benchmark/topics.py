@@ -0,0 +1,107 @@
+"""Micro-benchmark of topic matching: regex scan vs. subscription trie."""
+
+import random
+import re
+import timeit
+from typing import List
+
+import click
+
+from emqx_deepstack_exhook.topic import TopicTrie
+
+CAMERAS = 16
+LABELS = ["person", "car", "dog", "cat", "bicycle", "package"]
+
+
+class RegexSubscription:
+    """Reference matcher the trie replaced: one anchored regex per topic
+    filter, scanned in turn."""
+
+    def __init__(self, subscribe: str) -> None:
+        self.subscribe = subscribe
+        self.pattern = re.compile(
+            "^%s$"
+            % subscribe.replace("/", r"\/")
+            .replace("+", r"[^\/]+?")
+            .replace("#", r".+")
+        )
+
+    def matches(self, topic: str) -> bool:
+        if topic is None or len(topic.strip()) == 0:
+            return False
+        if self.subscribe == topic:
+            return True
+        if topic[0] == "$" and self.subscribe[0] in ("+", "#"):
+            return False
+        return self.pattern.match(topic) is not None
+
+
+def subscriptions(count: int) -> List[RegexSubscription]:
+    rng = random.Random(count)
+    shapes = [
+        "frigate/events",
+        "frigate/{camera}/{label}",
+        "frigate/{camera}/+/snapshot",
+        "frigate/{camera}/#",
+        "frigate/+/{label}/snapshot",
+        "site{n}/frigate/{camera}/{label}",
+    ]
+    return [
+        RegexSubscription(
+            rng.choice(shapes).format(
+                n=n,
+                camera=f"camera{rng.randrange(CAMERAS)}",
+                label=rng.choice(LABELS),
+            )
+        )
+        for n in range(count)
+    ]
+
+
+def published_topics(count: int) -> List[str]:
+    rng = random.Random(-count)
+    return [
+        rng.choice(
+            [
+                "frigate/events",
+                f"frigate/camera{rng.randrange(CAMERAS)}/{rng.choice(LABELS)}",
+                f"frigate/camera{rng.randrange(CAMERAS)}/{rng.choice(LABELS)}/snapshot",
+                f"site{rng.randrange(count)}/frigate/camera0/person",
+            ]
+        )
+        for _ in range(256)
+    ]
+
+
+@click.command()
+@click.option("--sizes", default="10,100,1000", show_default=True)
+@click.option("--repeat", default=5, show_default=True)
+def main(sizes: str, repeat: int):
+    click.echo(f"{'subscriptions':>13} {'regex us/op':>12} {'trie us/op':>11} speedup")
+    for size in [int(s) for s in sizes.split(",")]:
+        topics = subscriptions(size)
+        trie: TopicTrie[RegexSubscription] = TopicTrie()
+        for t in topics:
+            trie.insert(t.subscribe, t)
+        published = published_topics(size)
+
+        def scan():
+            for p in published:
+                [t for t in topics if t.matches(p)]
+
+        def lookup():
+            for p in published:
+                trie.match(p)
+
+        for p in published:
+            assert [t for t in topics if t.matches(p)] == trie.match(p)
+
+        number = max(1, 2000 // size)
+        ops = number * len(published)
+        regex = min(timeit.repeat(scan, number=number, repeat=repeat)) / ops * 1e6
+        trie_t = min(timeit.repeat(lookup, number=number, repeat=repeat)) / ops * 1e6
+        click.echo(f"{size:>13} {regex:>12.2f} {trie_t:>11.2f} {regex / trie_t:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
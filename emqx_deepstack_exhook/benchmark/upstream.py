@@ -0,0 +1,217 @@
+"""Local stand-ins for Frigate and CodeProject.AI.
+
+Both are served by one aiohttp app so the exhook can be pointed at it for
+frigate and for every CodeProject.AI server. Each upstream call sleeps for a
+sample of a configurable latency distribution before answering. Run it on
+its own with python -m emqx_deepstack_exhook.benchmark.upstream."""
+
+import asyncio
+import io
+import json
+import random
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import click
+from aiohttp import web
+from PIL import Image
+
+SNAPSHOT_SIZE = (1280, 720)
+CAMERAS = ["driveway", "doorbell", "backyard", "garage"]
+NAMES = ["alice", "bob", "carol", "unknown"]
+
+
+class Latency:
+    """Latency distribution parsed from a spec string.
+
+    - fixed:SECONDS
+    - uniform:LOW,HIGH
+    - exponential:MEAN
+    - lognormal:MEDIAN,SIGMA
+
+    A bare number is a fixed latency."""
+
+    def __init__(self, spec: str, rng: Optional[random.Random] = None) -> None:
+        self.spec = spec
+        self._rng = rng or random.Random()
+        kind, _, args = spec.partition(":")
+        if args == "":
+            kind, args = "fixed", kind
+        self.kind = kind
+        try:
+            self.args = [float(arg) for arg in args.split(",")]
+        except ValueError as exc:
+            raise ValueError(f"Invalid latency {spec}") from exc
+        expected = {"fixed": 1, "uniform": 2, "exponential": 1, "lognormal": 2}
+        if expected.get(kind, None) != len(self.args):
+            raise ValueError(f"Invalid latency {spec}")
+
+    def __repr__(self) -> str:
+        return f"Latency({self.spec!r})"
+
+    def sample(self) -> float:
+        if self.kind == "uniform":
+            return self._rng.uniform(*self.args)
+        if self.kind == "exponential":
+            return self._rng.expovariate(1.0 / self.args[0])
+        if self.kind == "lognormal":
+            median, sigma = self.args
+            return median * self._rng.lognormvariate(0.0, sigma)
+        return self.args[0]
+
+
+def snapshot_jpeg(size=SNAPSHOT_SIZE, quality: int = 85) -> bytes:
+    """A noisy JPEG roughly the size of a Frigate snapshot."""
+    rng = random.Random(0)
+    image = Image.effect_noise(size, 64).convert("RGB")
+    image.paste((rng.randrange(256), 64, 64), (0, 0, size[0] // 4, size[1] // 4))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class Upstream:
+    """Frigate and CodeProject.AI stand-ins with per-endpoint call counts."""
+
+    def __init__(
+        self,
+        frigate_latency: Latency,
+        cpai_latency: Latency,
+        detections: int = 2,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.frigate_latency = frigate_latency
+        self.cpai_latency = cpai_latency
+        self.detections = detections
+        self.calls: Counter = Counter()
+        self.sub_labels: Dict[str, Dict[str, Any]] = {}
+        self.snapshot = snapshot_jpeg()
+        # Snapshots scaled or re-encoded as asked by query parameters.
+        self._snapshots: Dict[Tuple[int, int], bytes] = {}
+        self._rng = random.Random(seed)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_get("/api/config", self.get_config)
+        app.router.add_get("/api/events/{id}/snapshot.jpg", self.get_snapshot)
+        app.router.add_post("/api/events/{id}/sub_label", self.set_sub_label)
+        app.router.add_post("/v1/vision/detection", self.detect)
+        app.router.add_post("/v1/vision/custom/{model}", self.detect)
+        app.router.add_post("/v1/vision/face", self.detect_faces)
+        app.router.add_post("/v1/vision/face/recognize", self.recognize_faces)
+        app.router.add_get("/v1/server/status/ping", self.ping)
+        return app
+
+    def reset(self) -> None:
+        self.calls.clear()
+        self.sub_labels.clear()
+
+    async def get_config(self, request: web.Request) -> web.Response:
+        self.calls["config"] += 1
+        width, height = SNAPSHOT_SIZE
+        return web.json_response(
+            {
+                "cameras": {
+                    camera: {"detect": {"width": width, "height": height}}
+                    for camera in CAMERAS
+                }
+            }
+        )
+
+    async def get_snapshot(self, request: web.Request) -> web.Response:
+        """The snapshot, scaled to h and encoded at quality like Frigate's."""
+        self.calls["snapshot"] += 1
+        await asyncio.sleep(self.frigate_latency.sample())
+        height = int(request.query.get("h", SNAPSHOT_SIZE[1]))
+        quality = int(request.query.get("quality", 0))
+        if height == SNAPSHOT_SIZE[1] and quality == 0:
+            return web.Response(body=self.snapshot, content_type="image/jpeg")
+        key = (height, quality)
+        if key not in self._snapshots:
+            width = round(SNAPSHOT_SIZE[0] * height / SNAPSHOT_SIZE[1])
+            self._snapshots[key] = snapshot_jpeg((width, height), quality or 70)
+        return web.Response(body=self._snapshots[key], content_type="image/jpeg")
+
+    async def set_sub_label(self, request: web.Request) -> web.Response:
+        self.calls["sub_label"] += 1
+        self.sub_labels[request.match_info["id"]] = await request.json()
+        await asyncio.sleep(self.frigate_latency.sample())
+        return web.json_response({"success": True})
+
+    async def detect(self, request: web.Request) -> web.Response:
+        return await self._vision(request, "detect", lambda: {"label": "car"})
+
+    async def detect_faces(self, request: web.Request) -> web.Response:
+        return await self._vision(request, "face", lambda: {})
+
+    async def recognize_faces(self, request: web.Request) -> web.Response:
+        return await self._vision(
+            request, "recognize", lambda: {"userid": self._rng.choice(NAMES)}
+        )
+
+    async def ping(self, request: web.Request) -> web.Response:
+        self.calls["ping"] += 1
+        return web.json_response({"success": True})
+
+    async def _vision(self, request: web.Request, endpoint: str, extra) -> web.Response:
+        self.calls[endpoint] += 1
+        await request.read()
+        await asyncio.sleep(self.cpai_latency.sample())
+        return web.json_response(
+            {"success": True, "predictions": self._predictions(extra)}
+        )
+
+    def _predictions(self, extra) -> List[Dict[str, Any]]:
+        predictions = []
+        for _ in range(self._rng.randint(0, self.detections)):
+            x, y = self._rng.randrange(0, 1000), self._rng.randrange(0, 500)
+            predictions.append(
+                {
+                    "confidence": round(self._rng.uniform(0.5, 1.0), 3),
+                    "x_min": x,
+                    "y_min": y,
+                    "x_max": x + 120,
+                    "y_max": y + 160,
+                    **extra(),
+                }
+            )
+        return predictions
+
+
+async def start_upstream(upstream: Upstream, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(upstream.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=18080, show_default=True)
+@click.option("--frigate-latency", default="uniform:0.01,0.03", show_default=True)
+@click.option("--cpai-latency", default="lognormal:0.05,0.5", show_default=True)
+@click.option("--seed", type=int, default=None)
+def main(host: str, port: int, frigate_latency: str, cpai_latency: str, seed):
+    rng = random.Random(seed)
+    upstream = Upstream(
+        Latency(frigate_latency, rng), Latency(cpai_latency, rng), seed=seed
+    )
+
+    async def run():
+        runner = await start_upstream(upstream, host, port)
+        click.echo(f"Serving Frigate and CodeProject.AI stand-ins on {host}:{port}")
+        try:
+            while True:
+                await asyncio.sleep(10)
+                click.echo(json.dumps(dict(upstream.calls)))
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
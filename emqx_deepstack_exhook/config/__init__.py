@@ -2,30 +2,137 @@ from dataclasses import dataclass
 from typing import Any, Dict, List, Optional
 
 from emqx_deepstack_exhook.config.const import (
+    ATTR_ADMISSION,
+    ATTR_ADMISSION_MAX_CONCURRENT,
+    ATTR_ADMISSION_MAX_QUEUE,
+    ATTR_ADMISSION_POLICY,
+    ATTR_ADMISSION_QUEUE_TIMEOUT,
     ATTR_BIND,
+    ATTR_CIRCUIT_BREAKER,
+    ATTR_CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    ATTR_CIRCUIT_BREAKER_RESET_TIMEOUT,
+    ATTR_CROP_PADDING,
+    ATTR_CROP_TO,
+    ATTR_DEFERRED_TIMEOUT,
     ATTR_FRIGATE,
+    ATTR_IMAGE_WORKERS,
+    ATTR_METRICS,
+    ATTR_MQTT,
+    ATTR_MQTT_HOST,
+    ATTR_MQTT_PASSWORD,
+    ATTR_MQTT_PORT,
+    ATTR_MQTT_SNAPSHOTS,
+    ATTR_MQTT_SNAPSHOTS_MAX_AGE,
+    ATTR_MQTT_SNAPSHOTS_MAX_ENTRIES,
+    ATTR_MQTT_SNAPSHOTS_TOPIC_PREFIX,
+    ATTR_MQTT_USERNAME,
+    ATTR_PIPELINE_CROP,
+    ATTR_PIPELINE_DEPENDS_ON,
     ATTR_PIPELINE_FILTER,
     ATTR_PIPELINE_MODEL,
     ATTR_PIPELINE_RESULT_TOPIC,
     ATTR_PIPELINE_SERVER,
+    ATTR_PIPELINE_SNAPSHOT,
     ATTR_PIPELINE_THRESHOLD,
+    ATTR_PIPELINE_THUMBNAIL,
+    ATTR_PIPELINE_TRANSFORM,
     ATTR_PIPELINE_TYPE,
     ATTR_PIPELINES,
+    ATTR_POOL_HEALTH_CHECK_INTERVAL,
+    ATTR_POOL_SERVERS,
+    ATTR_POOL_STRATEGY,
+    ATTR_POOLS,
     ATTR_SERVER_HOST,
     ATTR_SERVER_PORT,
     ATTR_SERVERS,
+    ATTR_SNAPSHOT_BBOX,
+    ATTR_SNAPSHOT_CACHE,
+    ATTR_SNAPSHOT_CACHE_MAX_BYTES,
+    ATTR_SNAPSHOT_CACHE_TTL,
+    ATTR_SNAPSHOT_HEIGHT,
+    ATTR_SNAPSHOT_QUALITY,
+    ATTR_SNAPSHOT_TIMESTAMP,
     ATTR_THREADS,
+    ATTR_THUMBNAIL_ACCEPT,
+    ATTR_THUMBNAIL_REJECT,
     ATTR_TOPIC_FILTER,
+    ATTR_TOPIC_LATENCY_BUDGET,
     ATTR_TOPIC_PIPELINE,
     ATTR_TOPIC_TOPIC,
     ATTR_TOPICS,
+    ATTR_TRANSFORM_GRAYSCALE,
+    ATTR_TRANSFORM_MAX_SIZE,
+    ATTR_TRANSFORM_QUALITY,
+    ATTR_WRITE_BACK,
+    ATTR_WRITE_BACK_BACKOFF,
+    ATTR_WRITE_BACK_MAX_PENDING,
+    ATTR_WRITE_BACK_MAX_RETRIES,
 )
 
 
+@dataclass
+class AdmissionConfig:
+    @classmethod
+    def load(cls, config: Dict[str, Any]) -> "AdmissionConfig":
+        return AdmissionConfig(
+            max_concurrent=config.get(ATTR_ADMISSION_MAX_CONCURRENT, None),
+            max_queue=config[ATTR_ADMISSION_MAX_QUEUE],
+            queue_timeout=config.get(ATTR_ADMISSION_QUEUE_TIMEOUT, None),
+            policy=config[ATTR_ADMISSION_POLICY],
+        )
+
+    max_concurrent: Optional[int]
+    max_queue: int
+    queue_timeout: Optional[float]
+    policy: str
+
+
 @dataclass
 class ServerConfig:
     host: str
     port: int
+    admission: AdmissionConfig
+
+
+@dataclass
+class MqttConfig:
+    host: str
+    port: int
+    username: Optional[str]
+    password: Optional[str]
+
+
+@dataclass
+class MqttSnapshotsConfig:
+    topic_prefix: str
+    max_age: float
+    max_entries: int
+
+
+@dataclass
+class SnapshotCacheConfig:
+    max_bytes: int
+    ttl: float
+
+
+@dataclass
+class WriteBackConfig:
+    max_pending: int
+    max_retries: int
+    backoff: float
+
+
+@dataclass
+class PoolConfig:
+    servers: List[str]
+    strategy: str
+    health_check_interval: float
+
+
+@dataclass
+class CircuitBreakerConfig:
+    failure_threshold: int
+    reset_timeout: float
 
 
 @dataclass
@@ -33,6 +140,62 @@ class TopicConfig:
     subscribe: str
     pipelines: List[str]
     filter: Optional[str]
+    latency_budget: Optional[float]
+
+
+@dataclass
+class CropConfig:
+    @classmethod
+    def load(cls, config: Dict[str, Any]) -> "CropConfig":
+        return CropConfig(to=config[ATTR_CROP_TO], padding=config[ATTR_CROP_PADDING])
+
+    to: str
+    padding: float
+
+
+@dataclass
+class TransformConfig:
+    @classmethod
+    def load(cls, config: Dict[str, Any]) -> "TransformConfig":
+        return TransformConfig(
+            max_size=config.get(ATTR_TRANSFORM_MAX_SIZE, None),
+            quality=config[ATTR_TRANSFORM_QUALITY],
+            grayscale=config[ATTR_TRANSFORM_GRAYSCALE],
+        )
+
+    max_size: Optional[int]
+    quality: int
+    grayscale: bool
+
+
+@dataclass
+class SnapshotConfig:
+    @classmethod
+    def load(cls, config: Dict[str, Any]) -> "SnapshotConfig":
+        return SnapshotConfig(
+            height=config.get(ATTR_SNAPSHOT_HEIGHT, None),
+            quality=config.get(ATTR_SNAPSHOT_QUALITY, None),
+            bbox=config[ATTR_SNAPSHOT_BBOX],
+            timestamp=config[ATTR_SNAPSHOT_TIMESTAMP],
+        )
+
+    height: Optional[int]
+    quality: Optional[int]
+    bbox: bool
+    timestamp: bool
+
+
+@dataclass
+class ThumbnailConfig:
+    @classmethod
+    def load(cls, config: Dict[str, Any]) -> "ThumbnailConfig":
+        return ThumbnailConfig(
+            accept=config[ATTR_THUMBNAIL_ACCEPT],
+            reject=config.get(ATTR_THUMBNAIL_REJECT, None),
+        )
+
+    accept: float
+    reject: Optional[float]
 
 
 @dataclass
@@ -43,6 +206,12 @@ class PipelineConfig:
     threshold: float
     result_topic: Optional[str]
     filter: Optional[str]
+    depends_on: List[str]
+    admission: AdmissionConfig
+    crop: Optional[CropConfig] = None
+    transform: Optional[TransformConfig] = None
+    snapshot: Optional[SnapshotConfig] = None
+    thumbnail: Optional[ThumbnailConfig] = None
 
 
 @dataclass
@@ -52,12 +221,23 @@ class Config:
         return Config(
             bind_address=config[ATTR_BIND],
             threads=config[ATTR_THREADS],
+            image_workers=config[ATTR_IMAGE_WORKERS],
             servers={
                 key: ServerConfig(
-                    host=value[ATTR_SERVER_HOST], port=value[ATTR_SERVER_PORT]
+                    host=value[ATTR_SERVER_HOST],
+                    port=value[ATTR_SERVER_PORT],
+                    admission=AdmissionConfig.load(value[ATTR_ADMISSION]),
                 )
                 for key, value in config[ATTR_SERVERS].items()
             },
+            pools={
+                key: PoolConfig(
+                    servers=value[ATTR_POOL_SERVERS],
+                    strategy=value[ATTR_POOL_STRATEGY],
+                    health_check_interval=value[ATTR_POOL_HEALTH_CHECK_INTERVAL],
+                )
+                for key, value in config.get(ATTR_POOLS, {}).items()
+            },
             pipelines={
                 key: PipelineConfig(
                     server=value[ATTR_PIPELINE_SERVER],
@@ -66,6 +246,28 @@ class Config:
                     threshold=value[ATTR_PIPELINE_THRESHOLD],
                     result_topic=value.get(ATTR_PIPELINE_RESULT_TOPIC, None),
                     filter=value.get(ATTR_PIPELINE_FILTER, None),
+                    depends_on=value.get(ATTR_PIPELINE_DEPENDS_ON, []),
+                    admission=AdmissionConfig.load(value[ATTR_ADMISSION]),
+                    crop=(
+                        CropConfig.load(value[ATTR_PIPELINE_CROP])
+                        if ATTR_PIPELINE_CROP in value
+                        else None
+                    ),
+                    transform=(
+                        TransformConfig.load(value[ATTR_PIPELINE_TRANSFORM])
+                        if ATTR_PIPELINE_TRANSFORM in value
+                        else None
+                    ),
+                    snapshot=(
+                        SnapshotConfig.load(value[ATTR_PIPELINE_SNAPSHOT])
+                        if ATTR_PIPELINE_SNAPSHOT in value
+                        else None
+                    ),
+                    thumbnail=(
+                        ThumbnailConfig.load(value[ATTR_PIPELINE_THUMBNAIL])
+                        if ATTR_PIPELINE_THUMBNAIL in value
+                        else None
+                    ),
                 )
                 for key, value in config[ATTR_PIPELINES].items()
             },
@@ -74,15 +276,67 @@ class Config:
                     subscribe=topic[ATTR_TOPIC_TOPIC],
                     pipelines=topic[ATTR_TOPIC_PIPELINE],
                     filter=topic.get(ATTR_TOPIC_FILTER, None),
+                    latency_budget=topic.get(ATTR_TOPIC_LATENCY_BUDGET, None),
                 )
                 for topic in config[ATTR_TOPICS]
             ],
             frigate=config[ATTR_FRIGATE],
+            mqtt=(
+                MqttConfig(
+                    host=config[ATTR_MQTT][ATTR_MQTT_HOST],
+                    port=config[ATTR_MQTT][ATTR_MQTT_PORT],
+                    username=config[ATTR_MQTT].get(ATTR_MQTT_USERNAME, None),
+                    password=config[ATTR_MQTT].get(ATTR_MQTT_PASSWORD, None),
+                )
+                if ATTR_MQTT in config
+                else None
+            ),
+            mqtt_snapshots=(
+                MqttSnapshotsConfig(
+                    topic_prefix=config[ATTR_MQTT_SNAPSHOTS][
+                        ATTR_MQTT_SNAPSHOTS_TOPIC_PREFIX
+                    ],
+                    max_age=config[ATTR_MQTT_SNAPSHOTS][ATTR_MQTT_SNAPSHOTS_MAX_AGE],
+                    max_entries=config[ATTR_MQTT_SNAPSHOTS][
+                        ATTR_MQTT_SNAPSHOTS_MAX_ENTRIES
+                    ],
+                )
+                if ATTR_MQTT_SNAPSHOTS in config
+                else None
+            ),
+            metrics_address=config.get(ATTR_METRICS, None),
+            deferred_timeout=config[ATTR_DEFERRED_TIMEOUT],
+            circuit_breaker=CircuitBreakerConfig(
+                failure_threshold=config[ATTR_CIRCUIT_BREAKER][
+                    ATTR_CIRCUIT_BREAKER_FAILURE_THRESHOLD
+                ],
+                reset_timeout=config[ATTR_CIRCUIT_BREAKER][
+                    ATTR_CIRCUIT_BREAKER_RESET_TIMEOUT
+                ],
+            ),
+            write_back=WriteBackConfig(
+                max_pending=config[ATTR_WRITE_BACK][ATTR_WRITE_BACK_MAX_PENDING],
+                max_retries=config[ATTR_WRITE_BACK][ATTR_WRITE_BACK_MAX_RETRIES],
+                backoff=config[ATTR_WRITE_BACK][ATTR_WRITE_BACK_BACKOFF],
+            ),
+            snapshot_cache=SnapshotCacheConfig(
+                max_bytes=config[ATTR_SNAPSHOT_CACHE][ATTR_SNAPSHOT_CACHE_MAX_BYTES],
+                ttl=config[ATTR_SNAPSHOT_CACHE][ATTR_SNAPSHOT_CACHE_TTL],
+            ),
         )
 
     bind_address: str
     threads: int
     servers: Dict[str, ServerConfig]
+    pools: Dict[str, PoolConfig]
     pipelines: Dict[str, PipelineConfig]
     topics: List[TopicConfig]
     frigate: str
+    snapshot_cache: SnapshotCacheConfig
+    write_back: WriteBackConfig
+    circuit_breaker: CircuitBreakerConfig
+    image_workers: int
+    mqtt: Optional[MqttConfig] = None
+    mqtt_snapshots: Optional[MqttSnapshotsConfig] = None
+    metrics_address: Optional[str] = None
+    deferred_timeout: float = 30.0
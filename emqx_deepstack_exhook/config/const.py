@@ -8,10 +8,58 @@ ATTR_FRIGATE_PORT = "port"
 
 ATTR_THREADS = "threads"
 
+ATTR_IMAGE_WORKERS = "image_workers"
+
+ATTR_METRICS = "metrics"
+
+ATTR_DEFERRED_TIMEOUT = "deferred_timeout"
+
+ATTR_SNAPSHOT_CACHE = "snapshot_cache"
+ATTR_SNAPSHOT_CACHE_MAX_BYTES = "max_bytes"
+ATTR_SNAPSHOT_CACHE_TTL = "ttl"
+
+ATTR_WRITE_BACK = "write_back"
+ATTR_WRITE_BACK_MAX_PENDING = "max_pending"
+ATTR_WRITE_BACK_MAX_RETRIES = "max_retries"
+ATTR_WRITE_BACK_BACKOFF = "backoff"
+
+ATTR_CIRCUIT_BREAKER = "circuit_breaker"
+ATTR_CIRCUIT_BREAKER_FAILURE_THRESHOLD = "failure_threshold"
+ATTR_CIRCUIT_BREAKER_RESET_TIMEOUT = "reset_timeout"
+
+ATTR_ADMISSION = "admission"
+ATTR_ADMISSION_MAX_CONCURRENT = "max_concurrent"
+ATTR_ADMISSION_MAX_QUEUE = "max_queue"
+ATTR_ADMISSION_QUEUE_TIMEOUT = "queue_timeout"
+ATTR_ADMISSION_POLICY = "policy"
+
+SHED_DROP_NEWEST = "drop_newest"
+SHED_DROP_OLDEST = "drop_oldest"
+SHED_PASS_THROUGH = "pass_through"
+
+ATTR_MQTT = "mqtt"
+ATTR_MQTT_HOST = "host"
+ATTR_MQTT_PORT = "port"
+ATTR_MQTT_USERNAME = "username"
+ATTR_MQTT_PASSWORD = "password"
+
+ATTR_MQTT_SNAPSHOTS = "mqtt_snapshots"
+ATTR_MQTT_SNAPSHOTS_TOPIC_PREFIX = "topic_prefix"
+ATTR_MQTT_SNAPSHOTS_MAX_AGE = "max_age"
+ATTR_MQTT_SNAPSHOTS_MAX_ENTRIES = "max_entries"
+
 ATTR_SERVERS = "servers"
 ATTR_SERVER_HOST = "host"
 ATTR_SERVER_PORT = "port"
 
+ATTR_POOLS = "pools"
+ATTR_POOL_SERVERS = "servers"
+ATTR_POOL_STRATEGY = "strategy"
+ATTR_POOL_HEALTH_CHECK_INTERVAL = "health_check_interval"
+
+POOL_LEAST_OUTSTANDING = "least_outstanding"
+POOL_LATENCY_WEIGHTED = "latency_weighted"
+
 ATTR_PIPELINES = "pipelines"
 ATTR_PIPELINE_SERVER = "server"
 ATTR_PIPELINE_MODEL = "model"
@@ -19,6 +67,28 @@ ATTR_PIPELINE_THRESHOLD = "threshold"
 ATTR_PIPELINE_RESULT_TOPIC = "result_topic"
 ATTR_PIPELINE_FILTER = "filter"
 ATTR_PIPELINE_TYPE = "type"
+ATTR_PIPELINE_DEPENDS_ON = "depends_on"
+ATTR_PIPELINE_CROP = "crop"
+ATTR_CROP_TO = "to"
+ATTR_CROP_PADDING = "padding"
+
+ATTR_PIPELINE_TRANSFORM = "transform"
+ATTR_TRANSFORM_MAX_SIZE = "max_size"
+ATTR_TRANSFORM_QUALITY = "quality"
+ATTR_TRANSFORM_GRAYSCALE = "grayscale"
+
+ATTR_PIPELINE_SNAPSHOT = "snapshot"
+ATTR_SNAPSHOT_HEIGHT = "height"
+ATTR_SNAPSHOT_QUALITY = "quality"
+ATTR_SNAPSHOT_BBOX = "bbox"
+ATTR_SNAPSHOT_TIMESTAMP = "timestamp"
+
+ATTR_PIPELINE_THUMBNAIL = "thumbnail"
+ATTR_THUMBNAIL_ACCEPT = "accept"
+ATTR_THUMBNAIL_REJECT = "reject"
+
+CROP_BOX = "box"
+CROP_REGION = "region"
 
 PIPELINE_FACE_DETECT = "face_detect"
 PIPELINE_FACE_RECOGNIZE = "face_recognize"
@@ -29,3 +99,4 @@ ATTR_TOPICS = "topics"
 ATTR_TOPIC_TOPIC = "subscribe"
 ATTR_TOPIC_PIPELINE = "pipeline"
 ATTR_TOPIC_FILTER = "filter"
+ATTR_TOPIC_LATENCY_BUDGET = "latency_budget"
@@ -1,21 +1,48 @@
-from typing import Any, Dict
+from typing import Any, Dict, Set
 import voluptuous as vol
 
 from emqx_deepstack_exhook.config.const import (
+    ATTR_ADMISSION,
+    ATTR_ADMISSION_MAX_CONCURRENT,
+    ATTR_ADMISSION_MAX_QUEUE,
+    ATTR_ADMISSION_POLICY,
+    ATTR_ADMISSION_QUEUE_TIMEOUT,
     ATTR_BIND,
     ATTR_BIND_IP,
     ATTR_BIND_PORT,
+    ATTR_CROP_PADDING,
+    ATTR_CROP_TO,
+    ATTR_DEFERRED_TIMEOUT,
+    ATTR_IMAGE_WORKERS,
+    ATTR_PIPELINE_CROP,
+    ATTR_PIPELINE_SNAPSHOT,
+    ATTR_PIPELINE_TRANSFORM,
+    ATTR_SNAPSHOT_BBOX,
+    ATTR_SNAPSHOT_HEIGHT,
+    ATTR_SNAPSHOT_QUALITY,
+    ATTR_SNAPSHOT_TIMESTAMP,
+    ATTR_TRANSFORM_GRAYSCALE,
+    ATTR_TRANSFORM_MAX_SIZE,
+    ATTR_TRANSFORM_QUALITY,
+    ATTR_PIPELINE_DEPENDS_ON,
     ATTR_PIPELINE_FILTER,
     ATTR_PIPELINE_SERVER,
     ATTR_PIPELINE_MODEL,
     ATTR_PIPELINE_THRESHOLD,
+    ATTR_PIPELINE_THUMBNAIL,
     ATTR_PIPELINE_RESULT_TOPIC,
     ATTR_PIPELINE_TYPE,
     ATTR_PIPELINES,
+    ATTR_POOL_HEALTH_CHECK_INTERVAL,
+    ATTR_POOL_SERVERS,
+    ATTR_POOL_STRATEGY,
+    ATTR_POOLS,
     ATTR_SERVER_HOST,
     ATTR_SERVER_PORT,
     ATTR_SERVERS,
     ATTR_THREADS,
+    ATTR_THUMBNAIL_ACCEPT,
+    ATTR_THUMBNAIL_REJECT,
     ATTR_TOPIC_FILTER,
     ATTR_TOPIC_PIPELINE,
     ATTR_TOPIC_TOPIC,
@@ -23,10 +50,38 @@ from emqx_deepstack_exhook.config.const import (
     ATTR_FRIGATE_HOST,
     ATTR_FRIGATE_PORT,
     ATTR_FRIGATE,
+    ATTR_CIRCUIT_BREAKER,
+    ATTR_CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    ATTR_CIRCUIT_BREAKER_RESET_TIMEOUT,
+    ATTR_METRICS,
+    ATTR_MQTT,
+    ATTR_MQTT_HOST,
+    ATTR_MQTT_PASSWORD,
+    ATTR_MQTT_PORT,
+    ATTR_MQTT_SNAPSHOTS,
+    ATTR_MQTT_SNAPSHOTS_MAX_AGE,
+    ATTR_MQTT_SNAPSHOTS_MAX_ENTRIES,
+    ATTR_MQTT_SNAPSHOTS_TOPIC_PREFIX,
+    ATTR_MQTT_USERNAME,
+    ATTR_TOPIC_LATENCY_BUDGET,
+    ATTR_WRITE_BACK,
+    ATTR_WRITE_BACK_BACKOFF,
+    ATTR_WRITE_BACK_MAX_PENDING,
+    ATTR_WRITE_BACK_MAX_RETRIES,
+    ATTR_SNAPSHOT_CACHE,
+    ATTR_SNAPSHOT_CACHE_MAX_BYTES,
+    ATTR_SNAPSHOT_CACHE_TTL,
+    CROP_BOX,
+    CROP_REGION,
     PIPELINE_FACE_DETECT,
     PIPELINE_FACE_RECOGNIZE,
     PIPELINE_OBJECT,
     PIPELINE_VISION,
+    POOL_LATENCY_WEIGHTED,
+    POOL_LEAST_OUTSTANDING,
+    SHED_DROP_NEWEST,
+    SHED_DROP_OLDEST,
+    SHED_PASS_THROUGH,
 )
 from emqx_deepstack_exhook.config.validation import (
     ensure_list,
@@ -37,12 +92,15 @@ from emqx_deepstack_exhook.config.validation import (
     url_no_path,
     valid_subscribe_topic,
     small_float,
+    positive_float,
+    positive_int,
     fqdn,
     port,
     bind_address,
     threads,
     valid_topic,
 )
+from emqx_deepstack_exhook.topic import TopicTrie
 
 SCHEMA_FRIGATE_DICT = vol.Schema(
     {
@@ -66,11 +124,75 @@ def ensure_frigate(value: Any | None) -> str:
 SCHEMA_FRIGATE = ensure_frigate
 
 
+SCHEMA_ADMISSION = vol.Schema(
+    {
+        vol.Optional(ATTR_ADMISSION_MAX_CONCURRENT): positive_int,
+        vol.Optional(ATTR_ADMISSION_MAX_QUEUE, default=16): vol.All(
+            vol.Coerce(int), vol.Range(min=0)
+        ),
+        vol.Optional(ATTR_ADMISSION_QUEUE_TIMEOUT): positive_float,
+        vol.Optional(ATTR_ADMISSION_POLICY, default=SHED_DROP_NEWEST): vol.Or(
+            SHED_DROP_NEWEST, SHED_DROP_OLDEST, SHED_PASS_THROUGH
+        ),
+    }
+)
+
+SCHEMA_CROP = vol.Schema(
+    {
+        vol.Optional(ATTR_CROP_TO, default=CROP_BOX): vol.Or(CROP_BOX, CROP_REGION),
+        vol.Optional(ATTR_CROP_PADDING, default=0.25): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+    }
+)
+
+SCHEMA_TRANSFORM = vol.Schema(
+    {
+        vol.Optional(ATTR_TRANSFORM_MAX_SIZE): positive_int,
+        vol.Optional(ATTR_TRANSFORM_QUALITY, default=85): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=95)
+        ),
+        vol.Optional(ATTR_TRANSFORM_GRAYSCALE, default=False): vol.Boolean(),
+    }
+)
+
+SCHEMA_SNAPSHOT = vol.Schema(
+    {
+        vol.Optional(ATTR_SNAPSHOT_HEIGHT): positive_int,
+        vol.Optional(ATTR_SNAPSHOT_QUALITY): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=100)
+        ),
+        vol.Optional(ATTR_SNAPSHOT_BBOX, default=False): vol.Boolean(),
+        vol.Optional(ATTR_SNAPSHOT_TIMESTAMP, default=False): vol.Boolean(),
+    }
+)
+
+
+def validate_thumbnail(config: Dict[str, Any]) -> Dict[str, Any]:
+    reject = config.get(ATTR_THUMBNAIL_REJECT, None)
+    if reject is not None and reject > config[ATTR_THUMBNAIL_ACCEPT]:
+        raise vol.Invalid(
+            f"must not be above {ATTR_THUMBNAIL_ACCEPT}", path=[ATTR_THUMBNAIL_REJECT]
+        )
+    return config
+
+
+SCHEMA_THUMBNAIL = vol.All(
+    vol.Schema(
+        {
+            vol.Optional(ATTR_THUMBNAIL_ACCEPT, default=0.9): small_float,
+            vol.Optional(ATTR_THUMBNAIL_REJECT): small_float,
+        }
+    ),
+    validate_thumbnail,
+)
+
 SCHEMA_TOPIC = vol.Schema(
     {
         vol.Required(ATTR_TOPIC_TOPIC): valid_subscribe_topic,
         vol.Required(ATTR_TOPIC_PIPELINE): vol.All(ensure_list, [slugify]),
         vol.Optional(ATTR_TOPIC_FILTER): string,
+        vol.Optional(ATTR_TOPIC_LATENCY_BUDGET): positive_float,
     }
 )
 
@@ -84,13 +206,85 @@ SCHEMA_PIPELINE = vol.Schema(
         vol.Optional(ATTR_PIPELINE_THRESHOLD, default=0.7): small_float,
         vol.Optional(ATTR_PIPELINE_RESULT_TOPIC): valid_topic,
         vol.Optional(ATTR_PIPELINE_FILTER): string,
+        vol.Optional(ATTR_PIPELINE_DEPENDS_ON, default=[]): vol.All(
+            ensure_list, [slugify]
+        ),
+        vol.Optional(ATTR_ADMISSION, default={}): SCHEMA_ADMISSION,
+        vol.Optional(ATTR_PIPELINE_CROP): SCHEMA_CROP,
+        vol.Optional(ATTR_PIPELINE_TRANSFORM): SCHEMA_TRANSFORM,
+        vol.Optional(ATTR_PIPELINE_SNAPSHOT): SCHEMA_SNAPSHOT,
+        vol.Optional(ATTR_PIPELINE_THUMBNAIL): SCHEMA_THUMBNAIL,
     }
 )
 
+# Servers keep their concurrency cap when only some admission options are
+# given, as when just the policy is set.
+SCHEMA_SERVER_ADMISSION = SCHEMA_ADMISSION.extend(
+    {
+        vol.Optional(ATTR_ADMISSION_MAX_CONCURRENT, default=4): positive_int,
+        vol.Optional(ATTR_ADMISSION_QUEUE_TIMEOUT, default=5.0): positive_float,
+    }
+)
 SCHEMA_SERVER = vol.Schema(
     {
         vol.Required(ATTR_SERVER_HOST): vol.Or(ip_address, fqdn),
         vol.Required(ATTR_SERVER_PORT): port,
+        vol.Optional(ATTR_ADMISSION, default={}): SCHEMA_SERVER_ADMISSION,
+    }
+)
+
+SCHEMA_MQTT = vol.Schema(
+    {
+        vol.Required(ATTR_MQTT_HOST): vol.Or(ip_address, fqdn),
+        vol.Optional(ATTR_MQTT_PORT, default=1883): port,
+        vol.Inclusive(ATTR_MQTT_USERNAME, "credentials"): string,
+        vol.Inclusive(ATTR_MQTT_PASSWORD, "credentials"): string,
+    }
+)
+
+SCHEMA_MQTT_SNAPSHOTS = vol.Schema(
+    {
+        vol.Optional(ATTR_MQTT_SNAPSHOTS_TOPIC_PREFIX, default="frigate"): valid_topic,
+        vol.Optional(ATTR_MQTT_SNAPSHOTS_MAX_AGE, default=5.0): positive_float,
+        vol.Optional(ATTR_MQTT_SNAPSHOTS_MAX_ENTRIES, default=64): positive_int,
+    }
+)
+
+SCHEMA_SNAPSHOT_CACHE = vol.Schema(
+    {
+        vol.Optional(ATTR_SNAPSHOT_CACHE_MAX_BYTES, default=64 * 1024 * 1024): (
+            positive_int
+        ),
+        vol.Optional(ATTR_SNAPSHOT_CACHE_TTL, default=60.0): positive_float,
+    }
+)
+
+SCHEMA_WRITE_BACK = vol.Schema(
+    {
+        vol.Optional(ATTR_WRITE_BACK_MAX_PENDING, default=1000): positive_int,
+        vol.Optional(ATTR_WRITE_BACK_MAX_RETRIES, default=5): vol.All(
+            vol.Coerce(int), vol.Range(min=0)
+        ),
+        vol.Optional(ATTR_WRITE_BACK_BACKOFF, default=0.5): positive_float,
+    }
+)
+
+SCHEMA_POOL = vol.Schema(
+    {
+        vol.Required(ATTR_POOL_SERVERS): vol.All(
+            ensure_list, [slugify], vol.Length(min=1)
+        ),
+        vol.Optional(ATTR_POOL_STRATEGY, default=POOL_LEAST_OUTSTANDING): vol.Or(
+            POOL_LEAST_OUTSTANDING, POOL_LATENCY_WEIGHTED
+        ),
+        vol.Optional(ATTR_POOL_HEALTH_CHECK_INTERVAL, default=10.0): positive_float,
+    }
+)
+
+SCHEMA_CIRCUIT_BREAKER = vol.Schema(
+    {
+        vol.Optional(ATTR_CIRCUIT_BREAKER_FAILURE_THRESHOLD, default=5): positive_int,
+        vol.Optional(ATTR_CIRCUIT_BREAKER_RESET_TIMEOUT, default=30.0): positive_float,
     }
 )
 
@@ -112,15 +306,139 @@ def ensure_bind(value: Any | None) -> str:
 
 SCHEMA_BIND = ensure_bind
 
-SCHEMA_CONFIG = vol.Schema(
+
+def validate_servers(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Check that pools and pipelines only refer to known servers or pools."""
+    servers = config[ATTR_SERVERS]
+    pools = config.get(ATTR_POOLS, {})
+    shadowed = [name for name in pools if name in servers]
+    if len(shadowed) > 0:
+        raise vol.Invalid(
+            f"pool names must not match server names: {', '.join(shadowed)}",
+            path=[ATTR_POOLS],
+        )
+    for name, pool in pools.items():
+        for server in pool[ATTR_POOL_SERVERS]:
+            if server not in servers:
+                raise vol.Invalid(
+                    f"unknown server {server}",
+                    path=[ATTR_POOLS, name, ATTR_POOL_SERVERS],
+                )
+    for name, pipeline in config[ATTR_PIPELINES].items():
+        if (
+            pipeline[ATTR_PIPELINE_SERVER] not in servers
+            and pipeline[ATTR_PIPELINE_SERVER] not in pools
+        ):
+            raise vol.Invalid(
+                f"unknown server or pool {pipeline[ATTR_PIPELINE_SERVER]}",
+                path=[ATTR_PIPELINES, name, ATTR_PIPELINE_SERVER],
+            )
+    return config
+
+
+def validate_result_topics(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Check that no result topic is one the hook subscribes to, or every
+    deferred result published there would be enriched again, and that
+    results deferred past a topic's latency budget can be published."""
+    if ATTR_MQTT not in config:
+        for index, topic in enumerate(config[ATTR_TOPICS]):
+            if ATTR_TOPIC_LATENCY_BUDGET not in topic:
+                continue
+            for name in topic[ATTR_TOPIC_PIPELINE]:
+                pipeline = config[ATTR_PIPELINES].get(name, {})
+                if pipeline.get(ATTR_PIPELINE_RESULT_TOPIC, None) is not None:
+                    raise vol.Invalid(
+                        f"pipeline {name} has a result topic and the topic a "
+                        "latency budget, so results can be deferred, but mqtt "
+                        "is not configured to publish them",
+                        path=[ATTR_TOPICS, index, ATTR_TOPIC_LATENCY_BUDGET],
+                    )
+    subscriptions: TopicTrie[str] = TopicTrie()
+    for topic in config[ATTR_TOPICS]:
+        subscriptions.insert(topic[ATTR_TOPIC_TOPIC], topic[ATTR_TOPIC_TOPIC])
+    for name, pipeline in config[ATTR_PIPELINES].items():
+        result_topic = pipeline.get(ATTR_PIPELINE_RESULT_TOPIC, None)
+        if result_topic is None:
+            continue
+        matches = subscriptions.match(result_topic)
+        if len(matches) > 0:
+            raise vol.Invalid(
+                f"result topic {result_topic} matches subscribed topic {matches[0]}",
+                path=[ATTR_PIPELINES, name, ATTR_PIPELINE_RESULT_TOPIC],
+            )
+    return config
+
+
+def validate_pipeline_order(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Check that face recognition listed after face detection in a topic
+    depends on it.
+
+    Pipelines of a topic used to run one after another in the order listed.
+    They now run concurrently unless depends_on says otherwise, which would
+    make such configs recognize faces before any were detected."""
+    pipelines = config[ATTR_PIPELINES]
+
+    def dependencies(name: str) -> Set[str]:
+        found: Set[str] = set()
+        queue = [name]
+        while queue:
+            for dependency in pipelines.get(queue.pop(), {}).get(
+                ATTR_PIPELINE_DEPENDS_ON, []
+            ):
+                if dependency not in found:
+                    found.add(dependency)
+                    queue.append(dependency)
+        return found
+
+    for index, topic in enumerate(config[ATTR_TOPICS]):
+        listed = topic[ATTR_TOPIC_PIPELINE]
+        for position, name in enumerate(listed):
+            pipeline = pipelines.get(name, {})
+            if pipeline.get(ATTR_PIPELINE_TYPE, None) != PIPELINE_FACE_RECOGNIZE:
+                continue
+            for earlier in listed[:position]:
+                if (
+                    pipelines.get(earlier, {}).get(ATTR_PIPELINE_TYPE, None)
+                    == PIPELINE_FACE_DETECT
+                    and earlier not in dependencies(name)
+                ):
+                    raise vol.Invalid(
+                        f"pipeline {name} runs concurrently with face detection "
+                        f"pipeline {earlier}, set depends_on: {earlier} to run "
+                        "it afterwards",
+                        path=[ATTR_TOPICS, index, ATTR_TOPIC_PIPELINE],
+                    )
+    return config
+
+
+SCHEMA_CONFIG_BASE = vol.Schema(
     {
         vol.Optional(
             ATTR_BIND, default={ATTR_BIND_IP: "0.0.0.0", ATTR_BIND_PORT: 9000}
         ): SCHEMA_BIND,
         vol.Optional(ATTR_THREADS, default=10): threads,
+        vol.Optional(ATTR_IMAGE_WORKERS, default=2): vol.All(
+            vol.Coerce(int), vol.Range(min=0, max=32)
+        ),
         vol.Required(ATTR_FRIGATE): SCHEMA_FRIGATE,
+        vol.Optional(ATTR_MQTT): SCHEMA_MQTT,
+        vol.Optional(ATTR_MQTT_SNAPSHOTS): SCHEMA_MQTT_SNAPSHOTS,
+        vol.Optional(ATTR_METRICS): SCHEMA_BIND,
+        # Three times the CodeProject.AI request timeout.
+        vol.Optional(ATTR_DEFERRED_TIMEOUT, default=30.0): positive_float,
+        vol.Optional(ATTR_SNAPSHOT_CACHE, default={}): SCHEMA_SNAPSHOT_CACHE,
+        vol.Optional(ATTR_WRITE_BACK, default={}): SCHEMA_WRITE_BACK,
+        vol.Optional(ATTR_CIRCUIT_BREAKER, default={}): SCHEMA_CIRCUIT_BREAKER,
         vol.Required(ATTR_SERVERS): schema_with_slug_keys(SCHEMA_SERVER),
+        vol.Optional(ATTR_POOLS, default={}): schema_with_slug_keys(SCHEMA_POOL),
         vol.Required(ATTR_PIPELINES): schema_with_slug_keys(SCHEMA_PIPELINE),
         vol.Required(ATTR_TOPICS): vol.All(ensure_list, [SCHEMA_TOPIC]),
     }
 )
+
+SCHEMA_CONFIG = vol.All(
+    SCHEMA_CONFIG_BASE,
+    validate_servers,
+    validate_result_topics,
+    validate_pipeline_order,
+)
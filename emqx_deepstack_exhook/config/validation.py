@@ -177,8 +177,10 @@ def ensure_list(value: _T | None) -> list[_T] | list[Any]:
 
 
 port = vol.All(vol.Coerce(int), vol.Range(min=1, max=65535))
+positive_int = vol.All(vol.Coerce(int), vol.Range(min=1))
 threads = vol.All(vol.Coerce(int), vol.Range(min=1, max=15))
 small_float = vol.All(vol.Coerce(float), vol.Range(min=0, max=1))
+positive_float = vol.All(vol.Coerce(float), vol.Range(min=0, min_included=False))
 ip_address = vol.All(vol.Coerce(str), matches_regex(r"^(?:\d{1,3}\.){3}\d{1,3}$"))
 bind_address = vol.All(
     vol.Coerce(str), matches_regex(r"^(?:\d{1,3}\.){3}\d{1,3}:\d{1,5}$")
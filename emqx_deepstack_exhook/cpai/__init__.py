@@ -1,13 +1,33 @@
+import asyncio
 import json
 import logging
-import io
-from PIL import Image
-from typing import Any, Dict, List, Optional
-import jq
+import weakref
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
 
 import aiohttp
-from emqx_deepstack_exhook.config import Config
+from emqx_deepstack_exhook.config import AdmissionConfig, Config, PoolConfig
+from emqx_deepstack_exhook.cpai.admission import Admission
 from emqx_deepstack_exhook.config.const import ATTR_FRIGATE
+from emqx_deepstack_exhook.cpai.filter import FilterResults, compile_filter
+from emqx_deepstack_exhook.cpai.frigate import (
+    FULL_SNAPSHOT,
+    FrigateCameras,
+    SnapshotQuery,
+    is_scaled,
+    snapshot_query,
+    snapshot_url,
+)
+from emqx_deepstack_exhook.cpai.graph import PipelineGraph, PipelineGraphError
+from emqx_deepstack_exhook.cpai.image import jpeg_size
+from emqx_deepstack_exhook.cpai.payload import FrigatePayload
+from emqx_deepstack_exhook.cpai.pool import CPAIServerPool
+from emqx_deepstack_exhook.cpai.resilience import CircuitBreaker, Deadline
+from emqx_deepstack_exhook.cpai.snapshot import PublishedSnapshots, SnapshotCache
+from emqx_deepstack_exhook.cpai.transform import ImageContext, ImageTransformer
+from emqx_deepstack_exhook.cpai.writeback import SubLabelWriter
+from emqx_deepstack_exhook.metrics import STAGE_ERRORS, STAGE_LATENCY, Gauge
+from emqx_deepstack_exhook.topic import TopicTrie
 from emqx_deepstack_exhook.cpai.types import (
     CPAIPipeline,
     CPAIServer,
@@ -17,22 +37,182 @@ from emqx_deepstack_exhook.cpai.types import (
 from emqx_deepstack_exhook.pb2.exhook_pb2 import Message
 
 
+# Share of a request's remaining time the snapshot fetch may use; the rest is
+# left for inference.
+SNAPSHOT_SHARE = 0.4
+
+GENERATION_ACTIVE = "active"
+GENERATION_DRAINING = "draining"
+GENERATION_CLOSED = "closed"
+
+# Every CPAIProcess still referenced anywhere, so a reload that leaks the
+# previous generation shows up as closed generations that never go away.
+_generations: "weakref.WeakSet[CPAIProcess]" = weakref.WeakSet()
+
+
+def build_admission(scope: str, name: str, config: AdmissionConfig) -> Admission:
+    return Admission(
+        scope,
+        name,
+        max_concurrent=config.max_concurrent,
+        max_queue=config.max_queue,
+        queue_timeout=config.queue_timeout,
+        policy=config.policy,
+    )
+
+
 class CPAIProcess:
+    """Runtime snapshot built from a validated Config.
+
+    Instances are treated as immutable once constructed so that a reload can
+    swap in a new one without coordinating with requests already using the
+    old one. Each is a numbered generation: after a reload the previous one
+    is drained, finishing the requests it already accepted before its
+    background work and session are closed."""
+
+    servers: Mapping[str, CPAIServer]
+    pools: Mapping[str, CPAIServerPool]
+    pipelines: Mapping[str, CPAIPipeline]
+    topics: Tuple[CPAITopic, ...]
+    published_snapshots: Optional[PublishedSnapshots]
 
     def __init__(
-        self, config: Config, session: Optional[aiohttp.ClientSession] = None
+        self,
+        config: Config,
+        session: Optional[aiohttp.ClientSession] = None,
+        previous: Optional["CPAIProcess"] = None,
     ) -> None:
+        """With previous, the process a reload replaces, every component whose
+        config is unchanged is carried over rather than rebuilt, keeping its
+        breaker state, queues, latency stats and cached snapshots."""
         self._logger = logging.getLogger(CPAIProcess.__name__)
+        self.config = config
+        self.generation = previous.generation + 1 if previous is not None else 1
+        self.state = GENERATION_ACTIVE
+        self.inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        if session is None and previous is not None:
+            session = previous.session
+            self._owns_session = previous._owns_session
+        else:
+            self._owns_session = session is None
         self._session = session or aiohttp.ClientSession()
         self.frigate = config.frigate
-        self.servers = {
-            key: CPAIServer(key, value.host, value.port)
-            for key, value in config.servers.items()
-        }
+        same_frigate = (
+            previous is not None
+            and previous.frigate == config.frigate
+            and previous.config.circuit_breaker == config.circuit_breaker
+        )
+        if previous is not None and same_frigate:
+            self.frigate_breaker = previous.frigate_breaker
+        else:
+            self.frigate_breaker = CircuitBreaker(
+                "frigate",
+                failure_threshold=config.circuit_breaker.failure_threshold,
+                reset_timeout=config.circuit_breaker.reset_timeout,
+            )
+        if (
+            previous is not None
+            and previous.frigate == config.frigate
+            and previous.config.snapshot_cache == config.snapshot_cache
+        ):
+            self.snapshot_cache = previous.snapshot_cache
+        else:
+            self.snapshot_cache = SnapshotCache(
+                max_bytes=config.snapshot_cache.max_bytes,
+                ttl=config.snapshot_cache.ttl,
+            )
+        if (
+            previous is not None
+            and previous.config.mqtt_snapshots == config.mqtt_snapshots
+        ):
+            self.published_snapshots = previous.published_snapshots
+        elif config.mqtt_snapshots is not None:
+            self.published_snapshots = PublishedSnapshots(
+                topic_prefix=config.mqtt_snapshots.topic_prefix,
+                max_age=config.mqtt_snapshots.max_age,
+                max_entries=config.mqtt_snapshots.max_entries,
+            )
+        else:
+            self.published_snapshots = None
+        if (
+            previous is not None
+            and previous.snapshot_cache is self.snapshot_cache
+            and previous.config.image_workers == config.image_workers
+        ):
+            self.transformer = previous.transformer
+        else:
+            # Transformed images share the snapshots' budget, so max_bytes
+            # bounds both. Their keys wrap a snapshot key and can't collide.
+            self.transformer = ImageTransformer(
+                workers=config.image_workers, cache=self.snapshot_cache
+            )
+        # Looked up again by every generation, so a reload picks up changed
+        # camera resolutions.
+        self.cameras = FrigateCameras(
+            self._session, self.frigate, breaker=self.frigate_breaker
+        )
+        if (
+            previous is not None
+            and same_frigate
+            and previous.config.write_back == config.write_back
+        ):
+            self.sub_label_writer = previous.sub_label_writer
+        else:
+            self.sub_label_writer = SubLabelWriter(
+                self._session,
+                self.frigate,
+                max_pending=config.write_back.max_pending,
+                max_retries=config.write_back.max_retries,
+                backoff=config.write_back.backoff,
+                breaker=self.frigate_breaker,
+            )
+        self.servers = MappingProxyType(
+            {
+                key: (
+                    previous.servers[key]
+                    if previous is not None
+                    and previous.config.circuit_breaker == config.circuit_breaker
+                    and previous.config.servers.get(key, None) == value
+                    else CPAIServer(
+                        key,
+                        value.host,
+                        value.port,
+                        breaker=CircuitBreaker(
+                            key,
+                            failure_threshold=config.circuit_breaker.failure_threshold,
+                            reset_timeout=config.circuit_breaker.reset_timeout,
+                        ),
+                        admission=build_admission("server", key, value.admission),
+                    )
+                )
+                for key, value in config.servers.items()
+            }
+        )
+        # Every server is also a pool of one, so pipelines only deal in pools.
+        pools: Dict[str, CPAIServerPool] = {}
+        for key, server in self.servers.items():
+            pools[key] = self._previous_pool(previous, key, [server], None) or (
+                CPAIServerPool(key, [server])
+            )
+        for key, value in config.pools.items():
+            if not all(name in self.servers for name in value.servers):
+                continue
+            servers = [self.servers[name] for name in value.servers]
+            pools[key] = self._previous_pool(previous, key, servers, value) or (
+                CPAIServerPool(
+                    key,
+                    servers,
+                    strategy=value.strategy,
+                    health_check_interval=value.health_check_interval,
+                )
+            )
+        self.pools = MappingProxyType(pools)
         invalid_pipelines = [
             key
             for key, value in config.pipelines.items()
-            if value.server not in self.servers
+            if value.server not in self.pools
         ]
         if len(invalid_pipelines) > 0:
             self._logger.error(
@@ -43,20 +223,44 @@ class CPAIProcess:
                 "Invalid pipeline configurations, server not present in list: %s"
                 % json.dumps(invalid_pipelines)
             )
-        self.pipelines = {
-            key: CPAIPipeline(
-                key,
-                pipeline_type=value.pipeline_type,
-                server=self.servers[value.server],
-                model=value.model,
-                threshold=value.threshold,
-                result_topic=value.result_topic,
-                filter=jq.compile(value.filter),
-                frigate=self.frigate,
-            )
-            for key, value in config.pipelines.items()
-            if value.server in self.servers
-        }
+        self.pipelines = MappingProxyType(
+            {
+                key: (
+                    previous.pipelines[key]
+                    if previous is not None
+                    and previous.config.pipelines.get(key, None) == value
+                    and previous.pipelines[key].server is self.pools[value.server]
+                    else CPAIPipeline(
+                        key,
+                        pipeline_type=value.pipeline_type,
+                        server=self.pools[value.server],
+                        model=value.model,
+                        threshold=value.threshold,
+                        result_topic=value.result_topic,
+                        filter=(
+                            compile_filter(value.filter)
+                            if value.filter is not None
+                            else None
+                        ),
+                        depends_on=value.depends_on,
+                        admission=build_admission("pipeline", key, value.admission),
+                        crop=value.crop,
+                        transform=value.transform,
+                        snapshot=value.snapshot,
+                        thumbnail=value.thumbnail,
+                    )
+                )
+                for key, value in config.pipelines.items()
+                if value.server in self.pools
+            }
+        )
+        try:
+            PipelineGraph(self.pipelines.values(), self.pipelines)
+        except PipelineGraphError as exc:
+            self._logger.error("Invalid pipeline configurations, %s", str(exc))
+            raise Exception(
+                "Invalid pipeline configurations, %s" % str(exc)
+            ) from exc
         invalid_topics = [
             value.subscribe
             for value in config.topics
@@ -77,10 +281,13 @@ class CPAIProcess:
                 "Invalid topic configurations, pipeline not present in list: %s"
                 % json.dumps(invalid_topics)
             )
-        self.topics = [
+        self.topics = tuple(
             CPAITopic(
                 subscribe=value.subscribe,
-                filter=jq.compile(value.filter) if value.filter is not None else None,
+                filter=(
+                    compile_filter(value.filter) if value.filter is not None else None
+                ),
+                latency_budget=value.latency_budget,
                 pipelines=[
                     self.pipelines[pipeline]
                     for pipeline in value.pipelines
@@ -88,77 +295,363 @@ class CPAIProcess:
                 ],
             )
             for value in config.topics
-        ]
+        )
+        self._graphs: Dict[Tuple[int, ...], PipelineGraph] = {}
+        self._topic_trie: TopicTrie[CPAITopic] = TopicTrie()
+        for cpai_topic in self.topics:
+            self._topic_trie.insert(cpai_topic.subscribe, cpai_topic)
+        _generations.add(self)
+
+    @staticmethod
+    def _previous_pool(
+        previous: Optional["CPAIProcess"],
+        key: str,
+        servers: List[CPAIServer],
+        config: Optional[PoolConfig],
+    ) -> Optional[CPAIServerPool]:
+        """The previous process's pool named key, if it is configured the same
+        way over the same server objects."""
+        if previous is None or previous.config.pools.get(key, None) != config:
+            return None
+        pool = previous.pools.get(key, None)
+        if pool is None or len(pool.servers) != len(servers):
+            return None
+        if any(a is not b for a, b in zip(pool.servers, servers)):
+            return None
+        return pool
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self._session
+
+    def reused(self, previous: "CPAIProcess") -> Dict[str, int]:
+        """How many servers, pools and pipelines were carried over from
+        previous."""
+        return {
+            name: sum(
+                1
+                for key, value in mine.items()
+                if theirs.get(key, None) is value
+            )
+            for name, mine, theirs in (
+                ("servers", self.servers, previous.servers),
+                ("pools", self.pools, previous.pools),
+                ("pipelines", self.pipelines, previous.pipelines),
+            )
+        }
+
+    def start(self) -> None:
+        """Start background work: pool health checks. Pools carried over from
+        a previous process keep their running checks."""
+        for pool in self.pools.values():
+            pool.start_health_checks(self._session)
+
+    async def drain(
+        self, timeout: Optional[float] = None, keep: Optional["CPAIProcess"] = None
+    ) -> None:
+        """Wait up to timeout for requests already running on this generation
+        to finish, then close it."""
+        self.state = GENERATION_DRAINING
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            self._logger.warning(
+                "Generation %d still had %d requests in flight after %ss",
+                self.generation,
+                self.inflight,
+                timeout,
+            )
+        await self.close(timeout=timeout, keep=keep)
+
+    async def close(
+        self, timeout: Optional[float] = None, keep: Optional["CPAIProcess"] = None
+    ) -> None:
+        """Stop background work, flushing queued sub label writes, shut down
+        the image workers and close the session if this generation created
+        it.
+
+        Components that were carried over into keep are left running."""
+        kept = set(id(pool) for pool in keep.pools.values()) if keep else set()
+        await asyncio.gather(
+            *[pool.stop() for pool in self.pools.values() if id(pool) not in kept]
+        )
+        if keep is None or keep.sub_label_writer is not self.sub_label_writer:
+            await self.sub_label_writer.stop(timeout=timeout)
+        if keep is None or keep.transformer is not self.transformer:
+            self.transformer.shutdown()
+        if self._owns_session and (keep is None or keep.session is not self._session):
+            await self._session.close()
+        self.state = GENERATION_CLOSED
 
     def find_topics(self, topic: str) -> List[CPAITopic]:
-        matching_topics: List[CPAITopic] = []
-        for t in self.topics:
-            if t.matches_subscription(topic):
-                matching_topics.append(t)
+        return self._topic_trie.match(topic)
+
+    def pipeline_graph(self, cpai_topics: List[CPAITopic]) -> PipelineGraph:
+        """Graph of the pipelines used by cpai_topics, built once per topic set."""
+        key = tuple(id(t) for t in cpai_topics)
+        graph = self._graphs.get(key, None)
+        if graph is None:
+            graph = self._graphs[key] = PipelineGraph(
+                (pipeline for t in cpai_topics for pipeline in t.pipelines),
+                self.pipelines,
+            )
+        return graph
+
+    def set_sub_label(self, event: FrigateEvent) -> bool:
+        """Queue the event's sub label to be written back to Frigate."""
+        if event.sub_label is None:
+            return False
+        label, score = event.sub_label
+        return self.sub_label_writer.submit(event.id, label, score)
+
+    def latency_budget(self, topic: str) -> Optional[float]:
+        """Tightest latency budget among the topics subscribed to topic.
 
-        return matching_topics
+        None means the hook should wait for enrichment to finish."""
+        budgets = [
+            t.latency_budget
+            for t in self.find_topics(topic)
+            if t.latency_budget is not None
+        ]
+        return min(budgets) if len(budgets) > 0 else None
+
+    async def get_snapshot(
+        self, event: FrigateEvent, query: SnapshotQuery = FULL_SNAPSHOT
+    ) -> bytes:
+        return await self.snapshot_cache.get(
+            (event.id, event.snapshot_time, query),
+            lambda: self.fetch_snapshot(event, query),
+        )
 
-    async def get_snapshot(self, event: FrigateEvent) -> bytes:
+    async def fetch_snapshot(
+        self, event: FrigateEvent, query: SnapshotQuery = FULL_SNAPSHOT
+    ) -> bytes:
+        """Download the event snapshot, passing Frigate's JPEG bytes through."""
         self._logger.debug("Getting snapshot...")
-        async with self._session.get(
-            f"{self.frigate}/api/events/{event.id}/snapshot.jpg?crop=0"
-        ) as resp:
-            img_bytes = await resp.read()
-            img = Image.open(io.BytesIO(img_bytes))
-            width, height = img.size
-            image_bytes = io.BytesIO()
-            img.save(image_bytes, format="JPEG")
-            self._logger.debug(f"{width, height}")
-            return image_bytes.getvalue()
-
-    async def process_message(
-        self, topic: str, message: Message
-    ) -> Optional[Dict[str, Any]]:
-        before_after = json.loads(message.payload)
-        if (
-            before_after is None
-            or not isinstance(before_after, dict)
-            or before_after.get("after", None) is None
+        with self.frigate_breaker:
+            async with self._session.get(
+                snapshot_url(self.frigate, event.id, query)
+            ) as resp:
+                resp.raise_for_status()
+                img_bytes = await resp.read()
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug(f"{jpeg_size(img_bytes)}")
+        return img_bytes
+
+    def store_snapshot(self, topic: str, payload: bytes) -> bool:
+        """Keep a snapshot Frigate published over MQTT.
+
+        Returns whether topic is one of Frigate's snapshot topics."""
+        if self.published_snapshots is None:
+            return False
+        return self.published_snapshots.put(topic, payload)
+
+    async def get_images(
+        self, event: FrigateEvent, pipelines: Iterable[CPAIPipeline]
+    ) -> Dict[str, ImageContext]:
+        """The snapshot of every pipeline, keyed by pipeline name.
+
+        Each distinct snapshot profile is fetched once, all of them
+        concurrently, and Frigate does any scaling before the bytes are
+        sent. A matching snapshot Frigate published over MQTT stands in for
+        the full snapshot."""
+        pipelines = list(pipelines)
+        frame = None
+        if self.published_snapshots is not None or any(
+            p.snapshot is not None and p.snapshot.height for p in pipelines
         ):
-            return None
-        event = FrigateEvent(**before_after["after"])
-        self._logger.debug(
-            [
-                {
-                    "topic": t,
-                    "event": {"id": event.id, "label": event.label},
-                    "filter": t.filter,
-                    "filterResult": t.filter is not None
-                    and t.filter.input_value(event.__dict__).first(),
-                }
-                for t in self.topics
+            frame = await self.cameras.frame_size(event.camera)
+        queries = {p.name: snapshot_query(p.snapshot, frame) for p in pipelines}
+        distinct = list(dict.fromkeys(queries.values()))
+        published = None
+        if self.published_snapshots is not None and FULL_SNAPSHOT in distinct:
+            published = self.published_snapshots.get(
+                event.id,
+                event.camera, event.label, event.snapshot_time, frame
+            )
+        snapshots = await asyncio.gather(
+            *[
+                self.get_snapshot(event, query)
+                for query in distinct
+                if query != FULL_SNAPSHOT or published is None
             ]
         )
-        cpai_topics = [
-            t
-            for t in self.find_topics(topic)
-            if t.filter is None or t.filter.input_value(event.__dict__).first()
-        ]
+        contexts: Dict[SnapshotQuery, ImageContext] = {}
+        fetched = iter(snapshots)
+        for query in distinct:
+            key = (event.id, event.snapshot_time, query)
+            if query == FULL_SNAPSHOT and published is not None:
+                # Frigate may have scaled what it published.
+                contexts[query] = ImageContext(
+                    self.transformer, (*key, "mqtt"), published, frame=frame
+                )
+                continue
+            contexts[query] = ImageContext(
+                self.transformer,
+                key,
+                next(fetched),
+                frame=frame if is_scaled(query) else None,
+            )
+        return {name: contexts[query] for name, query in queries.items()}
+
+    async def enrich_message(
+        self, topic: str, message: Message, deadline: Optional[Deadline] = None
+    ) -> Tuple[Optional[bytes], List[str]]:
+        """Run the matching pipelines against message.
+
+        Returns the encoded, enriched payload along with the result topics of
+        the pipelines that belong to successfully processed topics, or None
+        if nothing was learned about the event. The payload is only decoded
+        once a topic is subscribed to, and only as far as after.
+
+        With a deadline, the snapshot fetch may use at most SNAPSHOT_SHARE of
+        the remaining time and inference gets whatever is left; work still
+        running when the deadline passes is cancelled and raises
+        asyncio.TimeoutError."""
+        self.inflight += 1
+        self._idle.clear()
+        try:
+            return await self._enrich_message(topic, message, deadline)
+        finally:
+            self.inflight -= 1
+            if self.inflight == 0:
+                self._idle.set()
+
+    async def _enrich_message(
+        self, topic: str, message: Message, deadline: Optional[Deadline]
+    ) -> Tuple[Optional[bytes], List[str]]:
+        deadline = deadline or Deadline()
+        if deadline.expired():
+            raise asyncio.TimeoutError()
+        subscribed = self.find_topics(topic)
+        if len(subscribed) == 0:
+            return None, []
+        with STAGE_LATENCY.labels("parse").time():
+            payload = FrigatePayload(message.payload)
+            after = payload.after
+            if after is None:
+                return None, []
+        if self.published_snapshots is not None:
+            self.published_snapshots.observe(
+                after.get("id", None),
+                after.get("camera", None),
+                after.get("label", None),
+                after.get("end_time", None) is not None,
+            )
+        filters = FilterResults(after)
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug(
+                [
+                    {
+                        "topic": t.subscribe,
+                        "event": {
+                            "id": after.get("id", None),
+                            "label": after.get("label", None),
+                        },
+                        **result,
+                    }
+                    for t, result in zip(
+                        self.topics, filters.dump(t.filter for t in self.topics)
+                    )
+                ]
+            )
+        with STAGE_LATENCY.labels("filter").time():
+            cpai_topics = [t for t in subscribed if filters.matches(t.filter)]
         if len(cpai_topics) == 0:
-            return None
+            return None, []
+        with STAGE_LATENCY.labels("parse").time():
+            event = FrigateEvent.from_dict(after)
+
+        graph = self.pipeline_graph(cpai_topics)
+        # Pipelines that try the thumbnail first, and those depending on
+        # them, only fetch a snapshot if they still need one.
+        deferred: Set[str] = set()
+        for pipeline in graph.order:
+            if pipeline.uses_thumbnail(event) or any(
+                name in deferred for name in pipeline.depends_on
+            ):
+                deferred.add(pipeline.name)
+        try:
+            with STAGE_LATENCY.labels("snapshot").time():
+                images = await asyncio.wait_for(
+                    self.get_images(
+                        event,
+                        (
+                            p
+                            for p in graph.order
+                            if p.name not in deferred and filters.matches(p.filter)
+                        ),
+                    ),
+                    deadline.budget(SNAPSHOT_SHARE),
+                )
+        except Exception:
+            STAGE_ERRORS.labels("snapshot").inc()
+            raise
+
+        async def fetch_images(pipeline: CPAIPipeline) -> ImageContext:
+            with STAGE_LATENCY.labels("snapshot").time():
+                return (await self.get_images(event, [pipeline]))[pipeline.name]
+
+        with STAGE_LATENCY.labels("inference").time():
+            inferences = await asyncio.wait_for(
+                graph.run(self._session, event, images, filters, fetch_images),
+                deadline.remaining(),
+            )
+        if all(inference is None for inference in inferences.values()):
+            return None, []
+        sub_label_changed = False
+        # In pipeline order, not completion order, so ties between pipelines
+        # resolve the same way every time.
+        for pipeline in graph.order:
+            inference = inferences[pipeline.name]
+            if inference is not None:
+                sub_label_changed |= event.merge_predictions(inference.predictions)
+        if sub_label_changed:
+            self.set_sub_label(event)
 
-        snapshot = await self.get_snapshot(event)
+        result_topics: List[str] = []
         for cpai_topic in cpai_topics:
+            if not cpai_topic.succeeded(inferences):
+                continue
             self._logger.info(
-                f"Using topic {topic} match: {cpai_topic.subscribe} regex: {cpai_topic.topic_pattern}"
+                f"Using topic {topic} match: {cpai_topic.subscribe}"
             )
+            for pipeline in cpai_topic.pipelines:
+                if (
+                    pipeline.result_topic is not None
+                    and pipeline.result_topic not in result_topics
+                ):
+                    result_topics.append(pipeline.result_topic)
+        return payload.encode(event.to_dict()), result_topics
 
-            try:
-                event, success = await cpai_topic.process_event(
-                    self._session, event, snapshot
-                )
-                if not success:
-                    continue
-            except Exception as exc:
-                self._logger.error(
-                    "Error processing message on %s: %s" % (topic, str(exc)),
-                    exc_info=exc,
-                )
-                continue
-        before_after["after"] = event.__dict__
-        return before_after
+
+def generation_metrics() -> Iterable[Gauge]:
+    """Scrape-time view of the CPAIProcess generations still in memory."""
+    generations = Gauge(
+        "exhook_cpai_generations",
+        "CPAIProcess generations in memory by state",
+        ["state"],
+        registry=None,
+    )
+    inflight = Gauge(
+        "exhook_cpai_generation_inflight",
+        "Messages being enriched by generation state",
+        ["state"],
+        registry=None,
+    )
+    sessions = Gauge(
+        "exhook_cpai_sessions_open",
+        "HTTP client sessions held open by CPAIProcess generations",
+        registry=None,
+    )
+    for state in (GENERATION_ACTIVE, GENERATION_DRAINING, GENERATION_CLOSED):
+        generations.labels(state).set(0)
+        inflight.labels(state).set(0)
+    open_sessions = set()
+    for cpai in list(_generations):
+        generations.labels(cpai.state).inc()
+        inflight.labels(cpai.state).inc(cpai.inflight)
+        if not cpai.session.closed:
+            open_sessions.add(id(cpai.session))
+    sessions.labels().set(len(open_sessions))
+    return (generations, inflight, sessions)
@@ -0,0 +1,153 @@
+import asyncio
+from collections import deque
+from types import TracebackType
+from typing import Deque, Optional, Type
+
+from emqx_deepstack_exhook.config.const import (
+    SHED_DROP_NEWEST,
+    SHED_DROP_OLDEST,
+    SHED_PASS_THROUGH,
+)
+from emqx_deepstack_exhook.metrics import Counter, Gauge
+
+DEFAULT_MAX_QUEUE = 16
+
+ADMISSION_SHED = Counter(
+    "exhook_admission_shed",
+    "Requests shed by admission control",
+    ["scope", "name", "reason"],
+)
+ADMISSION_QUEUED = Gauge(
+    "exhook_admission_queued",
+    "Requests waiting for an admission slot",
+    ["scope", "name"],
+)
+ADMISSION_ACTIVE = Gauge(
+    "exhook_admission_active",
+    "Requests holding an admission slot",
+    ["scope", "name"],
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised when admission control sheds a request.
+
+    With pass_through set, the whole message should be forwarded unenriched
+    rather than just skipping the one pipeline."""
+
+    def __init__(self, message: str, pass_through: bool = False) -> None:
+        super().__init__(message)
+        self.pass_through = pass_through
+
+
+class Admission:
+    """Bounded admission in front of a server or pipeline.
+
+    At most max_concurrent requests hold a slot at once; up to max_queue more
+    wait for one, each for at most queue_timeout seconds. When the queue is
+    full the shedding policy decides what gives:
+
+    - drop_newest rejects the arriving request,
+    - drop_oldest rejects the longest waiting request and queues the new one,
+    - pass_through rejects the arriving request and asks for the whole
+      message to be forwarded unenriched.
+
+    Without max_concurrent every request is admitted immediately. Use it as
+    an async context manager around the guarded work."""
+
+    def __init__(
+        self,
+        scope: str,
+        name: str,
+        max_concurrent: Optional[int] = None,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        queue_timeout: Optional[float] = None,
+        policy: str = SHED_DROP_NEWEST,
+    ) -> None:
+        self.scope = scope
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.policy = policy
+        self.active = 0
+        self._waiters: Deque["asyncio.Future[None]"] = deque()
+        self._queued_gauge = ADMISSION_QUEUED.labels(scope, name)
+        self._active_gauge = ADMISSION_ACTIVE.labels(scope, name)
+
+    def __repr__(self) -> str:
+        return f"Admission(scope={self.scope!r}, name={self.name!r}, max_concurrent={self.max_concurrent!r})"
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def __aenter__(self) -> "Admission":
+        await self.acquire()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        self.release()
+
+    async def acquire(self) -> None:
+        self._discard_done()
+        if self.max_concurrent is None or (
+            self.active < self.max_concurrent and len(self._waiters) == 0
+        ):
+            self._set_active(self.active + 1)
+            return
+        if len(self._waiters) >= self.max_queue:
+            if self.policy != SHED_DROP_OLDEST or len(self._waiters) == 0:
+                raise self._shed("queue_full")
+            # Only pending waiters are left, see _discard_done.
+            self._waiters.popleft().set_exception(self._shed("evicted"))
+        waiter: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._queued_gauge.set(len(self._waiters))
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise self._shed("timeout") from None
+        except BaseException:
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                # The slot was handed over just as we were cancelled.
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self._queued_gauge.set(len(self._waiters))
+
+    def release(self) -> None:
+        """Hand the slot to the longest waiting request, or free it."""
+        while len(self._waiters) > 0:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._queued_gauge.set(len(self._waiters))
+                return
+        self._set_active(self.active - 1)
+
+    def _discard_done(self) -> None:
+        """Drop waiters that timed out or were cancelled but haven't run
+        their cleanup yet, so they neither take up queue space nor get
+        evicted twice."""
+        if any(waiter.done() for waiter in self._waiters):
+            self._waiters = deque(w for w in self._waiters if not w.done())
+            self._queued_gauge.set(len(self._waiters))
+
+    def _shed(self, reason: str) -> AdmissionRejected:
+        ADMISSION_SHED.labels(self.scope, self.name, reason).inc()
+        return AdmissionRejected(
+            f"{self.scope} {self.name} shed a request ({reason})",
+            pass_through=self.policy == SHED_PASS_THROUGH,
+        )
+
+    def _set_active(self, active: int) -> None:
+        self.active = active
+        self._active_gauge.set(active)
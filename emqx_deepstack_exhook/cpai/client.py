@@ -0,0 +1,133 @@
+import asyncio
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+from emqx_deepstack_exhook.cpai.inference import CPAIInference
+from emqx_deepstack_exhook.metrics import SERVER_IN_FLIGHT, SERVER_LATENCY
+
+DEFAULT_TIMEOUT = 10.0
+
+URL_BASE_VISION = "http://{host}:{port}/v1/vision"
+URL_PING = "http://{host}:{port}/v1/server/status/ping"
+URL_CUSTOM = "/custom/{model}"
+URL_OBJECT_DETECTION = "/detection"
+URL_FACE_DETECTION = "/face"
+URL_FACE_RECOGNIZE = "/face/recognize"
+
+UNKNOWN_FACE = "unknown"
+
+
+class CPAIClientError(Exception):
+    """A request CodeProject.AI didn't answer successfully.
+
+    status is the HTTP status it answered with, or None when it couldn't
+    be reached."""
+
+    def __init__(self, message: str, status: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class CPAIClient:
+    """asyncio client for the CodeProject.AI vision endpoints.
+
+    Requests go through the caller's aiohttp session so every pipeline
+    shares its keep-alive connection pool instead of opening a new
+    connection per inference."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        timeout: float = DEFAULT_TIMEOUT,
+        name: Optional[str] = None,
+    ):
+        self.name = name or f"{host}:{port}"
+        self.url_base = URL_BASE_VISION.format(host=host, port=port)
+        self.url_ping = URL_PING.format(host=host, port=port)
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async def ping(self, session: aiohttp.ClientSession, timeout: float) -> bool:
+        """Whether the server answers its status endpoint within timeout."""
+        try:
+            async with session.get(
+                self.url_ping, timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as resp:
+                return resp.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def detect(
+        self,
+        session: aiohttp.ClientSession,
+        image: bytes,
+        min_confidence: float,
+        model: Optional[str] = None,
+    ) -> CPAIInference:
+        path = URL_CUSTOM.format(model=model) if model else URL_OBJECT_DETECTION
+        return CPAIInference.parse(
+            await self._post(session, path, image, min_confidence)
+        )
+
+    async def detect_faces(
+        self, session: aiohttp.ClientSession, image: bytes, min_confidence: float
+    ) -> CPAIInference:
+        inference = CPAIInference.parse(
+            await self._post(session, URL_FACE_DETECTION, image, min_confidence)
+        )
+        for prediction in inference.predictions:
+            prediction.label = "face"
+        return inference
+
+    async def recognize_faces(
+        self, session: aiohttp.ClientSession, image: bytes, min_confidence: float
+    ) -> CPAIInference:
+        resp = await self._post(session, URL_FACE_RECOGNIZE, image, min_confidence)
+        resp["predictions"] = [
+            p for p in resp.get("predictions", []) if p.get("userid") != UNKNOWN_FACE
+        ]
+        return CPAIInference.parse(resp)
+
+    async def _post(
+        self,
+        session: aiohttp.ClientSession,
+        path: str,
+        image: bytes,
+        min_confidence: float,
+    ) -> Dict[str, Any]:
+        data = aiohttp.FormData()
+        data.add_field(
+            "image", image, filename="image.jpg", content_type="image/jpeg"
+        )
+        data.add_field("min_confidence", str(min_confidence))
+        url = self.url_base + path
+        try:
+            with SERVER_IN_FLIGHT.labels(self.name).track_inprogress(), (
+                SERVER_LATENCY.labels(self.name, path).time()
+            ):
+                async with session.post(
+                    url, data=data, timeout=self._timeout
+                ) as resp:
+                    status = resp.status
+                    if status == 404:
+                        raise CPAIClientError(
+                            f"Bad url supplied, url {url} raised 404", status
+                        )
+                    if status != 200:
+                        raise CPAIClientError(
+                            f"CodeProject.AI Server error: {status}", status
+                        )
+                    result = await resp.json()
+        except aiohttp.ClientError as exc:
+            raise CPAIClientError(
+                f"CodeProject.AI Server connection error: {str(exc)}"
+            ) from exc
+        if result.get("success", True) is False:
+            # The server is fine, it just has no answer for this image, like
+            # when there's no face in it.
+            raise CPAIClientError(
+                f"CodeProject.AI Server error: {result.get('error', 'unknown')}",
+                status,
+            )
+        return result
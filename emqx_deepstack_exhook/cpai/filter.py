@@ -0,0 +1,287 @@
+"""Event filters: jq expressions with a native fast path.
+
+The filters in a config are almost always simple tests on event fields such
+as .label == "person" or .score > 0.7 and .area < 40000. Those are compiled
+to Python closures that read the event dict directly. Anything outside that
+subset, or a value the closures can't compare the way jq would, is handed
+to jq."""
+
+import json
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import jq
+
+Predicate = Callable[[Mapping[str, Any]], Any]
+
+_TOKEN = re.compile(
+    r"""\s*(?:
+    (?P<string>"(?:[^"\\]|\\[^(])*")
+    |(?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+    |(?P<path>\.(?:[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)?)
+    |(?P<op>==|!=|<=|>=|<|>|\||\(|\)|;|,)
+    |(?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    )""",
+    re.VERBOSE,
+)
+_COMPARISONS: Dict[str, Callable[[Any, Any], bool]] = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+_LITERALS = {"true": True, "false": False, "null": None}
+
+
+class _Unsupported(Exception):
+    """The expression or value is outside what the native path handles."""
+
+
+def _truthy(value: Any) -> bool:
+    return value is not None and value is not False
+
+
+def _order_key(value: Any) -> Tuple:
+    """Sort key following jq's ordering: null < false < true < numbers <
+    strings < arrays. Objects are left to jq."""
+    if value is None:
+        return (0,)
+    if value is False:
+        return (1,)
+    if value is True:
+        return (2,)
+    if isinstance(value, (int, float)):
+        return (3, value)
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, (list, tuple)):
+        return (5, [_order_key(v) for v in value])
+    raise _Unsupported(type(value).__name__)
+
+
+def _tokenize(expression: str) -> List[Tuple[str, str]]:
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if match is None or match.end() == position:
+            raise _Unsupported(expression[position:])
+        kind = match.lastgroup
+        assert kind is not None
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """Recursive descent parser for the supported jq subset:
+
+    pipe    := or ("|" ("not" | "IN" "(" literal ("," literal)* ")"))*
+    or      := and ("or" and)*
+    and     := compare ("and" compare)*
+    compare := term (("==" | "!=" | "<" | "<=" | ">" | ">=") term)?
+    term    := literal | path | "(" pipe ")"
+             | "IN" "(" pipe ";" literal ("," literal)* ")"
+    """
+
+    def __init__(self, expression: str) -> None:
+        self._tokens = _tokenize(expression)
+        self._position = 0
+
+    def parse(self) -> Predicate:
+        predicate = self._pipe()
+        if self._position != len(self._tokens):
+            raise _Unsupported(self._tokens[self._position][1])
+        return predicate
+
+    def _peek(self) -> Optional[Tuple[str, str]]:
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return None
+
+    def _accept(self, value: str) -> bool:
+        token = self._peek()
+        if token is not None and token[0] in ("op", "word") and token[1] == value:
+            self._position += 1
+            return True
+        return False
+
+    def _expect(self, value: str) -> None:
+        if not self._accept(value):
+            raise _Unsupported(f"expected {value}")
+
+    def _pipe(self) -> Predicate:
+        left = self._or()
+        while self._accept("|"):
+            if self._accept("not"):
+                left = (lambda inner: lambda e: not _truthy(inner(e)))(left)
+            elif self._accept("IN"):
+                self._expect("(")
+                left = self._member(left, self._literals())
+                self._expect(")")
+            else:
+                raise _Unsupported("pipe")
+        return left
+
+    def _or(self) -> Predicate:
+        left = self._and()
+        while self._accept("or"):
+            right = self._and()
+            left = (lambda a, b: lambda e: _truthy(a(e)) or _truthy(b(e)))(
+                left, right
+            )
+        return left
+
+    def _and(self) -> Predicate:
+        left = self._compare()
+        while self._accept("and"):
+            right = self._compare()
+            left = (lambda a, b: lambda e: _truthy(a(e)) and _truthy(b(e)))(
+                left, right
+            )
+        return left
+
+    def _compare(self) -> Predicate:
+        left = self._term()
+        token = self._peek()
+        if token is None or token[0] != "op" or token[1] not in _COMPARISONS:
+            return left
+        self._position += 1
+        right = self._term()
+        compare = _COMPARISONS[token[1]]
+        return lambda e: compare(_order_key(left(e)), _order_key(right(e)))
+
+    def _term(self) -> Predicate:
+        token = self._peek()
+        if token is None:
+            raise _Unsupported("unexpected end")
+        kind, value = token
+        if kind == "path":
+            self._position += 1
+            return self._path(value)
+        if kind in ("string", "number") or value in _LITERALS:
+            literal = self._literal()
+            return lambda e: literal
+        if self._accept("("):
+            inner = self._pipe()
+            self._expect(")")
+            return inner
+        if self._accept("IN"):
+            self._expect("(")
+            source = self._pipe()
+            self._expect(";")
+            predicate = self._member(source, self._literals())
+            self._expect(")")
+            return predicate
+        raise _Unsupported(value)
+
+    def _literal(self) -> Any:
+        token = self._peek()
+        if token is None:
+            raise _Unsupported("unexpected end")
+        kind, value = token
+        self._position += 1
+        if kind == "string":
+            return json.loads(value)
+        if kind == "number":
+            return float(value)
+        if value in _LITERALS:
+            return _LITERALS[value]
+        raise _Unsupported(value)
+
+    def _literals(self) -> List[Any]:
+        literals = [self._literal()]
+        while self._accept(","):
+            literals.append(self._literal())
+        return literals
+
+    @staticmethod
+    def _member(source: Predicate, literals: List[Any]) -> Predicate:
+        keys = [_order_key(literal) for literal in literals]
+        return lambda e: _order_key(source(e)) in keys
+
+    @staticmethod
+    def _path(path: str) -> Predicate:
+        keys = [key for key in path.split(".") if key != ""]
+
+        def get(event: Mapping[str, Any]) -> Any:
+            value: Any = event
+            for key in keys:
+                if value is None:
+                    return None
+                if not isinstance(value, Mapping):
+                    raise _Unsupported("index into non-object")
+                value = value.get(key, None)
+            return value
+
+        return get
+
+
+class EventFilter:
+    """A compiled filter expression, evaluated against an event dict."""
+
+    def __init__(self, expression: str) -> None:
+        self.expression = expression
+        self._program: Optional[jq._Program] = None
+        try:
+            self._predicate: Optional[Predicate] = _Parser(expression).parse()
+        except _Unsupported:
+            self._predicate = None
+            self._program = jq.compile(expression)
+
+    def __repr__(self) -> str:
+        return f"EventFilter({self.expression!r}, native={self.native})"
+
+    @property
+    def native(self) -> bool:
+        return self._predicate is not None
+
+    def matches(self, event: Mapping[str, Any]) -> bool:
+        if self._predicate is not None:
+            try:
+                return _truthy(self._predicate(event))
+            except _Unsupported:
+                pass
+        if self._program is None:
+            self._program = jq.compile(self.expression)
+        if not isinstance(event, dict):
+            event = dict(event)
+        return _truthy(self._program.input_value(event).first())
+
+
+@lru_cache(maxsize=None)
+def compile_filter(expression: str) -> EventFilter:
+    """Compile expression, sharing one EventFilter per distinct expression so
+    results can be memoized by filter."""
+    return EventFilter(expression)
+
+
+class FilterResults:
+    """Filter results for one event, each filter evaluated at most once."""
+
+    def __init__(self, event: Mapping[str, Any]) -> None:
+        self.event = event
+        self._results: Dict[EventFilter, bool] = {}
+
+    def matches(self, event_filter: Optional[EventFilter]) -> bool:
+        """Whether the event passes event_filter; no filter passes."""
+        if event_filter is None:
+            return True
+        result = self._results.get(event_filter, None)
+        if result is None:
+            result = self._results[event_filter] = event_filter.matches(self.event)
+        return result
+
+    def dump(self, filters: Iterable[Optional[EventFilter]]) -> List[Dict[str, Any]]:
+        return [
+            {
+                "filter": None if f is None else f.expression,
+                "native": f is not None and f.native,
+                "filterResult": self.matches(f),
+            }
+            for f in filters
+        ]
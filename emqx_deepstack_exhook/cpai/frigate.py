@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlencode
+
+import aiohttp
+
+from emqx_deepstack_exhook.config import SnapshotConfig
+from emqx_deepstack_exhook.cpai.resilience import CircuitBreaker
+
+DEFAULT_RETRY_INTERVAL = 60.0
+
+# Query parameters of Frigate's snapshot.jpg, sorted so equal profiles
+# compare and hash the same.
+SnapshotQuery = Tuple[Tuple[str, str], ...]
+FULL_SNAPSHOT: SnapshotQuery = (("crop", "0"),)
+
+
+def snapshot_query(
+    profile: Optional[SnapshotConfig], frame: Optional[Tuple[int, int]]
+) -> SnapshotQuery:
+    """The snapshot.jpg query for profile, for a camera whose frames are of
+    size frame.
+
+    Frigate scales to any height, up as well as down, and never says what
+    it scaled from, so height is only asked for when frame is known and
+    height is smaller than it."""
+    if profile is None:
+        return FULL_SNAPSHOT
+    query: Dict[str, str] = {"crop": "0"}
+    if profile.bbox:
+        query["bbox"] = "1"
+    if profile.timestamp:
+        query["timestamp"] = "1"
+    if profile.height is not None and frame is not None and profile.height < frame[1]:
+        query["h"] = str(profile.height)
+    if profile.quality is not None:
+        query["quality"] = str(profile.quality)
+    return tuple(sorted(query.items()))
+
+
+def snapshot_url(frigate: str, event_id: str, query: SnapshotQuery) -> str:
+    return f"{frigate}/api/events/{event_id}/snapshot.jpg?{urlencode(query)}"
+
+
+def is_scaled(query: SnapshotQuery) -> bool:
+    return any(key == "h" for key, _ in query)
+
+
+class FrigateCameras:
+    """Frame size of every camera, read from Frigate's config once.
+
+    Snapshots are taken from the detect stream, so its resolution is the
+    size of a full snapshot and the space event boxes are given in. Until
+    the config has been read, or while reading it keeps failing, sizes are
+    unknown; failed reads are retried at most every retry_interval
+    seconds."""
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        frigate: str,
+        breaker: Optional[CircuitBreaker] = None,
+        retry_interval: float = DEFAULT_RETRY_INTERVAL,
+    ) -> None:
+        self._logger = logging.getLogger(FrigateCameras.__name__)
+        self._session = session
+        self._frigate = frigate
+        self._breaker = breaker or CircuitBreaker("frigate")
+        self.retry_interval = retry_interval
+        self._sizes: Optional[Dict[str, Tuple[int, int]]] = None
+        self._retry_at = 0.0
+        self._load_task: Optional["asyncio.Task[None]"] = None
+
+    async def frame_size(self, camera: str) -> Optional[Tuple[int, int]]:
+        if self._sizes is None and time.monotonic() >= self._retry_at:
+            if self._load_task is None:
+                self._load_task = asyncio.ensure_future(self._load())
+            # Shared by every caller, so one giving up doesn't cancel it.
+            await asyncio.shield(self._load_task)
+        if self._sizes is None:
+            return None
+        return self._sizes.get(camera, None)
+
+    async def _load(self) -> None:
+        try:
+            with self._breaker:
+                async with self._session.get(f"{self._frigate}/api/config") as resp:
+                    resp.raise_for_status()
+                    config = await resp.json()
+            sizes: Dict[str, Tuple[int, int]] = {}
+            for name, camera in config.get("cameras", {}).items():
+                detect = camera.get("detect", None) or {}
+                width, height = detect.get("width", None), detect.get("height", None)
+                if isinstance(width, int) and isinstance(height, int):
+                    sizes[name] = (width, height)
+            self._sizes = sizes
+        except Exception as exc:
+            self._retry_at = time.monotonic() + self.retry_interval
+            self._logger.warning(
+                "Could not read camera sizes from Frigate, fetching full snapshots: %s"
+                % str(exc)
+            )
+        finally:
+            self._load_task = None
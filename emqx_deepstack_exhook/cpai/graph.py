@@ -0,0 +1,174 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Mapping, Optional
+
+import aiohttp
+
+from emqx_deepstack_exhook.cpai.admission import AdmissionRejected
+from emqx_deepstack_exhook.cpai.filter import FilterResults
+from emqx_deepstack_exhook.cpai.inference import CPAIInference
+from emqx_deepstack_exhook.cpai.resilience import CircuitOpenError
+from emqx_deepstack_exhook.cpai.transform import ImageContext
+from emqx_deepstack_exhook.cpai.types import CPAIPipeline, FrigateEvent
+from emqx_deepstack_exhook.metrics import STAGE_ERRORS
+
+ImageFetcher = Callable[[CPAIPipeline], Awaitable[ImageContext]]
+
+
+class PipelineGraphError(Exception):
+    pass
+
+
+class PipelineGraph:
+    """Dependency graph of the pipelines needed for one message.
+
+    Every pipeline runs at most once per message, as soon as the pipelines it
+    depends on have produced predictions. Independent pipelines run
+    concurrently, so the latency of a message is its critical path.
+    Pipelines listed in depends_on are pulled into the graph even if none of
+    the matched topics list them.
+
+    Pipelines used to run one after another in the order topics list them.
+    They no longer do: a pipeline that has to wait for another must say so
+    with depends_on. Configs listing face recognition after face detection
+    without it are rejected rather than silently run out of order. order still follows the topics, dependencies first,
+    and results are merged into the event in that order whatever order the
+    pipelines finish in."""
+
+    def __init__(
+        self,
+        pipelines: Iterable[CPAIPipeline],
+        available: Mapping[str, CPAIPipeline],
+    ) -> None:
+        self._logger = logging.getLogger(PipelineGraph.__name__)
+        self.order: List[CPAIPipeline] = []
+        visiting: List[str] = []
+        visited: Dict[str, CPAIPipeline] = {}
+
+        def visit(pipeline: CPAIPipeline) -> None:
+            if pipeline.name in visited:
+                return
+            if pipeline.name in visiting:
+                raise PipelineGraphError(
+                    "Pipeline dependency cycle: %s"
+                    % " -> ".join([*visiting, pipeline.name])
+                )
+            visiting.append(pipeline.name)
+            for dependency in pipeline.depends_on:
+                if dependency not in available:
+                    raise PipelineGraphError(
+                        "Pipeline %s depends on unknown pipeline %s"
+                        % (pipeline.name, dependency)
+                    )
+                visit(available[dependency])
+            visiting.pop()
+            visited[pipeline.name] = pipeline
+            self.order.append(pipeline)
+
+        for pipeline in pipelines:
+            visit(pipeline)
+
+    async def run(
+        self,
+        session: aiohttp.ClientSession,
+        event: FrigateEvent,
+        images: Mapping[str, ImageContext],
+        filters: Optional[FilterResults] = None,
+        fetch_images: Optional[ImageFetcher] = None,
+    ) -> Dict[str, Optional[CPAIInference]]:
+        """Run every pipeline on its snapshot in images, returning its
+        inference keyed by pipeline name, in order.
+
+        Pipelines missing from images get theirs from fetch_images, once a
+        thumbnail stage hasn't settled their outcome, so the snapshot is
+        only fetched when it is needed.
+
+        A pipeline that fails, finds nothing, is shed, has no snapshot, or
+        whose dependencies found nothing maps to None. A pipeline shed with
+        pass_through raises AdmissionRejected and cancels the rest.
+
+        The images the pipelines that pass their filter want are declared up
+        front, so those made from the same snapshot come from one decode."""
+        filters = filters or FilterResults(event.as_mapping())
+        for pipeline in self.order:
+            context = images.get(pipeline.name, None)
+            if context is None or not filters.matches(pipeline.filter):
+                continue
+            plan = pipeline.plan(event, context)
+            if plan is not None:
+                context.prepare([plan[0]])
+        tasks: Dict[str, "asyncio.Task[Optional[CPAIInference]]"] = {}
+        for pipeline in self.order:
+            tasks[pipeline.name] = asyncio.ensure_future(
+                self._run_stage(
+                    pipeline,
+                    [tasks[dependency] for dependency in pipeline.depends_on],
+                    session,
+                    event,
+                    images.get(pipeline.name, None),
+                    filters,
+                    fetch_images,
+                )
+            )
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return {name: task.result() for name, task in tasks.items()}
+
+    async def _run_stage(
+        self,
+        pipeline: CPAIPipeline,
+        dependencies: List["asyncio.Task[Optional[CPAIInference]]"],
+        session: aiohttp.ClientSession,
+        event: FrigateEvent,
+        images: Optional[ImageContext],
+        filters: Optional[FilterResults],
+        fetch_images: Optional[ImageFetcher],
+    ) -> Optional[CPAIInference]:
+        for dependency in dependencies:
+            if await asyncio.shield(dependency) is None:
+                return None
+        try:
+            settled, inference = await pipeline.infer_thumbnail(
+                session, event, filters
+            )
+            if settled:
+                return inference
+            if (
+                images is None
+                and fetch_images is not None
+                and (filters or FilterResults(event.as_mapping())).matches(
+                    pipeline.filter
+                )
+            ):
+                images = await fetch_images(pipeline)
+            if images is None:
+                return None
+            return await pipeline.infer(
+                session, event, images.snapshot, filters, images
+            )
+        except AdmissionRejected as exc:
+            if exc.pass_through:
+                raise
+            self._logger.debug(
+                "Shed pipeline %s on event %s: %s"
+                % (pipeline.name, event.id, str(exc))
+            )
+            return None
+        except CircuitOpenError as exc:
+            self._logger.debug(
+                "Skipping pipeline %s on event %s: %s"
+                % (pipeline.name, event.id, str(exc))
+            )
+            return None
+        except Exception as exc:
+            STAGE_ERRORS.labels("pipeline").inc()
+            self._logger.error(
+                "Error running pipeline %s on event %s: %s"
+                % (pipeline.name, event.id, str(exc)),
+                exc_info=exc,
+            )
+            return None
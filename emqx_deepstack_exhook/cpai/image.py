@@ -0,0 +1,139 @@
+import io
+import math
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from PIL import Image
+
+JPEG_SOI = b"\xff\xd8"
+# Start-of-frame markers; C4 (DHT), C8 (JPG) and CC (DAC) share the range.
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Markers that are not followed by a length field.
+JPEG_STANDALONE_MARKERS = frozenset([0x01, *range(0xD0, 0xD8)])
+DEFAULT_QUALITY = 85
+
+Bounds = Tuple[int, int, int, int]
+# Where an image sits in the frame it was made from: the top left corner of
+# its crop, then its horizontal and vertical scale.
+Projection = Tuple[float, float, float, float]
+IDENTITY: Projection = (0.0, 0.0, 1.0, 1.0)
+
+
+def jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """Read (width, height) from a JPEG's frame header without decoding it.
+
+    Returns None if data is not a JPEG or the frame header can't be found."""
+    if not data.startswith(JPEG_SOI):
+        return None
+    view = memoryview(data)
+    i = 2
+    end = len(view)
+    while i + 4 <= end:
+        if view[i] != 0xFF:
+            return None
+        marker = view[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker.
+            i += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            i += 2
+            continue
+        length = (view[i + 2] << 8) | view[i + 3]
+        if marker in JPEG_SOF_MARKERS:
+            if i + 9 > end:
+                return None
+            height = (view[i + 5] << 8) | view[i + 6]
+            width = (view[i + 7] << 8) | view[i + 8]
+            return width, height
+        if marker == 0xDA:
+            # Start of scan without a frame header.
+            return None
+        i += 2 + length
+    return None
+
+
+def crop_bounds(
+    rect: Sequence[int], padding: float, size: Tuple[int, int]
+) -> Optional[Bounds]:
+    """rect, as (x_min, y_min, x_max, y_max), grown on every side by padding
+    times its width and height and clamped to an image of size.
+
+    Returns None if rect is empty or the crop would be the whole image."""
+    if len(rect) != 4:
+        return None
+    x_min, y_min, x_max, y_max = (int(v) for v in rect)
+    if x_max <= x_min or y_max <= y_min:
+        return None
+    width, height = size
+    pad_x = round((x_max - x_min) * padding)
+    pad_y = round((y_max - y_min) * padding)
+    bounds = (
+        max(0, x_min - pad_x),
+        max(0, y_min - pad_y),
+        min(width, x_max + pad_x),
+        min(height, y_max + pad_y),
+    )
+    if bounds[2] <= bounds[0] or bounds[3] <= bounds[1]:
+        return None
+    if bounds == (0, 0, width, height):
+        return None
+    return bounds
+
+
+def scaled_size(size: Tuple[int, int], max_size: Optional[int]) -> Tuple[int, int]:
+    """size shrunk to fit max_size on its longer side, keeping its aspect."""
+    width, height = size
+    if max_size is None or max(width, height) <= max_size:
+        return size
+    scale = max_size / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class ImageSpec(NamedTuple):
+    """An image to make from a snapshot: the part to cut out, if any, the
+    size to scale that to and how to encode it."""
+
+    bounds: Optional[Bounds]
+    size: Tuple[int, int]
+    quality: int = DEFAULT_QUALITY
+    grayscale: bool = False
+
+
+def transform_jpeg(data: bytes, specs: Sequence[ImageSpec]) -> List[bytes]:
+    """Make the JPEG of every spec from a single decode of data.
+
+    data is decoded once, at the smallest of 1/1, 1/2, 1/4 or 1/8 scale
+    that still covers every spec and only in luminance when all of them are
+    grayscale, so a 4K snapshot headed for 640px models never gets fully
+    decoded. Each spec is then cut from that one image."""
+    mode = "L" if all(spec.grayscale for spec in specs) else "RGB"
+    images: List[bytes] = []
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        ratio = 0.0
+        for spec in specs:
+            left, top, right, bottom = spec.bounds or (0, 0, width, height)
+            ratio = max(
+                ratio, spec.size[0] / (right - left), spec.size[1] / (bottom - top)
+            )
+        image.draft(mode, (math.ceil(width * ratio), math.ceil(height * ratio)))
+        scale_x = image.size[0] / width
+        scale_y = image.size[1] / height
+        for spec in specs:
+            left, top, right, bottom = spec.bounds or (0, 0, width, height)
+            region = (
+                round(left * scale_x),
+                round(top * scale_y),
+                round(right * scale_x),
+                round(bottom * scale_y),
+            )
+            result = image.crop(region) if region != (0, 0, *image.size) else image
+            spec_mode = "L" if spec.grayscale else "RGB"
+            if result.mode != spec_mode:
+                result = result.convert(spec_mode)
+            if result.size != spec.size:
+                result = result.resize(spec.size, Image.Resampling.BILINEAR)
+            out = io.BytesIO()
+            result.save(out, "JPEG", quality=spec.quality)
+            images.append(out.getvalue())
+    return images
@@ -0,0 +1,56 @@
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List
+
+
+@dataclass
+class CPAIPrediction:
+    confidence: float
+    label: str
+    x_min: int
+    y_min: int
+    x_max: int
+    y_max: int
+
+
+@dataclass
+class CPAIInference:
+    predictions: List[CPAIPrediction] = field(init=True)
+
+    @classmethod
+    def parse(cls, resp: Dict[str, Any], label="") -> "CPAIInference":
+        return CPAIInference(
+            predictions=[
+                CPAIPrediction(
+                    confidence=prediction["confidence"],
+                    label=(
+                        prediction.get("label", None)
+                        or prediction.get("userid", None)
+                        or label
+                    ),
+                    y_min=prediction["y_min"],
+                    x_min=prediction["x_min"],
+                    y_max=prediction["y_max"],
+                    x_max=prediction["x_max"],
+                )
+                for prediction in resp.get("predictions", [])
+            ],
+        )
+
+    def to_frame(
+        self, x: float, y: float, scale_x: float = 1.0, scale_y: float = 1.0
+    ) -> "CPAIInference":
+        """Map predictions made on a transformed image back to the frame it
+        was made from: cut out at (x, y), then scaled by scale_x and
+        scale_y."""
+        return CPAIInference(
+            predictions=[
+                replace(
+                    p,
+                    x_min=round(p.x_min / scale_x + x),
+                    y_min=round(p.y_min / scale_y + y),
+                    x_max=round(p.x_max / scale_x + x),
+                    y_max=round(p.y_max / scale_y + y),
+                )
+                for p in self.predictions
+            ]
+        )
@@ -0,0 +1,97 @@
+"""Frigate event payloads, decoded only as far as a message needs.
+
+A Frigate event message is {"before": {...}, "after": {...}, "type": ...}
+and only after is used. Without orjson, after is decoded on its own and the
+enriched payload is spliced back into the original bytes, so before is
+never decoded or re-encoded. With orjson installed the whole document goes
+through orjson, which is faster than decoding part of it with json."""
+
+import json
+import re
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_AFTER_KEY = '"after"'
+_COLON = re.compile(r"\s*:\s*")
+# What may follow the after object for it to be a top level key: more
+# members with scalar values, then the end of the document.
+_SCALAR = r'(?:"(?:[^"\\]|\\.)*"|-?\d[\d.eE+-]*|true|false|null)'
+_TAIL = re.compile(
+    r'\s*(?:,\s*"(?:[^"\\]|\\.)*"\s*:\s*' + _SCALAR + r"\s*)*\}\s*$"
+)
+_DECODER = json.JSONDecoder()
+_UNSET: Any = object()
+
+
+def loads(data: bytes | str) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value).encode("utf-8")
+
+
+class FrigatePayload:
+    """Lazily decoded Frigate event message."""
+
+    def __init__(self, raw: bytes) -> None:
+        self.raw = raw
+        self._after: Optional[Dict[str, Any]] = _UNSET
+        self._text: Optional[str] = None
+        self._span: Optional[Tuple[int, int]] = None
+        self._document: Any = _UNSET
+
+    @property
+    def after(self) -> Optional[Dict[str, Any]]:
+        """The after event, or None if the message doesn't have one."""
+        if self._after is _UNSET:
+            after = self._decode_after()
+            self._after = after if isinstance(after, dict) else None
+        return self._after
+
+    def encode(self, after: Dict[str, Any]) -> bytes:
+        """The message with after replaced."""
+        if self._span is not None and self._text is not None:
+            start, end = self._span
+            return (
+                self._text[:start] + json.dumps(after) + self._text[end:]
+            ).encode("utf-8")
+        document = dict(self._decode_document())
+        document["after"] = after
+        return dumps(document)
+
+    def _decode_after(self) -> Any:
+        if orjson is None:
+            try:
+                text = self.raw.decode("utf-8")
+            except UnicodeDecodeError:
+                text = None
+            if text is not None:
+                key = text.find(_AFTER_KEY)
+                while key != -1:
+                    colon = _COLON.match(text, key + len(_AFTER_KEY))
+                    if colon is not None and text[key - 1 : key] != "\\":
+                        try:
+                            after, end = _DECODER.raw_decode(text, colon.end())
+                        except json.JSONDecodeError:
+                            after, end = None, -1
+                        if end != -1 and _TAIL.match(text, end):
+                            self._text = text
+                            self._span = (colon.end(), end)
+                            return after
+                    key = text.find(_AFTER_KEY, key + 1)
+        document = self._decode_document()
+        return document.get("after", None) if isinstance(document, dict) else None
+
+    def _decode_document(self) -> Any:
+        if self._document is _UNSET:
+            self._document = loads(self.raw)
+        return self._document
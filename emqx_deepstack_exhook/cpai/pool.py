@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import random
+from typing import Iterable, List, Optional
+
+import aiohttp
+
+from emqx_deepstack_exhook.config.const import (
+    POOL_LATENCY_WEIGHTED,
+    POOL_LEAST_OUTSTANDING,
+)
+from emqx_deepstack_exhook.cpai.resilience import CircuitOpenError
+from emqx_deepstack_exhook.cpai.types import CPAIServer
+from emqx_deepstack_exhook.metrics import Counter, Gauge
+
+
+class CPAIServerPool:
+    """Named group of CodeProject.AI servers a pipeline can send work to.
+
+    select picks the healthy server with the fewest outstanding or queued
+    requests,
+    or makes a random choice weighted by inverse latency. Servers whose
+    circuit breaker is open are skipped. With a
+    health_check_interval, each server is probed in the background. Dead
+    servers are taken out of rotation and put back once they answer
+    again."""
+
+    def __init__(
+        self,
+        name: str,
+        servers: List[CPAIServer],
+        strategy: str = POOL_LEAST_OUTSTANDING,
+        health_check_interval: Optional[float] = None,
+    ) -> None:
+        self._logger = logging.getLogger(CPAIServerPool.__name__).getChild(name)
+        self.name = name
+        self.servers = servers
+        self.strategy = strategy
+        self.health_check_interval = health_check_interval
+        self._task: Optional[asyncio.Task] = None
+
+    def __repr__(self) -> str:
+        return f"CPAIServerPool(name={self.name!r}, servers={[s.name for s in self.servers]!r})"
+
+    def select(self) -> CPAIServer:
+        candidates = [s for s in self.servers if s.available] or [
+            s for s in self.servers if s.breaker is not None and s.breaker.available
+        ]
+        if len(candidates) == 0:
+            raise CircuitOpenError(f"No server in pool {self.name} is available")
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.strategy == POOL_LATENCY_WEIGHTED:
+            known = [s.latency for s in candidates if s.latency is not None]
+            default = sum(known) / len(known) if len(known) > 0 else 1.0
+            weights = [
+                1.0 / ((s.latency or default) * (s.load + 1))
+                for s in candidates
+            ]
+            return random.choices(candidates, weights=weights)[0]
+        return min(
+            candidates,
+            key=lambda s: (s.load, s.latency or 0.0),
+        )
+
+    def start_health_checks(self, session: aiohttp.ClientSession) -> None:
+        if self.health_check_interval is None or self._task is not None:
+            return
+        self._task = asyncio.get_running_loop().create_task(
+            self._health_checks(session)
+        )
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _health_checks(self, session: aiohttp.ClientSession) -> None:
+        assert self.health_check_interval is not None
+        while True:
+            results = await asyncio.gather(
+                *[
+                    s.client.ping(session, self.health_check_interval)
+                    for s in self.servers
+                ]
+            )
+            for server, alive in zip(self.servers, results):
+                if alive and not server.healthy:
+                    self._logger.info("Server %s is back", server.name)
+                elif not alive and server.healthy:
+                    self._logger.warning("Server %s failed its health check", server.name)
+                server.set_healthy(alive)
+            await asyncio.sleep(self.health_check_interval)
+
+
+def server_metrics(servers: Iterable[CPAIServer]) -> Iterable[Gauge | Counter]:
+    """Scrape-time per-node load stats."""
+    outstanding = Gauge(
+        "exhook_cpai_server_outstanding",
+        "Outstanding requests per CodeProject.AI server",
+        ["server"],
+        registry=None,
+    )
+    latency = Gauge(
+        "exhook_cpai_server_latency_seconds",
+        "Moving average request latency per CodeProject.AI server",
+        ["server"],
+        registry=None,
+    )
+    healthy = Gauge(
+        "exhook_cpai_server_healthy",
+        "Whether the CodeProject.AI server is in rotation",
+        ["server"],
+        registry=None,
+    )
+    requests = Counter(
+        "exhook_cpai_server_requests",
+        "Requests per CodeProject.AI server by outcome",
+        ["server", "outcome"],
+        registry=None,
+    )
+    for server in servers:
+        outstanding.labels(server.name).set(server.outstanding)
+        latency.labels(server.name).set(server.latency or 0.0)
+        healthy.labels(server.name).set(1 if server.healthy else 0)
+        requests.labels(server.name, "success").set(server.requests - server.failures)
+        requests.labels(server.name, "failure").set(server.failures)
+    return (outstanding, latency, healthy, requests)
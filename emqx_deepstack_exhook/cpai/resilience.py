@@ -0,0 +1,136 @@
+import asyncio
+import time
+from types import TracebackType
+from typing import Optional, Type
+
+import aiohttp
+
+from emqx_deepstack_exhook.cpai.client import CPAIClientError
+from emqx_deepstack_exhook.metrics import Counter, Gauge
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+BREAKER_STATE = Gauge(
+    "exhook_circuit_breaker_open",
+    "Whether an upstream's circuit breaker is open",
+    ["upstream"],
+)
+BREAKER_REJECTED = Counter(
+    "exhook_circuit_breaker_rejected",
+    "Calls failed fast by an open circuit breaker",
+    ["upstream"],
+)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def is_upstream_failure(exc: Optional[BaseException]) -> bool:
+    """Whether exc means the upstream is unhealthy rather than that it
+    refused one request.
+
+    Only connection errors, timeouts and 5xx responses are failures."""
+    if isinstance(exc, (aiohttp.ClientResponseError, CPAIClientError)):
+        return exc.status is None or exc.status >= 500
+    return True
+
+
+class CircuitBreaker:
+    """Fails calls to an upstream fast after repeated failures.
+
+    After failure_threshold consecutive failures the breaker opens and
+    rejects calls for reset_timeout seconds. It then lets a single trial
+    call through: success closes the breaker, failure re-opens it.
+    Cancellation does not count as a failure, and neither do 4xx or
+    unsuccessful responses: the upstream answered, the request was just
+    refused, as when Frigate no longer has an event's snapshot or a
+    pipeline asks CodeProject.AI for a model it doesn't have.
+
+    Use it as a context manager around the upstream call."""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._state_gauge = BREAKER_STATE.labels(name)
+        self._rejected = BREAKER_REJECTED.labels(name)
+
+    @property
+    def available(self) -> bool:
+        """Whether a call would currently be let through."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self._opened_at >= self.reset_timeout
+        return not self._trial_running
+
+    def __enter__(self) -> "CircuitBreaker":
+        if not self.available:
+            self._rejected.inc()
+            raise CircuitOpenError(f"Circuit breaker for {self.name} is open")
+        if self.state != CLOSED:
+            self.state = HALF_OPEN
+            self._trial_running = True
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        trial = self._trial_running
+        self._trial_running = False
+        if exc_type is None or not is_upstream_failure(exc):
+            self.failures = 0
+            self._set_state(CLOSED)
+        elif issubclass(exc_type, asyncio.CancelledError):
+            if trial:
+                self._set_state(OPEN)
+        else:
+            self.failures += 1
+            if trial or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        self._state_gauge.set(1 if state == OPEN else 0)
+
+
+class Deadline:
+    """Absolute deadline shared by the stages of one request.
+
+    A Deadline without a timeout never expires."""
+
+    def __init__(self, timeout: Optional[float] = None) -> None:
+        self.expires = None if timeout is None else time.monotonic() + timeout
+
+    def remaining(self) -> Optional[float]:
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def budget(self, share: float) -> Optional[float]:
+        """share of the remaining time, for a stage that must leave room for
+        the stages after it."""
+        remaining = self.remaining()
+        return None if remaining is None else remaining * share
@@ -0,0 +1,253 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from emqx_deepstack_exhook.cpai.image import JPEG_SOI, jpeg_size
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL = 60.0
+DEFAULT_TOPIC_PREFIX = "frigate"
+DEFAULT_MAX_AGE = 5.0
+DEFAULT_MAX_ENTRIES = 64
+# Frigate updates an event every few seconds while it lasts, so one not
+# heard of for this long has ended without us seeing it end.
+ACTIVE_EVENT_TTL = 300.0
+
+
+class _Fetch:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Future[bytes]") -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SnapshotCache:
+    """Byte-budgeted LRU/TTL cache of snapshot bytes.
+
+    Concurrent lookups of a key that is not cached yet share a single
+    in-flight fetch, which is cancelled once every caller waiting on it has
+    been cancelled. Failed fetches are not cached."""
+
+    def __init__(
+        self, max_bytes: int = DEFAULT_MAX_BYTES, ttl: float = DEFAULT_TTL
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[bytes, float]]" = OrderedDict()
+        self._inflight: Dict[Hashable, _Fetch] = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether key is cached and fresh, without counting a lookup."""
+        entry = self._entries.get(key, None)
+        return entry is not None and entry[1] > time.monotonic()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    async def get(
+        self, key: Hashable, fetch: Callable[[], Awaitable[bytes]]
+    ) -> bytes:
+        entry = self._entries.get(key, None)
+        if entry is not None:
+            data, expires = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self._remove(key)
+
+        inflight = self._inflight.get(key, None)
+        if inflight is None:
+            self.misses += 1
+            inflight = self._inflight[key] = _Fetch(
+                asyncio.ensure_future(self._fetch(key, fetch))
+            )
+        else:
+            self.hits += 1
+        inflight.waiters += 1
+        try:
+            return await asyncio.shield(inflight.task)
+        finally:
+            inflight.waiters -= 1
+            # Nobody wants the result anymore, so stop downloading it.
+            if inflight.waiters == 0 and not inflight.task.done():
+                inflight.task.cancel()
+                # A task cancelled before it starts never runs its cleanup.
+                if self._inflight.get(key, None) is inflight:
+                    del self._inflight[key]
+
+    async def _fetch(
+        self, key: Hashable, fetch: Callable[[], Awaitable[bytes]]
+    ) -> bytes:
+        try:
+            data = await fetch()
+            self._put(key, data)
+            return data
+        finally:
+            inflight = self._inflight.get(key, None)
+            if inflight is not None and inflight.task is asyncio.current_task():
+                del self._inflight[key]
+
+    def _put(self, key: Hashable, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (data, time.monotonic() + self.ttl)
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        data, _ = self._entries.pop(key)
+        self.size -= len(data)
+
+
+class PublishedSnapshots:
+    """Latest snapshot Frigate published over MQTT for each camera and label.
+
+    Frigate publishes the best snapshot of the latest object of every label
+    to <topic_prefix>/<camera>/<label>/snapshot whenever it changes. Only
+    the most recent max_entries camera and label pairs are kept.
+
+    A stored snapshot only answers for an event if it was received after the
+    event's snapshot_time and no more than max_age seconds later, so one
+    published for an earlier best frame is never mistaken for it. This
+    relies on the clocks of Frigate and the exhook agreeing.
+
+    Frigate publishes one snapshot per camera and label, not per event, so
+    while two objects of a label are tracked on a camera there is no telling
+    whose snapshot it is. Events are observed as they come in, and a
+    snapshot is only used while the event asking is the only active one for
+    its camera and label.
+
+    Frigate's MQTT snapshots should be configured without crop, bounding
+    box or timestamp. Cropped ones are rejected, but drawn on ones can't be
+    told apart from clean ones."""
+
+    def __init__(
+        self,
+        topic_prefix: str = DEFAULT_TOPIC_PREFIX,
+        max_age: float = DEFAULT_MAX_AGE,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        self.topic_prefix = topic_prefix
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[bytes, float]]" = (
+            OrderedDict()
+        )
+        self._active: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self.stored = 0
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.ambiguous = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def subscription(self) -> str:
+        return f"{self.topic_prefix}/+/+/snapshot"
+
+    def put(self, topic: str, payload: bytes) -> bool:
+        """Store payload if topic is a snapshot topic.
+
+        Returns whether it was, whatever became of the payload."""
+        prefix = self.topic_prefix + "/"
+        if not topic.startswith(prefix) or not topic.endswith("/snapshot"):
+            return False
+        parts = topic[len(prefix) : -len("/snapshot")].split("/")
+        if len(parts) != 2:
+            return False
+        if not payload.startswith(JPEG_SOI):
+            return True
+        key = (parts[0], parts[1])
+        self._entries[key] = (payload, time.time())
+        self._entries.move_to_end(key)
+        self.stored += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return True
+
+    def observe(
+        self,
+        event_id: Optional[str],
+        camera: Optional[str],
+        label: Optional[str],
+        ended: bool,
+    ) -> None:
+        """Note that an event was seen, and whether it has ended."""
+        if not event_id or not camera or not label:
+            return
+        key = (camera, label)
+        now = time.monotonic()
+        active = self._active.get(key, None)
+        if active is not None:
+            expired = now - ACTIVE_EVENT_TTL
+            for stale in [i for i, seen in active.items() if seen < expired]:
+                del active[stale]
+        if ended:
+            if active is not None:
+                active.pop(event_id, None)
+        else:
+            if active is None:
+                active = self._active[key] = {}
+            active[event_id] = now
+        if active is not None and not active:
+            del self._active[key]
+
+    def get(
+        self,
+        event_id: str,
+        camera: str,
+        label: Optional[str],
+        snapshot_time: Optional[float],
+        frame: Optional[Tuple[int, int]],
+    ) -> Optional[bytes]:
+        """The snapshot for an event on camera, if a fresh one was published.
+
+        frame is the camera's frame size. The snapshot must show the whole
+        frame, possibly scaled down, or event boxes can't be mapped into it;
+        without frame it can't be checked and isn't used."""
+        entry = self._entries.get((camera, label), None) if label else None
+        if entry is None or snapshot_time is None:
+            self.misses += 1
+            return None
+        others = self._active.get((camera, label), {}).keys() - {event_id}
+        if others:
+            self.ambiguous += 1
+            return None
+        data, received = entry
+        if not snapshot_time <= received <= snapshot_time + self.max_age:
+            self.misses += 1
+            return None
+        size = jpeg_size(data)
+        if (
+            size is None
+            or frame is None
+            or size[0] > frame[0]
+            or abs(size[0] * frame[1] - size[1] * frame[0]) > max(frame)
+        ):
+            self.rejected += 1
+            return None
+        self.hits += 1
+        return data
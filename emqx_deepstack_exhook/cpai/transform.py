@@ -0,0 +1,133 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from emqx_deepstack_exhook.cpai.image import (
+    IDENTITY,
+    ImageSpec,
+    Projection,
+    jpeg_size,
+    transform_jpeg,
+)
+from emqx_deepstack_exhook.cpai.snapshot import SnapshotCache
+from emqx_deepstack_exhook.metrics import STAGE_LATENCY
+
+DEFAULT_WORKERS = 2
+
+_UNSET: Any = object()
+
+
+class ImageTransformer:
+    """Runs image transforms off the event loop.
+
+    Transforms go to a pool of worker processes, started on first use so
+    configs without transforms never spawn one; with no workers they run in
+    the loop's default thread executor instead. cache holds the results,
+    shared by every message about the same snapshot; it may be the snapshot
+    cache itself, so one byte budget covers both."""
+
+    def __init__(
+        self, workers: int = DEFAULT_WORKERS, cache: Optional[SnapshotCache] = None
+    ) -> None:
+        self.workers = workers
+        self.cache = cache if cache is not None else SnapshotCache()
+        self._executor: Optional[Executor] = None
+
+    async def run(self, snapshot: bytes, specs: List[ImageSpec]) -> List[bytes]:
+        """transform_jpeg(snapshot, specs) in the pool."""
+        with STAGE_LATENCY.labels("transform").time():
+            return await asyncio.get_running_loop().run_in_executor(
+                self._pool(), transform_jpeg, snapshot, specs
+            )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _pool(self) -> Optional[Executor]:
+        if self.workers == 0:
+            return None
+        if self._executor is None:
+            # Forking a process that runs gRPC threads is unsafe.
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+
+class ImageContext:
+    """The snapshot of one message and the images its pipelines make of it.
+
+    Specs declared with prepare are made together, from one decode of the
+    snapshot in one trip to the pool, the first time any of them is asked
+    for. The work therefore grows with the number of distinct images rather
+    than the number of pipelines, and pipelines asking for the same image
+    share it. key identifies the snapshot in the transformer's cache.
+
+    frame is the size of the camera frame when Frigate scaled the snapshot
+    down from it, so that coordinates can be mapped between the two."""
+
+    def __init__(
+        self,
+        transformer: ImageTransformer,
+        key: Hashable,
+        snapshot: bytes,
+        frame: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        self.transformer = transformer
+        self.key = key
+        self.snapshot = snapshot
+        self.frame = frame
+        self._size: Optional[Tuple[int, int]] = _UNSET
+        # Insertion ordered set of declared specs.
+        self._declared: Dict[ImageSpec, None] = {}
+        self._batches: Dict[ImageSpec, Tuple["asyncio.Task[List[bytes]]", int]] = {}
+
+    @property
+    def size(self) -> Optional[Tuple[int, int]]:
+        """The snapshot's size, or None if it isn't a JPEG."""
+        if self._size is _UNSET:
+            self._size = jpeg_size(self.snapshot)
+        return self._size
+
+    @property
+    def projection(self) -> Projection:
+        """Where the snapshot sits in the camera frame."""
+        size = self.size
+        if self.frame is None or size is None or size == self.frame:
+            return IDENTITY
+        return (0.0, 0.0, size[0] / self.frame[0], size[1] / self.frame[1])
+
+    def prepare(self, specs: Iterable[ImageSpec]) -> None:
+        """Declare images that are likely to be asked for."""
+        for spec in specs:
+            self._declared.setdefault(spec, None)
+
+    async def get(self, spec: ImageSpec) -> bytes:
+        return await self.transformer.cache.get(
+            (self.key, spec), lambda: self._make(spec)
+        )
+
+    async def _make(self, spec: ImageSpec) -> bytes:
+        batch = self._batches.get(spec, None)
+        if batch is None:
+            specs = [
+                spec,
+                *[
+                    s
+                    for s in self._declared
+                    if s != spec
+                    and s not in self._batches
+                    and (self.key, s) not in self.transformer.cache
+                ],
+            ]
+            task = asyncio.ensure_future(self.transformer.run(self.snapshot, specs))
+            # Nobody may be waiting when it fails.
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            for index, s in enumerate(specs):
+                self._batches[s] = (task, index)
+            batch = self._batches[spec]
+        task, index = batch
+        return (await asyncio.shield(task))[index]
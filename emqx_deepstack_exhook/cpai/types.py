@@ -1,35 +1,66 @@
-import asyncio
+import base64
+import binascii
 import logging
-import concurrent.futures
-import codeprojectai.core as cpai
-from typing import Any, Dict, List, Optional, Tuple, Union
-from dataclasses import dataclass, field
-import re
-from jq import _Program
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Mapping, Optional, Tuple
+from dataclasses import dataclass, field, fields, replace
+from types import MappingProxyType
 
 
 import aiohttp
 
+from emqx_deepstack_exhook.config import (
+    CropConfig,
+    SnapshotConfig,
+    ThumbnailConfig,
+    TransformConfig,
+)
 from emqx_deepstack_exhook.config.const import (
+    CROP_BOX,
     PIPELINE_FACE_DETECT,
     PIPELINE_FACE_RECOGNIZE,
-    PIPELINE_OBJECT,
 )
-from emqx_deepstack_exhook.pb2.exhook_pb2 import Message
+from emqx_deepstack_exhook.cpai.admission import Admission
+from emqx_deepstack_exhook.cpai.client import CPAIClient
+from emqx_deepstack_exhook.cpai.filter import EventFilter, FilterResults
+from emqx_deepstack_exhook.cpai.image import (
+    DEFAULT_QUALITY,
+    IDENTITY,
+    JPEG_SOI,
+    ImageSpec,
+    Projection,
+    crop_bounds,
+    scaled_size,
+)
+from emqx_deepstack_exhook.cpai.inference import CPAIInference, CPAIPrediction
+from emqx_deepstack_exhook.cpai.resilience import CircuitBreaker
+from emqx_deepstack_exhook.cpai.transform import ImageContext, ImageTransformer
+from emqx_deepstack_exhook.metrics import (
+    PIPELINE_IN_FLIGHT,
+    PIPELINE_LATENCY,
+    PIPELINE_THUMBNAILS,
+)
 
 
-def apply_anchors(pattern: str) -> str:
-    return f"^{pattern}$"
+if TYPE_CHECKING:
+    from emqx_deepstack_exhook.cpai.pool import CPAIServerPool
 
+LATENCY_SMOOTHING = 0.2
 
-class InferenceError(Exception):
-    def __init__(self, *args: object, inferences: List["CPAIInference"]) -> None:
-        super().__init__(*args)
-        self.inferences = inferences
 
+NO_EXTRAS: Mapping[str, Any] = MappingProxyType({})
 
-@dataclass
+
+@dataclass(slots=True)
 class FrigateEvent:
+    """A Frigate event.
+
+    Keys this class doesn't know about, such as fields added by a newer
+    Frigate, are kept in extras rather than rejected. Build one with
+    from_dict to have to_dict write changes back into the decoded dict
+    instead of copying the event."""
+
     id: str = field(init=True)
     camera: str = field(init=True)
     frame_time: Optional[float] = field(default=None, init=True)
@@ -62,143 +93,70 @@ class FrigateEvent:
         default_factory=lambda: [],
         init=True,
     )
-
-
-@dataclass
-class CPAIPrediction:
-    confidence: float
-    label: str
-    x_min: int
-    y_min: int
-    x_max: int
-    y_max: int
-
-
-@dataclass
-class CPAIInference:
-    predictions: List[CPAIPrediction] = field(init=True)
+    extras: Mapping[str, Any] = field(default_factory=lambda: NO_EXTRAS, init=True)
+    _source: Optional[Dict[str, Any]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _view: Optional["FrigateEventView"] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     @classmethod
-    def parse(cls, resp: Dict[str, Any], label="") -> "CPAIInference":
-        return CPAIInference(
-            predictions=[
-                CPAIPrediction(
-                    confidence=prediction["confidence"],
-                    label=(
-                        label
-                        if prediction.get("label", None) is None
-                        else prediction.get("label", None)
-                    ),
-                    y_min=prediction["y_min"],
-                    x_min=prediction["x_min"],
-                    y_max=prediction["y_max"],
-                    x_max=prediction["x_max"],
-                )
-                for prediction in resp.get("predictions", [])
-            ],
+    def from_dict(cls, data: Dict[str, Any]) -> "FrigateEvent":
+        known: Dict[str, Any] = {}
+        extras: Dict[str, Any] = {}
+        for key, value in data.items():
+            if key in _EVENT_FIELD_SET:
+                known[key] = value
+            else:
+                extras[key] = value
+        event = cls(
+            **known, extras=MappingProxyType(extras) if extras else NO_EXTRAS
         )
+        event._source = data
+        return event
 
+    def as_mapping(self) -> "FrigateEventView":
+        """Read-only mapping view of the event, including extras."""
+        if self._view is None:
+            self._view = FrigateEventView(self)
+        return self._view
 
-@dataclass
-class CPAIServer:
-    name: str
-    host: str
-    port: int
-
+    def thumbnail_jpeg(self) -> Optional[bytes]:
+        """The event's base64 thumbnail decoded, if it has a JPEG one."""
+        if not isinstance(self.thumbnail, str):
+            return None
+        try:
+            data = base64.b64decode(self.thumbnail, validate=True)
+        except (binascii.Error, ValueError):
+            return None
+        return data if data.startswith(JPEG_SOI) else None
 
-@dataclass
-class CPAIPipeline:
-    name: str
-    pipeline_type: str
-    server: CPAIServer
-    frigate: str
-    model: Optional[str]
-    threshold: float
-    result_topic: Optional[str]
-    filter: Optional[_Program]
-    inference_api: Union[cpai.CodeProjectAIObject, cpai.CodeProjectAIFace] = field(
-        init=False, repr=False
-    )
+    def to_dict(self) -> Dict[str, Any]:
+        """The event as a dict ready for JSON encoding.
 
-    def __post_init__(self):
-        if self.pipeline_type == PIPELINE_OBJECT:
-            self.inference_api = cpai.CodeProjectAIObject(
-                ip=self.server.host,
-                port=self.server.port,
-                min_confidence=self.threshold,
-                custom_model=self.model or "",
-            )
-        elif (
-            self.pipeline_type == PIPELINE_FACE_DETECT
-            or self.pipeline_type == PIPELINE_FACE_RECOGNIZE
-        ):
-            self.inference_api = cpai.CodeProjectAIFace(
-                ip=self.server.host,
-                port=self.server.port,
-                min_confidence=self.threshold,
-            )
+        For an event built by from_dict this is the source dict, updated in
+        place."""
+        data = self._source if self._source is not None else dict(self.extras)
+        for name in EVENT_FIELDS:
+            data[name] = getattr(self, name)
+        return data
 
-    async def infer(
-        self, session: aiohttp.ClientSession, event: FrigateEvent, snapshot: bytes
-    ) -> Tuple[Optional[CPAIInference], FrigateEvent]:
-        if (
-            self.filter is not None
-            and not self.filter.input_value(event.__dict__).first()
-        ):
-            return None, event
-        logging.getLogger(CPAIPipeline.__name__).info(
-            f"Detect {self.inference_api.detect} Recognize {self.inference_api.recognize}"
-        )
-        loop = asyncio.get_running_loop()
-        with concurrent.futures.ThreadPoolExecutor() as pool:
-            if "recognize" in self.pipeline_type:
-                result = await loop.run_in_executor(
-                    pool, self.inference_api.recognize, snapshot  # type: ignore
-                )
-            else:
-                result = await loop.run_in_executor(
-                    pool, self.inference_api.detect, snapshot  # type: ignore
-                )
-        inference = CPAIInference.parse(
-            {
-                "predictions": result,
-                "label": "face" if "face" in self.pipeline_type else "",
-            }
-        )
-        logging.getLogger("CPAIPipeline.infer").warn(f"RESULTS {inference}")
-        if len(inference.predictions) == 0:
-            return None, event
-        if self.pipeline_type == PIPELINE_FACE_DETECT:
-            for p in inference.predictions:
-                p.label = "face"
-        return inference, await self.set_sub_label(
-            session, event, inference.predictions
-        )
+    def merge_predictions(self, predictions: List[CPAIPrediction]) -> bool:
+        """Fold predictions into the event's attributes and sub label.
 
-    async def set_sub_label(
-        self,
-        session: aiohttp.ClientSession,
-        event: FrigateEvent,
-        predictions: List[CPAIPrediction],
-    ) -> FrigateEvent:
+        Returns True if the sub label changed."""
         if len(predictions) == 0:
-            return event
+            return False
         sorted_attributes = sorted(
             predictions, key=lambda x: x.confidence, reverse=True
         )
         top_label = sorted_attributes[0]
-        _, sub_score = event.sub_label or (None, None)
-        if sub_score is None or sub_score < top_label.confidence:
-            async with session.post(
-                f"{self.frigate}/api/events/{event.id}/sub_label",
-                json={
-                    "subLabel": top_label.label,
-                    "subLabelScore": top_label.confidence,
-                },
-            ) as resp:
-                resp.raise_for_status()
-            event.sub_label = (top_label.label, top_label.confidence)
-        attributes = {k: v for k, v in event.attributes.items()}
+        _, sub_score = self.sub_label or (None, None)
+        changed = sub_score is None or sub_score < top_label.confidence
+        if changed:
+            self.sub_label = (top_label.label, top_label.confidence)
+        attributes = {k: v for k, v in self.attributes.items()}
         attributes.update(
             {
                 p.label: p.confidence
@@ -206,8 +164,9 @@ class CPAIPipeline:
                 if p.confidence > attributes.get(p.label, 0.0)
             }
         )
+        self.attributes = attributes
         all_attributes = [
-            *event.current_attributes,
+            *self.current_attributes,
             *[
                 {
                     "label": p.label,
@@ -218,70 +177,303 @@ class CPAIPipeline:
             ],
         ]
 
-        def key(a: Dict[str, Any]) -> str:
-            return f"{a['box'][0]} {a['box'][1]} {a['box'][2]}{a['box'][3]}"
+        # Keyed by label too: predictions from a thumbnail all share the
+        # event's box, and different labels there are different findings.
+        def key(a: Dict[str, Any]) -> Tuple[Any, ...]:
+            return (a.get("label", None), *a["box"])
 
-        current_attributes: Dict[str, Dict[str, Any]] = {}
+        current_attributes: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
         [
             current_attributes.update({key(a): a})
             for a in all_attributes
             if key(a) not in current_attributes
         ]
-        event.current_attributes = list(current_attributes.values())
-        return event
+        self.current_attributes = list(current_attributes.values())
+        return changed
+
+
+EVENT_FIELDS: Tuple[str, ...] = tuple(
+    f.name for f in fields(FrigateEvent) if f.name != "extras" and f.init
+)
+_EVENT_FIELD_SET = frozenset(EVENT_FIELDS)
+
+
+class FrigateEventView(Mapping[str, Any]):
+    __slots__ = ("_event",)
+
+    def __init__(self, event: FrigateEvent) -> None:
+        self._event = event
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _EVENT_FIELD_SET:
+            return getattr(self._event, key)
+        return self._event.extras[key]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from EVENT_FIELDS
+        yield from self._event.extras
+
+    def __len__(self) -> int:
+        return len(EVENT_FIELDS) + len(self._event.extras)
 
 
 @dataclass
-class CPAITopic:
-    subscribe: str
-    pipelines: List[CPAIPipeline]
-    filter: Optional[_Program]
-    topic_pattern: re.Pattern = field(init=False)
-    _logger: logging.Logger = field(
-        default=logging.getLogger("CPAITopic"), init=False, repr=False
-    )
+class CPAIServer:
+    name: str
+    host: str
+    port: int
+    breaker: Optional[CircuitBreaker] = field(default=None, repr=False)
+    admission: Optional[Admission] = field(default=None, repr=False)
+    client: CPAIClient = field(init=False, repr=False)
+    outstanding: int = field(default=0, init=False)
+    latency: Optional[float] = field(default=None, init=False)
+    healthy: bool = field(default=True, init=False)
+    requests: int = field(default=0, init=False)
+    failures: int = field(default=0, init=False)
 
     def __post_init__(self):
-        self.topic_pattern = re.compile(
-            apply_anchors(
-                self.subscribe.replace("/", r"\/")
-                .replace("+", r"[^\/]+?")
-                .replace("#", r".+")
-            )
-        )
+        self.client = CPAIClient(self.host, self.port, name=self.name)
+        if self.breaker is None:
+            self.breaker = CircuitBreaker(self.name)
+        if self.admission is None:
+            self.admission = Admission("server", self.name)
 
-    def matches_subscription(self, topic: str) -> bool:
-        if topic is None or len(topic.strip()) == 0:
-            return False
-        if self.subscribe == topic:
-            return True
-        if "$" in [topic[0], self.subscribe[0]] and topic[0] != self.subscribe[0]:
-            return True
+    @property
+    def available(self) -> bool:
+        assert self.breaker is not None
+        return self.healthy and self.breaker.available
 
-        if not self.topic_pattern.match(topic):
-            return False
-        return True
-
-    async def process_event(
-        self, session: aiohttp.ClientSession, event: FrigateEvent, snapshot: bytes
-    ) -> Tuple[FrigateEvent, bool]:
-        logger = self._logger.getChild(self.subscribe)
-        inferences: List[CPAIInference] = []
-        logger.info(self.pipelines)
-        for pipeline in self.pipelines:
+    @property
+    def load(self) -> int:
+        """Requests in flight plus requests queued for admission."""
+        assert self.admission is not None
+        return self.outstanding + self.admission.waiting
+
+    def set_healthy(self, healthy: bool) -> None:
+        self.healthy = healthy
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """Account for one request: outstanding count, latency and failures.
+
+        Raises CircuitOpenError without calling out if the server's circuit
+        breaker is open."""
+        assert self.breaker is not None
+        with self.breaker:
+            self.outstanding += 1
+            self.requests += 1
+            start = time.perf_counter()
             try:
-                inference, event = await pipeline.infer(session, event, snapshot)
-                if not inference or len(inference.predictions) == 0:
-                    return event, False
-                inferences.append(inference)
-            except Exception as exc:
-                logger.error(
-                    "Error running inference on event %s: %s" % (event.id, str(exc)),
-                    exc_info=exc,
+                yield
+            except Exception:
+                self.failures += 1
+                raise
+            else:
+                elapsed = time.perf_counter() - start
+                self.latency = (
+                    elapsed
+                    if self.latency is None
+                    else self.latency + LATENCY_SMOOTHING * (elapsed - self.latency)
                 )
-                raise InferenceError(
-                    "Error running inference on event %s: %s" % (event.id, str(exc)),
-                    inferences=inferences,
-                ) from exc
+            finally:
+                self.outstanding -= 1
+
+
+@dataclass
+class CPAIPipeline:
+    name: str
+    pipeline_type: str
+    server: "CPAIServerPool"
+    model: Optional[str]
+    threshold: float
+    result_topic: Optional[str]
+    filter: Optional[EventFilter]
+    depends_on: List[str] = field(default_factory=list)
+    admission: Optional[Admission] = field(default=None, repr=False)
+    crop: Optional[CropConfig] = None
+    transform: Optional[TransformConfig] = None
+    snapshot: Optional[SnapshotConfig] = None
+    thumbnail: Optional[ThumbnailConfig] = None
+
+    def __post_init__(self):
+        if self.admission is None:
+            self.admission = Admission("pipeline", self.name)
 
-        return event, True
+    def plan(
+        self, event: FrigateEvent, images: ImageContext
+    ) -> Optional[Tuple[ImageSpec, Projection]]:
+        """The image this pipeline wants made from the snapshot of images,
+        along with where that image sits in the camera frame: the top left
+        corner of its crop and its scale.
+
+        crop cuts out the event's box or region plus padding and transform
+        shrinks the image to max_size, re-encodes it and optionally drops
+        colour. None means the snapshot itself: without either, when the
+        event has no usable box, or when there's nothing to do."""
+        size = images.size
+        if (self.crop is None and self.transform is None) or size is None:
+            return None
+        # Event boxes are in frame coordinates, the snapshot may be smaller.
+        _, _, frame_x, frame_y = images.projection
+        bounds = None
+        if self.crop is not None:
+            rect = event.box if self.crop.to == CROP_BOX else event.region
+            if rect is not None and len(rect) == 4:
+                rect = [
+                    round(v * s)
+                    for v, s in zip(rect, (frame_x, frame_y, frame_x, frame_y))
+                ]
+                bounds = crop_bounds(rect, self.crop.padding, size)
+        left, top, right, bottom = bounds or (0, 0, *size)
+        source = (right - left, bottom - top)
+        transform = self.transform
+        scaled = scaled_size(source, transform.max_size if transform else None)
+        grayscale = transform is not None and transform.grayscale
+        if bounds is None and scaled == size and not grayscale:
+            return None
+        spec = ImageSpec(
+            bounds,
+            scaled,
+            transform.quality if transform else DEFAULT_QUALITY,
+            grayscale,
+        )
+        return spec, (
+            left / frame_x,
+            top / frame_y,
+            scaled[0] / source[0] * frame_x,
+            scaled[1] / source[1] * frame_y,
+        )
+
+    async def preprocess(
+        self, event: FrigateEvent, images: ImageContext
+    ) -> Tuple[bytes, Projection]:
+        """The image to send for inference and its projection, see plan."""
+        plan = self.plan(event, images)
+        if plan is None:
+            return images.snapshot, images.projection
+        spec, projection = plan
+        return await images.get(spec), projection
+
+    async def infer(
+        self,
+        session: aiohttp.ClientSession,
+        event: FrigateEvent,
+        snapshot: bytes,
+        filters: Optional[FilterResults] = None,
+        images: Optional[ImageContext] = None,
+    ) -> Optional[CPAIInference]:
+        """Run inference on snapshot, or the image plan asks images to make
+        of it; prediction coordinates are always relative to the camera
+        frame, which is the snapshot's unless Frigate scaled it.
+
+        Returns None when the event is filtered out or nothing was found. The
+        event is not modified; results are merged by the caller. Raises
+        AdmissionRejected if the pipeline or the chosen server sheds the
+        request."""
+        if not (filters or FilterResults(event.as_mapping())).matches(self.filter):
+            return None
+        if images is None:
+            images = ImageContext(
+                ImageTransformer(workers=0), (event.id, event.snapshot_time), snapshot
+            )
+        image, projection = await self.preprocess(event, images)
+        inference = await self._detect(session, image, self.threshold)
+        if len(inference.predictions) == 0:
+            return None
+        if projection != IDENTITY:
+            inference = inference.to_frame(*projection)
+        return inference
+
+    def uses_thumbnail(self, event: FrigateEvent) -> bool:
+        """Whether infer_thumbnail has anything to work with for event."""
+        return (
+            self.thumbnail is not None
+            and event.box is not None
+            and len(event.box) == 4
+            and isinstance(event.thumbnail, str)
+        )
+
+    async def infer_thumbnail(
+        self,
+        session: aiohttp.ClientSession,
+        event: FrigateEvent,
+        filters: Optional[FilterResults] = None,
+    ) -> Tuple[bool, Optional[CPAIInference]]:
+        """Run inference on the event's thumbnail first, returning whether
+        that settled the outcome along with the inference.
+
+        It is settled when the top prediction reaches thumbnail.accept, or
+        when nothing reaches thumbnail.reject; anything in between needs the
+        snapshot. Frigate doesn't say which part of the frame a thumbnail
+        shows, so accepted predictions are given the event's box; each
+        label is still kept apart in current_attributes."""
+        if not self.uses_thumbnail(event):
+            return False, None
+        assert self.thumbnail is not None and event.box is not None
+        if not (filters or FilterResults(event.as_mapping())).matches(self.filter):
+            return True, None
+        image = event.thumbnail_jpeg()
+        if image is None:
+            return False, None
+        accept, reject = self.thumbnail.accept, self.thumbnail.reject
+        inference = await self._detect(
+            session, image, min(self.threshold, accept if reject is None else reject)
+        )
+        top = max((p.confidence for p in inference.predictions), default=0.0)
+        if top >= accept:
+            PIPELINE_THUMBNAILS.labels(self.name, "accepted").inc()
+            x_min, y_min, x_max, y_max = event.box
+            predictions = [
+                replace(p, x_min=x_min, y_min=y_min, x_max=x_max, y_max=y_max)
+                for p in inference.predictions
+                if p.confidence >= self.threshold
+            ]
+            if len(predictions) == 0:
+                return True, None
+            return True, CPAIInference(predictions=predictions)
+        if reject is not None and top < reject:
+            PIPELINE_THUMBNAILS.labels(self.name, "rejected").inc()
+            return True, None
+        PIPELINE_THUMBNAILS.labels(self.name, "escalated").inc()
+        return False, None
+
+    async def _detect(
+        self, session: aiohttp.ClientSession, image: bytes, threshold: float
+    ) -> CPAIInference:
+        assert self.admission is not None
+        async with self.admission:
+            server = self.server.select()
+            assert server.admission is not None
+            async with server.admission:
+                with PIPELINE_IN_FLIGHT.labels(self.name).track_inprogress(), (
+                    PIPELINE_LATENCY.labels(self.name, server.name).time()
+                ), server.track():
+                    if self.pipeline_type == PIPELINE_FACE_RECOGNIZE:
+                        inference = await server.client.recognize_faces(
+                            session, image, threshold
+                        )
+                    elif self.pipeline_type == PIPELINE_FACE_DETECT:
+                        inference = await server.client.detect_faces(
+                            session, image, threshold
+                        )
+                    else:
+                        inference = await server.client.detect(
+                            session, image, threshold, self.model
+                        )
+        logging.getLogger("CPAIPipeline.infer").debug(f"RESULTS {inference}")
+        return inference
+
+
+@dataclass
+class CPAITopic:
+    subscribe: str
+    pipelines: List[CPAIPipeline]
+    filter: Optional[EventFilter]
+    latency_budget: Optional[float] = None
+
+    def succeeded(self, inferences: Mapping[str, Optional[CPAIInference]]) -> bool:
+        """Whether every pipeline of this topic produced predictions."""
+        return all(
+            inferences.get(pipeline.name, None) is not None
+            for pipeline in self.pipelines
+        )
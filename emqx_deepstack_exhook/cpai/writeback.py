@@ -0,0 +1,213 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+import aiohttp
+
+from emqx_deepstack_exhook.cpai.resilience import CircuitBreaker, is_upstream_failure
+from emqx_deepstack_exhook.metrics import Counter, Gauge
+
+DEFAULT_MAX_PENDING = 1000
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF = 0.5
+DEFAULT_WORKERS = 4
+
+SUB_LABEL_UPDATES = Counter(
+    "exhook_sub_label_updates",
+    "Frigate sub label updates by outcome",
+    ["outcome"],
+)
+SUB_LABEL_PENDING = Gauge(
+    "exhook_sub_label_pending", "Sub label updates waiting to be written"
+)
+
+
+class SubLabelWriter:
+    """Background write-back queue for Frigate sub label updates.
+
+    Pending updates are coalesced per event id so only the highest
+    confidence label is written. Failed writes are retried with
+    exponential backoff, unless Frigate refused them with a 4xx. When
+    max_pending events are waiting, updates for new events are dropped."""
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        frigate: str,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        workers: int = DEFAULT_WORKERS,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        self._logger = logging.getLogger(SubLabelWriter.__name__)
+        self._session = session
+        self._frigate = frigate
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._workers = workers
+        self._breaker = breaker or CircuitBreaker("frigate")
+        self._pending: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        # Highest score written per event, to skip redundant writes.
+        self._written: "OrderedDict[str, float]" = OrderedDict()
+        self._retries: Set[asyncio.TimerHandle] = set()
+        self._writing: Dict[str, float] = {}
+        self._wakeup = asyncio.Event()
+        # Set whenever nothing is pending, retrying or being written.
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks: List[asyncio.Task] = []
+        self._pending_gauge = SUB_LABEL_PENDING.labels()
+
+    def __len__(self) -> int:
+        return len(self._pending) + len(self._retries) + len(self._writing)
+
+    def submit(self, event_id: str, label: str, score: float) -> bool:
+        """Queue a sub label write without waiting for it.
+
+        Returns False if the update was dropped."""
+        written = max(
+            self._written.get(event_id, -1.0), self._writing.get(event_id, -1.0)
+        )
+        if written >= score:
+            SUB_LABEL_UPDATES.labels("skipped").inc()
+            return True
+        pending = self._pending.get(event_id, None)
+        if pending is not None:
+            SUB_LABEL_UPDATES.labels("coalesced").inc()
+            if pending[1] < score:
+                self._pending[event_id] = (label, score, pending[2])
+            return True
+        if len(self) >= self.max_pending:
+            SUB_LABEL_UPDATES.labels("dropped").inc()
+            self._logger.warning(
+                "Sub label queue full, dropping update for %s", event_id
+            )
+            return False
+        self._enqueue(event_id, label, score, 0)
+        SUB_LABEL_UPDATES.labels("queued").inc()
+        self._start()
+        return True
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        """Flush pending writes, waiting at most timeout seconds, then stop."""
+        if len(self._tasks) == 0:
+            return
+        flushing = len(self)
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+            SUB_LABEL_UPDATES.labels("flushed").inc(flushing)
+        except asyncio.TimeoutError:
+            SUB_LABEL_UPDATES.labels("abandoned").inc(len(self))
+            self._logger.warning(
+                "Abandoning %d pending sub label updates", len(self)
+            )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Abandoned above along with everything still pending.
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+        self._pending.clear()
+        self._pending_gauge.set(0)
+        self._update_idle()
+
+    async def _drain(self) -> None:
+        await self._idle.wait()
+
+    def _update_idle(self) -> None:
+        if len(self) == 0:
+            self._idle.set()
+        else:
+            self._idle.clear()
+
+    def _start(self) -> None:
+        if len(self._tasks) == 0:
+            loop = asyncio.get_running_loop()
+            self._tasks = [
+                loop.create_task(self._run()) for _ in range(self._workers)
+            ]
+
+    def _enqueue(self, event_id: str, label: str, score: float, attempt: int):
+        self._pending[event_id] = (label, score, attempt)
+        self._pending_gauge.set(len(self._pending))
+        self._update_idle()
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            # Writes for one event are serialized so they land in order.
+            event_id = next(
+                (key for key in self._pending if key not in self._writing), None
+            )
+            if event_id is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            label, score, attempt = self._pending.pop(event_id)
+            self._pending_gauge.set(len(self._pending))
+            self._writing[event_id] = score
+            try:
+                await self._write(event_id, label, score)
+            except Exception as exc:
+                self._retry(event_id, label, score, attempt, exc)
+            finally:
+                del self._writing[event_id]
+                self._update_idle()
+                if event_id in self._pending:
+                    self._wakeup.set()
+
+    async def _write(self, event_id: str, label: str, score: float) -> None:
+        with self._breaker:
+            async with self._session.post(
+                f"{self._frigate}/api/events/{event_id}/sub_label",
+                json={"subLabel": label, "subLabelScore": score},
+            ) as resp:
+                resp.raise_for_status()
+        SUB_LABEL_UPDATES.labels("written").inc()
+        self._written[event_id] = max(score, self._written.get(event_id, 0.0))
+        self._written.move_to_end(event_id)
+        while len(self._written) > self.max_pending:
+            self._written.popitem(last=False)
+
+    def _retry(
+        self, event_id: str, label: str, score: float, attempt: int, exc: Exception
+    ) -> None:
+        # A 4xx, like for an event Frigate no longer has, won't go better
+        # next time.
+        if attempt >= self.max_retries or not is_upstream_failure(exc):
+            SUB_LABEL_UPDATES.labels("failed").inc()
+            self._logger.error(
+                "Giving up setting sub label on %s: %s" % (event_id, str(exc)),
+                exc_info=exc,
+            )
+            return
+        SUB_LABEL_UPDATES.labels("retried").inc()
+        self._logger.warning(
+            "Error setting sub label on %s, retrying: %s" % (event_id, str(exc))
+        )
+        handle = asyncio.get_running_loop().call_later(
+            self.backoff * 2**attempt,
+            lambda: self._requeue(handle, event_id, label, score, attempt + 1),
+        )
+        self._retries.add(handle)
+
+    def _requeue(
+        self,
+        handle: asyncio.TimerHandle,
+        event_id: str,
+        label: str,
+        score: float,
+        attempt: int,
+    ) -> None:
+        self._retries.discard(handle)
+        pending = self._pending.get(event_id, None)
+        if pending is None or pending[1] < score:
+            # Keep the retry unless a higher-confidence update superseded it.
+            self._enqueue(event_id, label, score, attempt)
+        else:
+            self._update_idle()
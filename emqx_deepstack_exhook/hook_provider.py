@@ -1,7 +1,11 @@
 import asyncio
 import logging
-import json
+from typing import List, Optional, Set, Tuple
 from emqx_deepstack_exhook.cpai import CPAIProcess
+from emqx_deepstack_exhook.cpai.admission import AdmissionRejected
+from emqx_deepstack_exhook.cpai.resilience import CircuitOpenError, Deadline
+from emqx_deepstack_exhook.metrics import HOOK_ERRORS, STAGE_ERRORS
+from emqx_deepstack_exhook.mqtt import ResultPublisher
 from emqx_deepstack_exhook.pb2.exhook_pb2 import (
     EmptySuccess,
     HookSpec,
@@ -12,29 +16,43 @@ from emqx_deepstack_exhook.pb2.exhook_pb2_grpc import HookProviderServicer
 
 _LOGGER = logging.getLogger(__name__)
 
+# Time kept back from the caller's deadline to send the response.
+DEADLINE_MARGIN = 0.05
+
 
 class HookProvider(HookProviderServicer):
     _LOGGER = _LOGGER.getChild("HookProvider")
 
-    def __init__(self, *args, cpai: CPAIProcess):
+    def __init__(
+        self,
+        *args,
+        cpai: CPAIProcess,
+        publisher: Optional[ResultPublisher] = None,
+    ):
         super().__init__(*args)
         self._logger = logging.getLogger(HookProvider.__name__)
         self._cpai: CPAIProcess = cpai
+        self._publisher = publisher
+        self._deferred: Set[asyncio.Task] = set()
+        # Only serializes writers; readers capture self._cpai once per request.
         self._lock: asyncio.Lock = asyncio.Lock()
 
+    @property
+    def cpai(self) -> CPAIProcess:
+        return self._cpai
+
     async def set_cpai(self, cpai: CPAIProcess):
-        await self._lock.acquire()
-        try:
-            prev = self._cpai
-            self._cpai = cpai
+        """Publish a new runtime snapshot.
 
-        except Exception as exc:
-            self._logger.error(f"Error assigning CPAI: {str(exc)}", exc_info=exc)
-        finally:
-            self._lock.release()
+        The swap is a single reference assignment, so requests already in
+        flight keep running against the snapshot they captured while new
+        requests pick up the replacement."""
+        async with self._lock:
+            self._cpai = cpai
 
     async def OnProviderLoaded(self, request, context):
         _LOGGER.info(f"OnProviderLoaded: {request.meta.node}")
+        cpai = self._cpai
         specs = [
             # HookSpec(name="client.connect"),
             # HookSpec(name="client.connack"),
@@ -53,7 +71,14 @@ class HookProvider(HookProviderServicer):
             # HookSpec(name="session.terminated"),
             HookSpec(
                 name="message.publish",
-                topics=[topic.subscribe for topic in self._cpai.topics],
+                topics=[
+                    *[topic.subscribe for topic in cpai.topics],
+                    *(
+                        [cpai.published_snapshots.subscription]
+                        if cpai.published_snapshots is not None
+                        else []
+                    ),
+                ],
             ),
             # HookSpec(name="message.delivered"),
             # HookSpec(name="message.acked"),
@@ -126,23 +151,104 @@ class HookProvider(HookProviderServicer):
         return EmptySuccess()
 
     async def OnMessagePublish(self, request, context) -> ValuedResponse:
-        print(f"OnMessagePublish: {request.message.topic} {request.message.payload}")
-        await self._lock.acquire()
+        cpai = self._cpai
+        # Snapshots Frigate publishes are only kept for later events.
+        if cpai.store_snapshot(request.message.topic, request.message.payload):
+            return ValuedResponse(type=ValuedResponse.IGNORE)
+        self._logger.debug("OnMessagePublish: %s", request.message.topic)
+        remaining = self._time_remaining(context)
         try:
-            event = await self._cpai.process_message(
-                request.message.topic, request.message
-            )
-            if event is None:
+            budget = cpai.latency_budget(request.message.topic)
+            if budget is None:
+                payload, _ = await cpai.enrich_message(
+                    request.message.topic, request.message, Deadline(remaining)
+                )
+            else:
+                # Deferred enrichment outlives the call, so it gets a deadline
+                # of its own rather than the caller's.
+                task = asyncio.ensure_future(
+                    cpai.enrich_message(
+                        request.message.topic,
+                        request.message,
+                        Deadline(cpai.config.deferred_timeout),
+                    )
+                )
+                if remaining is not None:
+                    budget = min(budget, remaining)
+                try:
+                    payload, _ = await asyncio.wait_for(
+                        asyncio.shield(task), budget
+                    )
+                except asyncio.TimeoutError:
+                    self._defer(task)
+                    return ValuedResponse(
+                        type=ValuedResponse.CONTINUE, message=request.message
+                    )
+            if payload is None:
                 return ValuedResponse(type=ValuedResponse.IGNORE)
             nmsg = request.message
-            nmsg.payload = json.dumps(event).encode("utf-8")
+            nmsg.payload = payload
 
             return ValuedResponse(type=ValuedResponse.CONTINUE, message=nmsg)
+        except asyncio.TimeoutError:
+            STAGE_ERRORS.labels("deadline").inc()
+            self._logger.warning(
+                "Deadline exceeded processing message on %s", request.message.topic
+            )
+            return ValuedResponse(type=ValuedResponse.IGNORE, message=request.message)
+        except (AdmissionRejected, CircuitOpenError) as exc:
+            self._logger.warning(f"Skipping message: {str(exc)}")
+            return ValuedResponse(type=ValuedResponse.IGNORE, message=request.message)
         except Exception as exc:
+            HOOK_ERRORS.labels("OnMessagePublish").inc()
             self._logger.error(f"Error processing message: {str(exc)}", exc_info=exc)
             return ValuedResponse(type=ValuedResponse.IGNORE, message=request.message)
-        finally:
-            self._lock.release()
+
+    @staticmethod
+    def _time_remaining(context) -> Optional[float]:
+        """Seconds left before the caller gives up on this call, if it set a
+        deadline."""
+        remaining = context.time_remaining() if context is not None else None
+        if remaining is None:
+            return None
+        return max(0.0, remaining - DEADLINE_MARGIN)
+
+    def _defer(self, task: asyncio.Task) -> None:
+        """Let enrichment finish in the background and publish the result."""
+        self._deferred.add(task)
+        task.add_done_callback(self._publish_deferred)
+
+    def _publish_deferred(
+        self, task: "asyncio.Task[Tuple[Optional[bytes], List[str]]]"
+    ) -> None:
+        self._deferred.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if isinstance(exc, asyncio.TimeoutError):
+            STAGE_ERRORS.labels("deadline").inc()
+            self._logger.warning("Deadline exceeded processing deferred message")
+            return
+        if isinstance(exc, (AdmissionRejected, CircuitOpenError)):
+            self._logger.warning(f"Skipping deferred message: {str(exc)}")
+            return
+        if exc is not None:
+            HOOK_ERRORS.labels("OnMessagePublish").inc()
+            self._logger.error(
+                f"Error processing deferred message: {str(exc)}", exc_info=exc
+            )
+            return
+        payload, result_topics = task.result()
+        if payload is None or len(result_topics) == 0:
+            return
+        if self._publisher is None:
+            self._logger.warning(
+                "No mqtt configured, dropping deferred result for %s",
+                ", ".join(result_topics),
+            )
+            return
+        for result_topic in result_topics:
+            self._publisher.publish(result_topic, payload)
 
     async def OnMessageDelivered(self, request, context) -> EmptySuccess:
         print("OnMessageDelivered:", request)
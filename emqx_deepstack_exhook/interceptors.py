@@ -0,0 +1,55 @@
+import time
+from typing import Awaitable, Callable, Optional
+
+import grpc
+import grpc.aio as g_aio
+
+from emqx_deepstack_exhook.metrics import (
+    HOOK_ERRORS,
+    HOOK_IN_FLIGHT,
+    HOOK_LATENCY,
+    HOOK_RESPONSES,
+)
+from emqx_deepstack_exhook.pb2.exhook_pb2 import ValuedResponse
+
+
+class MetricsInterceptor(g_aio.ServerInterceptor):
+    """Records latency, in-flight calls, outcomes and errors for every hook."""
+
+    async def intercept_service(
+        self,
+        continuation: Callable[
+            [grpc.HandlerCallDetails], Awaitable[grpc.RpcMethodHandler]
+        ],
+        handler_call_details: grpc.HandlerCallDetails,
+    ) -> Optional[grpc.RpcMethodHandler]:
+        handler = await continuation(handler_call_details)
+        if handler is None or handler.unary_unary is None:
+            return handler
+        hook = handler_call_details.method.rsplit("/", 1)[-1]
+        behavior = handler.unary_unary
+        latency = HOOK_LATENCY.labels(hook)
+        in_flight = HOOK_IN_FLIGHT.labels(hook)
+
+        async def timed(request, context):
+            start = time.perf_counter()
+            in_flight.inc()
+            try:
+                response = await behavior(request, context)
+            except BaseException:
+                HOOK_ERRORS.labels(hook).inc()
+                raise
+            finally:
+                in_flight.dec()
+                latency.observe(time.perf_counter() - start)
+            if isinstance(response, ValuedResponse):
+                HOOK_RESPONSES.labels(
+                    hook, ValuedResponse.ResponsedType.Name(response.type)
+                ).inc()
+            return response
+
+        return grpc.unary_unary_rpc_method_handler(
+            timed,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer,
+        )
@@ -0,0 +1,330 @@
+"""Minimal in-process metrics rendered in the Prometheus text format.
+
+Recording a sample is a dict lookup plus a couple of additions, so the
+instrumentation is cheap enough to stay enabled in production."""
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Labels, float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(labels: Labels) -> str:
+    if len(labels) == 0:
+        return ""
+    return "{%s}" % ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, "_Metric"] = {}
+        self._collectors: List[Callable[[], Iterable["_Metric"]]] = []
+
+    def register(self, metric: "_Metric") -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+
+    def add_collector(self, collector: Callable[[], Iterable["_Metric"]]) -> None:
+        """Add a callable producing metrics computed at scrape time."""
+        self._collectors.append(collector)
+
+    def collect(self) -> Iterator["_Metric"]:
+        yield from self._metrics.values()
+        for collector in self._collectors:
+            yield from collector()
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.collect():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Optional[Registry] = REGISTRY,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values: str):
+        child = self._children.get(values, None)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(
+                    f"{self.name} expects labels {self.labelnames}, got {values}"
+                )
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _labels(self, values: Tuple[str, ...]) -> Labels:
+        return tuple(zip(self.labelnames, values))
+
+    def samples(self) -> Iterator[Sample]:
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    @contextmanager
+    def track_inprogress(self) -> Iterator[None]:
+        self.value += 1
+        try:
+            yield
+        finally:
+            self.value -= 1
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def samples(self) -> Iterator[Sample]:
+        for values, child in self._children.items():
+            yield f"{self.name}_total", self._labels(values), child.value
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def samples(self) -> Iterator[Sample]:
+        for values, child in self._children.items():
+            yield self.name, self._labels(values), child.value
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        registry: Optional[Registry] = REGISTRY,
+    ) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def samples(self) -> Iterator[Sample]:
+        for values, child in self._children.items():
+            labels = self._labels(values)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), child.counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    (*labels, ("le", _format_value(bound))),
+                    cumulative,
+                )
+            yield f"{self.name}_count", labels, cumulative
+            yield f"{self.name}_sum", labels, child.sum
+
+
+HOOK_LATENCY = Histogram(
+    "exhook_hook_latency_seconds", "Time spent handling a hook call", ["hook"]
+)
+HOOK_IN_FLIGHT = Gauge(
+    "exhook_hook_in_flight", "Hook calls currently being handled", ["hook"]
+)
+HOOK_RESPONSES = Counter(
+    "exhook_hook_responses", "Hook responses by response type", ["hook", "type"]
+)
+HOOK_ERRORS = Counter(
+    "exhook_hook_errors", "Hook calls that raised an exception", ["hook"]
+)
+STAGE_LATENCY = Histogram(
+    "exhook_stage_latency_seconds", "Time spent in each message stage", ["stage"]
+)
+STAGE_ERRORS = Counter("exhook_stage_errors", "Errors by message stage", ["stage"])
+PIPELINE_LATENCY = Histogram(
+    "exhook_pipeline_latency_seconds",
+    "Time spent running inference for a pipeline",
+    ["pipeline", "server"],
+)
+PIPELINE_IN_FLIGHT = Gauge(
+    "exhook_pipeline_in_flight", "Inferences currently running", ["pipeline"]
+)
+PIPELINE_THUMBNAILS = Counter(
+    "exhook_pipeline_thumbnails",
+    "Thumbnail stage outcomes by pipeline",
+    ["pipeline", "outcome"],
+)
+SERVER_LATENCY = Histogram(
+    "exhook_cpai_request_latency_seconds",
+    "CodeProject.AI request latency",
+    ["server", "endpoint"],
+)
+SERVER_IN_FLIGHT = Gauge(
+    "exhook_cpai_requests_in_flight", "Outstanding CodeProject.AI requests", ["server"]
+)
+
+
+def _add_label(series: str, name: str, value: str) -> str:
+    label = f'{name}="{_escape(value)}"'
+    metric, _, labels = series.partition("{")
+    if labels in ("", "}"):
+        return f"{metric}{{{label}}}"
+    return f"{metric}{{{label},{labels}"
+
+
+def merge_exposition(texts: Iterable[Tuple[Optional[str], str]]) -> str:
+    """Merge several scrapes, given as (worker, text) pairs, into one.
+
+    Used to aggregate the metrics of worker processes. Counters and
+    histograms add up across workers. Gauges don't: averages, flags and
+    per-process levels mean nothing summed, so every worker's gauges are
+    kept as their own series under a worker label. Scrapes without a worker
+    are merged as they are."""
+    headers: Dict[str, List[str]] = {}
+    types: Dict[str, str] = {}
+    samples: Dict[str, Dict[str, float]] = {}
+    for worker, text in texts:
+        family = ""
+        for line in text.splitlines():
+            if line == "":
+                continue
+            if line.startswith("#"):
+                parts = line.split(" ", 3)
+                family = parts[2]
+                if parts[1] == "TYPE" and len(parts) > 3:
+                    types[family] = parts[3]
+                family_headers = headers.setdefault(family, [])
+                samples.setdefault(family, {})
+                if line not in family_headers:
+                    family_headers.append(line)
+                continue
+            series, _, value = line.rpartition(" ")
+            if worker is not None and types.get(family, None) == "gauge":
+                series = _add_label(series, "worker", worker)
+            family_samples = samples.setdefault(family, {})
+            family_samples[series] = family_samples.get(series, 0.0) + float(value)
+    lines: List[str] = []
+    for family, family_samples in samples.items():
+        lines.extend(headers.get(family, []))
+        for series, value in family_samples.items():
+            lines.append(f"{series} {_format_value(value)}")
+    lines.append("")
+    return "\n".join(lines)
+
+
+async def start_metrics_server(
+    bind_address: Optional[str] = None,
+    registry: Registry = REGISTRY,
+    unix_path: Optional[str] = None,
+    render: Optional[Callable[[], Awaitable[str]]] = None,
+) -> web.AppRunner:
+    """Serve registry on http://bind_address/metrics, or on the unix socket
+    at unix_path. render replaces the registry as the source of the page."""
+
+    async def metrics(request: web.Request) -> web.Response:
+        text = await render() if render is not None else registry.render()
+        return web.Response(
+            body=text.encode("utf-8"),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    if unix_path is not None:
+        await web.UnixSite(runner, unix_path).start()
+    else:
+        assert bind_address is not None
+        host, port = bind_address.rsplit(":", 1)
+        await web.TCPSite(runner, host, int(port)).start()
+    return runner
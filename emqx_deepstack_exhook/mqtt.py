@@ -0,0 +1,82 @@
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+import aiomqtt
+
+from emqx_deepstack_exhook.config import MqttConfig
+
+
+class ResultPublisher:
+    """Background worker that publishes late enrichment results over MQTT.
+
+    Results are queued without blocking the caller; when the queue is full
+    the newest result is dropped rather than holding up the hook."""
+
+    def __init__(
+        self,
+        config: MqttConfig,
+        max_pending: int = 1000,
+        reconnect_interval: float = 5.0,
+    ) -> None:
+        self._logger = logging.getLogger(ResultPublisher.__name__)
+        self._config = config
+        self._queue: asyncio.Queue[Tuple[str, bytes]] = asyncio.Queue(
+            maxsize=max_pending
+        )
+        self._reconnect_interval = reconnect_interval
+        self._task: Optional[asyncio.Task] = None
+        self.published = 0
+        self.dropped = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def publish(self, topic: str, payload: bytes) -> bool:
+        try:
+            self._queue.put_nowait((topic, payload))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self._logger.warning("Result queue full, dropping result for %s", topic)
+            return False
+
+    async def _run(self) -> None:
+        pending: Optional[Tuple[str, bytes]] = None
+        while True:
+            try:
+                async with aiomqtt.Client(
+                    hostname=self._config.host,
+                    port=self._config.port,
+                    username=self._config.username,
+                    password=self._config.password,
+                ) as client:
+                    self._logger.info(
+                        "Connected to MQTT broker %s:%s",
+                        self._config.host,
+                        self._config.port,
+                    )
+                    while True:
+                        if pending is None:
+                            pending = await self._queue.get()
+                        topic, payload = pending
+                        await client.publish(topic, payload=payload)
+                        pending = None
+                        self.published += 1
+            except aiomqtt.MqttError as exc:
+                self._logger.error(
+                    f"MQTT connection error: {str(exc)}, retrying in "
+                    f"{self._reconnect_interval}s"
+                )
+                await asyncio.sleep(self._reconnect_interval)
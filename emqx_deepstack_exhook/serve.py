@@ -1,6 +1,5 @@
 import asyncio
-from typing import Optional
-import aiohttp
+from typing import Iterable, Optional, Set
 import click
 from concurrent import futures
 import logging
@@ -8,9 +7,19 @@ import voluptuous as vol
 import grpc.aio as g_aio
 import aiofiles
 from yaml import load
-import os
+import signal
 from emqx_deepstack_exhook.config import Config
-from emqx_deepstack_exhook.cpai import CPAIProcess
+from emqx_deepstack_exhook.cpai import CPAIProcess, generation_metrics
+from emqx_deepstack_exhook.cpai.pool import server_metrics
+from emqx_deepstack_exhook.interceptors import MetricsInterceptor
+from emqx_deepstack_exhook.metrics import (
+    REGISTRY,
+    Counter,
+    Gauge,
+    start_metrics_server,
+)
+from emqx_deepstack_exhook.mqtt import ResultPublisher
+from emqx_deepstack_exhook.watch import ConfigWatcher
 
 try:
     from yaml import CLoader as Loader
@@ -27,13 +36,27 @@ from emqx_deepstack_exhook.pb2.exhook_pb2_grpc import (
 logging.basicConfig(level=logging.INFO)
 _LOGGER = logging.getLogger(__name__)
 
-_session: aiohttp.ClientSession = aiohttp.ClientSession()
-_task: asyncio.Task
-_last_modified = 0.0
+# How long a replaced CPAIProcess may keep finishing the requests it accepted.
+DRAIN_TIMEOUT = 30.0
+
+_watcher: Optional[ConfigWatcher] = None
+_draining: Set[asyncio.Task] = set()
+_reload_lock = asyncio.Lock()
 _cleanup_coroutines = []
 
 
 async def reload_config(config_file: str, servicer: HookProvider) -> None:
+    """Validate config_file and swap in a CPAIProcess built from it, carrying
+    over everything whose config did not change. New requests go to the new
+    generation while the previous one drains.
+
+    Reloads run one at a time, so each builds on the generation installed
+    by the one before and drains exactly the generation it replaced."""
+    async with _reload_lock:
+        await _reload_config(config_file, servicer)
+
+
+async def _reload_config(config_file: str, servicer: HookProvider) -> None:
     try:
         config = await load_config(config_file)
     except Exception as exc:
@@ -42,9 +65,28 @@ async def reload_config(config_file: str, servicer: HookProvider) -> None:
         )
         return
 
+    previous = servicer.cpai
+    if config == previous.config:
+        logging.getLogger("reload_config").info("Config unchanged")
+        return
     try:
-        await servicer.set_cpai(CPAIProcess(config, _session))
-        logging.getLogger("reload_conif").info("Config reloaded!")
+        cpai = CPAIProcess(config, previous=previous)
+        cpai.start()
+        await servicer.set_cpai(cpai)
+        logging.getLogger("reload_config").info(
+            "Config reloaded as generation %d, reused %s",
+            cpai.generation,
+            ", ".join(
+                f"{count}/{len(getattr(cpai, name))} {name}"
+                for name, count in cpai.reused(previous).items()
+            ),
+        )
+        # Draining in the background lets the next reload start right away.
+        task = asyncio.get_running_loop().create_task(
+            previous.drain(timeout=DRAIN_TIMEOUT, keep=cpai)
+        )
+        _draining.add(task)
+        task.add_done_callback(_draining.discard)
     except Exception as exc:
         logging.getLogger("reload_config").error(
             f"Error assigning new config: {str(exc)}", exc_info=exc
@@ -52,27 +94,24 @@ async def reload_config(config_file: str, servicer: HookProvider) -> None:
         return
 
 
-async def check_for_changes(config_file: str, servicer: HookProvider):
-    global _last_modified
-    while True:
-        await asyncio.sleep(10)
-        logging.getLogger("check_for_changes").info("Checking for changes...")
-        mtime = os.stat(config_file).st_mtime
-        if mtime != _last_modified:
-            logging.getLogger("check_for_changes").info("Loading changes...")
-            await reload_config(config_file, servicer)
+def watch_config(config_file: str, servicer: HookProvider) -> None:
+    global _watcher
+    _watcher = ConfigWatcher(
+        config_file, lambda: reload_config(config_file, servicer)
+    )
+    _watcher.start()
 
 
-def stop_config_watch():
-    global _task
-    _task.cancel()
+async def stop_config_watch():
+    global _watcher
+    if _watcher is not None:
+        await _watcher.stop()
+        _watcher = None
 
 
 async def load_config(config_file: str) -> Config:
     async with aiofiles.open(config_file, mode="r") as f:
         config = load(await f.read(), Loader=Loader)
-    global _last_modified
-    _last_modified = os.stat(config_file).st_mtime
     try:
         config = SCHEMA_CONFIG(config)
     except vol.Invalid as exc:
@@ -81,37 +120,137 @@ async def load_config(config_file: str) -> Config:
     return Config.load(config)
 
 
-async def serve(config_file):
+def runtime_metrics(
+    servicer: HookProvider, publisher: Optional[ResultPublisher]
+) -> Iterable[Gauge | Counter]:
+    """Scrape-time view of the state owned by the current CPAIProcess."""
+    stats = servicer.cpai.snapshot_cache.stats()
+    cache_size = Gauge(
+        "exhook_snapshot_cache_size",
+        "Snapshot and transformed image cache usage",
+        ["unit"],
+        registry=None,
+    )
+    cache_size.labels("entries").set(stats["entries"])
+    cache_size.labels("bytes").set(stats["bytes"])
+    cache_lookups = Counter(
+        "exhook_snapshot_cache_lookups",
+        "Snapshot cache lookups by result",
+        ["result"],
+        registry=None,
+    )
+    cache_lookups.labels("hit").set(stats["hits"])
+    cache_lookups.labels("miss").set(stats["misses"])
+    cache_evictions = Counter(
+        "exhook_snapshot_cache_evictions", "Snapshot cache evictions", registry=None
+    )
+    cache_evictions.labels().set(stats["evictions"])
+    yield from (cache_size, cache_lookups, cache_evictions)
+    published = servicer.cpai.published_snapshots
+    if published is not None:
+        published_snapshots = Counter(
+            "exhook_published_snapshots",
+            "Snapshots Frigate published over MQTT by use",
+            ["result"],
+            registry=None,
+        )
+        published_snapshots.labels("stored").set(published.stored)
+        published_snapshots.labels("hit").set(published.hits)
+        published_snapshots.labels("miss").set(published.misses)
+        published_snapshots.labels("rejected").set(published.rejected)
+        published_snapshots.labels("ambiguous").set(published.ambiguous)
+        yield published_snapshots
+    yield from server_metrics(servicer.cpai.servers.values())
+    yield from generation_metrics()
+    if publisher is not None:
+        results = Counter(
+            "exhook_deferred_results",
+            "Deferred results handed to MQTT by outcome",
+            ["outcome"],
+            registry=None,
+        )
+        results.labels("published").set(publisher.published)
+        results.labels("dropped").set(publisher.dropped)
+        yield results
+
+
+async def serve(config_file, metrics_socket: Optional[str] = None):
     """Start up the EMQX ExHook gRPC server.
 
-    CONFIG_FILE is the path to the file specifying the configuration for this server."""
+    CONFIG_FILE is the path to the file specifying the configuration for this server.
+
+    With metrics_socket the server runs as a worker under a Supervisor: it
+    serves metrics on that unix socket for the supervisor to aggregate and
+    leaves watching the config file to the supervisor, which sends SIGHUP
+    to reload."""
     try:
         config = await load_config(config_file)
     except:
         exit(1)
 
-    server = g_aio.server(futures.ThreadPoolExecutor(max_workers=config.threads))
+    server = g_aio.server(
+        futures.ThreadPoolExecutor(max_workers=config.threads),
+        interceptors=[MetricsInterceptor()],
+        # Lets the workers of a supervisor share bind_address.
+        options=[("grpc.so_reuseport", 1)],
+    )
     cpai = CPAIProcess(config)
-    hook_provider = HookProvider(cpai=cpai)
+    cpai.start()
+    publisher = ResultPublisher(config.mqtt) if config.mqtt is not None else None
+    if publisher is not None:
+        publisher.start()
+    hook_provider = HookProvider(cpai=cpai, publisher=publisher)
+    # Before the metrics socket exists: a supervisor takes that as the
+    # sign SIGHUP can be sent without killing the worker.
+    loop = asyncio.get_event_loop()
+    loop.add_signal_handler(
+        signal.SIGHUP,
+        lambda: asyncio.ensure_future(reload_config(config_file, hook_provider)),
+    )
+    loop.add_signal_handler(
+        signal.SIGTERM, lambda: asyncio.ensure_future(server.stop(5))
+    )
 
     add_HookProviderServicer_to_server(hook_provider, server)
     server.add_insecure_port(config.bind_address)
     await server.start()
-    loop = asyncio.get_event_loop()
-    global _task
-    _task = loop.create_task(check_for_changes(config_file, hook_provider))
-    asyncio.ensure_future(_task)
+    metrics_runner = None
+    if metrics_socket is not None:
+        REGISTRY.add_collector(lambda: runtime_metrics(hook_provider, publisher))
+        metrics_runner = await start_metrics_server(unix_path=metrics_socket)
+    elif config.metrics_address is not None:
+        REGISTRY.add_collector(lambda: runtime_metrics(hook_provider, publisher))
+        metrics_runner = await start_metrics_server(config.metrics_address)
+        _LOGGER.info("Serving metrics on %s", config.metrics_address)
+    if metrics_socket is None:
+        watch_config(config_file, hook_provider)
     _LOGGER.info("Started gRPC server on %s", config.bind_address)
 
     async def graceful_shutdown():
-        stop_config_watch()
+        await stop_config_watch()
         await server.stop(1)
+        if publisher is not None:
+            await publisher.stop()
+        await asyncio.gather(*_draining)
+        await hook_provider.cpai.close(timeout=5)
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
     _cleanup_coroutines.append(graceful_shutdown())
-    _cleanup_coroutines.append(_session.close())
     await server.wait_for_termination()
 
 
+def run(config_file: str, metrics_socket: Optional[str] = None) -> None:
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(
+            serve(config_file=config_file, metrics_socket=metrics_socket)
+        )
+    finally:
+        loop.run_until_complete(asyncio.gather(*_cleanup_coroutines))
+        loop.close()
+
+
 @click.command()
 @click.argument(
     "config_file",
@@ -120,10 +259,17 @@ async def serve(config_file):
     ),
     required=True,
 )
-def cli(config_file):
-    loop = asyncio.get_event_loop()
-    try:
-        loop.run_until_complete(serve(config_file=config_file))
-    finally:
-        asyncio.gather(*_cleanup_coroutines)
-        loop.close()
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Worker processes sharing the bind address",
+)
+def cli(config_file, workers):
+    if workers == 1:
+        run(config_file)
+        return
+    from emqx_deepstack_exhook.supervisor import Supervisor
+
+    asyncio.run(Supervisor(config_file, workers).run())
@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import time
+from multiprocessing.process import BaseProcess
+from typing import List, Optional
+
+import aiohttp
+
+from emqx_deepstack_exhook.metrics import (
+    Counter,
+    Gauge,
+    Registry,
+    merge_exposition,
+    start_metrics_server,
+)
+from emqx_deepstack_exhook.watch import ConfigWatcher
+
+CHECK_INTERVAL = 1.0
+# Only used where inotify is unavailable.
+CONFIG_CHECK_INTERVAL = 10.0
+MAX_RESTART_DELAY = 30.0
+# A worker that lived at least this long is considered healthy again.
+STABLE_UPTIME = 60.0
+SHUTDOWN_TIMEOUT = 10.0
+
+SUPERVISOR_REGISTRY = Registry()
+WORKERS_ALIVE = Gauge(
+    "exhook_workers_alive",
+    "Worker processes currently running",
+    registry=SUPERVISOR_REGISTRY,
+)
+WORKER_RESTARTS = Counter(
+    "exhook_worker_restarts",
+    "Worker processes restarted after exiting",
+    registry=SUPERVISOR_REGISTRY,
+)
+
+
+def run_worker(config_file: str, metrics_socket: str) -> None:
+    from emqx_deepstack_exhook.serve import run
+
+    run(config_file, metrics_socket=metrics_socket)
+
+
+class _Worker:
+    def __init__(self, index: int, metrics_socket: str) -> None:
+        self.index = index
+        self.metrics_socket = metrics_socket
+        self.process: Optional[BaseProcess] = None
+        self.started = 0.0
+        self.failures = 0
+        self.restart_at = 0.0
+        self.reload_pending = False
+
+    @property
+    def ready(self) -> bool:
+        """Whether the worker handles SIGHUP yet. Until it does, SIGHUP
+        would kill it; it serves metrics only once it handles it."""
+        return os.path.exists(self.metrics_socket)
+
+
+class Supervisor:
+    """Runs the exhook in several worker processes on one bind address.
+
+    Each worker is a full exhook server; the kernel spreads connections
+    across them with SO_REUSEPORT. The supervisor restarts workers that
+    exit, backing off when they keep crashing. When the config file changes
+    and still validates it sends every worker SIGHUP, holding it back from
+    workers still starting up until they are ready. Its metrics endpoint
+    serves the sum of every worker's metrics."""
+
+    def __init__(self, config_file: str, workers: int) -> None:
+        self._logger = logging.getLogger(Supervisor.__name__)
+        self.config_file = config_file
+        self._context = multiprocessing.get_context("spawn")
+        self._socket_dir = tempfile.mkdtemp(prefix="exhook-")
+        self.workers = [
+            _Worker(index, os.path.join(self._socket_dir, f"worker{index}.sock"))
+            for index in range(workers)
+        ]
+        self._stopping = asyncio.Event()
+
+    async def run(self) -> None:
+        from emqx_deepstack_exhook.serve import load_config
+
+        try:
+            config = await load_config(self.config_file)
+        except Exception:
+            exit(1)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self._stopping.set)
+        loop.add_signal_handler(signal.SIGHUP, self.reload)
+        for worker in self.workers:
+            self._spawn(worker)
+        metrics_runner = None
+        if config.metrics_address is not None:
+            metrics_runner = await start_metrics_server(
+                config.metrics_address, render=self.render_metrics
+            )
+            self._logger.info("Serving metrics on %s", config.metrics_address)
+        self._logger.info(
+            "Started %d workers on %s", len(self.workers), config.bind_address
+        )
+        watcher = ConfigWatcher(
+            self.config_file,
+            self._config_changed,
+            poll_interval=CONFIG_CHECK_INTERVAL,
+        )
+        watcher.start()
+        monitor = loop.create_task(self._monitor())
+        try:
+            await self._stopping.wait()
+        finally:
+            monitor.cancel()
+            await asyncio.gather(monitor, return_exceptions=True)
+            await watcher.stop()
+            await self._stop_workers()
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+
+    def reload(self) -> None:
+        """Ask every worker to reload the config file.
+
+        Workers still starting up are asked once they are ready, since they
+        may have read the config before it changed."""
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.reload_pending = True
+                self._reload_if_ready(worker)
+
+    def _reload_if_ready(self, worker: _Worker) -> None:
+        if not worker.reload_pending or not worker.ready:
+            return
+        assert worker.process is not None and worker.process.pid is not None
+        worker.reload_pending = False
+        os.kill(worker.process.pid, signal.SIGHUP)
+
+    async def render_metrics(self) -> str:
+        WORKERS_ALIVE.labels().set(
+            sum(1 for w in self.workers if w.process is not None and w.process.is_alive())
+        )
+        texts = await asyncio.gather(
+            *[self._scrape(worker) for worker in self.workers]
+        )
+        return merge_exposition(
+            [
+                (None, SUPERVISOR_REGISTRY.render()),
+                *[
+                    (str(worker.index), text)
+                    for worker, text in zip(self.workers, texts)
+                    if text is not None
+                ],
+            ]
+        )
+
+    async def _scrape(self, worker: _Worker) -> Optional[str]:
+        try:
+            async with aiohttp.ClientSession(
+                connector=aiohttp.UnixConnector(path=worker.metrics_socket),
+                timeout=aiohttp.ClientTimeout(total=5),
+            ) as session:
+                async with session.get("http://worker/metrics") as resp:
+                    resp.raise_for_status()
+                    return await resp.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as exc:
+            self._logger.debug(
+                "Could not scrape worker %d: %s" % (worker.index, str(exc))
+            )
+            return None
+
+    def _spawn(self, worker: _Worker) -> None:
+        if os.path.exists(worker.metrics_socket):
+            os.unlink(worker.metrics_socket)
+        worker.process = self._context.Process(
+            target=run_worker,
+            args=(self.config_file, worker.metrics_socket),
+            name=f"exhook-worker-{worker.index}",
+        )
+        worker.process.start()
+        worker.started = time.monotonic()
+        worker.reload_pending = False
+
+    async def _monitor(self) -> None:
+        while True:
+            await asyncio.sleep(CHECK_INTERVAL)
+            now = time.monotonic()
+            for worker in self.workers:
+                process = worker.process
+                if process is not None and process.is_alive():
+                    if now - worker.started >= STABLE_UPTIME:
+                        worker.failures = 0
+                    self._reload_if_ready(worker)
+                    continue
+                if process is not None:
+                    worker.failures += 1
+                    delay = min(MAX_RESTART_DELAY, 2 ** (worker.failures - 1))
+                    worker.restart_at = now + delay
+                    self._logger.warning(
+                        "Worker %d exited with %s, restarting in %ds",
+                        worker.index,
+                        process.exitcode,
+                        delay,
+                    )
+                    worker.process = None
+                if now >= worker.restart_at:
+                    WORKER_RESTARTS.labels().inc()
+                    self._spawn(worker)
+
+    async def _config_changed(self) -> None:
+        from emqx_deepstack_exhook.serve import load_config
+
+        try:
+            await load_config(self.config_file)
+        except Exception as exc:
+            self._logger.error(f"Not reloading workers, invalid config: {str(exc)}")
+            return
+        self._logger.info("Config changed, reloading workers")
+        self.reload()
+
+    async def _stop_workers(self) -> None:
+        processes = [w.process for w in self.workers if w.process is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        while any(p.is_alive() for p in processes) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for process in processes:
+            if process.is_alive():
+                self._logger.warning("Killing worker %s", process.name)
+                process.kill()
+            process.join()
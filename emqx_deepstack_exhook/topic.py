@@ -0,0 +1,77 @@
+from typing import Dict, Generic, List, Tuple, TypeVar
+
+_T = TypeVar("_T")
+
+SEPARATOR = "/"
+SINGLE_LEVEL = "+"
+MULTI_LEVEL = "#"
+SYSTEM_PREFIX = "$"
+
+
+class _Node(Generic[_T]):
+    __slots__ = ("children", "values")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_Node[_T]"] = {}
+        self.values: List[Tuple[int, _T]] = []
+
+
+class TopicTrie(Generic[_T]):
+    """MQTT subscription trie mapping topic filters to values.
+
+    Lookups walk one level of the topic at a time, so their cost depends on
+    the topic depth rather than the number of filters. Matches are
+    returned in insertion order. Topics starting with '$' are not matched
+    by filters starting with a wildcard."""
+
+    def __init__(self) -> None:
+        self._root: _Node[_T] = _Node()
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def insert(self, topic_filter: str, value: _T) -> None:
+        node = self._root
+        for level in topic_filter.split(SEPARATOR):
+            child = node.children.get(level, None)
+            if child is None:
+                child = node.children[level] = _Node()
+            node = child
+        node.values.append((self._count, value))
+        self._count += 1
+
+    def match(self, topic: str) -> List[_T]:
+        if topic is None or len(topic.strip()) == 0:
+            return []
+        levels = topic.split(SEPARATOR)
+        matches: List[Tuple[int, _T]] = []
+        self._match(self._root, levels, 0, topic[0] == SYSTEM_PREFIX, matches)
+        if len(matches) > 1:
+            matches.sort(key=lambda match: match[0])
+        return [value for _, value in matches]
+
+    def _match(
+        self,
+        node: _Node[_T],
+        levels: List[str],
+        depth: int,
+        system: bool,
+        matches: List[Tuple[int, _T]],
+    ) -> None:
+        wildcards = not (system and depth == 0)
+        if wildcards:
+            multi = node.children.get(MULTI_LEVEL, None)
+            if multi is not None:
+                # '#' also matches the parent level, e.g. a/# matches a
+                matches.extend(multi.values)
+        if depth == len(levels):
+            matches.extend(node.values)
+            return
+        child = node.children.get(levels[depth], None)
+        if child is not None:
+            self._match(child, levels, depth + 1, system, matches)
+        if wildcards:
+            single = node.children.get(SINGLE_LEVEL, None)
+            if single is not None:
+                self._match(single, levels, depth + 1, system, matches)
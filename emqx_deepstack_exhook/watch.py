@@ -0,0 +1,152 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+from typing import Awaitable, Callable, Optional, Tuple
+
+DEFAULT_DEBOUNCE = 0.5
+DEFAULT_POLL_INTERVAL = 10.0
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+_WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+_EVENT = struct.Struct("iIII")
+
+Signature = Tuple[int, int, int]
+
+
+def _inotify(directory: str) -> Optional[int]:
+    """A non-blocking inotify descriptor watching directory, if the platform
+    has inotify."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        return None
+    if add_watch(fd, os.fsencode(directory), _WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class ConfigWatcher:
+    """Calls on_change when the file at path changes.
+
+    Uses inotify on the file's directory where available, so editors that
+    replace the file rather than write it in place are noticed, and falls
+    back to polling every poll_interval seconds. Bursts of events are
+    debounced, and on_change only runs when the file's size, mtime or inode
+    actually changed since the last call, whatever on_change made of it.
+    Calls never overlap; a change during a call triggers one more."""
+
+    def __init__(
+        self,
+        path: str,
+        on_change: Callable[[], Awaitable[None]],
+        debounce: float = DEFAULT_DEBOUNCE,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ) -> None:
+        self._logger = logging.getLogger(ConfigWatcher.__name__)
+        self.path = path
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._on_change = on_change
+        self._signature = self._stat()
+        self._fd: Optional[int] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._poll_task: Optional[asyncio.Task] = None
+        self._check_task: Optional[asyncio.Task] = None
+        self._recheck = False
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._fd = _inotify(os.path.dirname(os.path.abspath(self.path)))
+        if self._fd is not None:
+            loop.add_reader(self._fd, self._on_events)
+        else:
+            self._logger.info("inotify unavailable, polling %s", self.path)
+            self._poll_task = loop.create_task(self._poll())
+
+    async def stop(self) -> None:
+        if self._fd is not None:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for task in (self._poll_task, self._check_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._poll_task = self._check_task = None
+
+    def _stat(self) -> Optional[Signature]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _on_events(self) -> None:
+        assert self._fd is not None
+        try:
+            data = os.read(self._fd, 64 * _EVENT.size)
+        except BlockingIOError:
+            return
+        # Only whether something happened matters; the stat signature
+        # decides whether it was the config file.
+        if len(data) >= _EVENT.size:
+            self._schedule()
+
+    def _schedule(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(
+            self.debounce, self._check
+        )
+
+    def _check(self) -> None:
+        self._timer = None
+        if self._check_task is not None and not self._check_task.done():
+            self._recheck = True
+            return
+        self._check_task = asyncio.get_running_loop().create_task(self._changed())
+
+    async def _changed(self) -> None:
+        while True:
+            self._recheck = False
+            signature = await asyncio.get_running_loop().run_in_executor(
+                None, self._stat
+            )
+            if signature is not None and signature != self._signature:
+                self._signature = signature
+                try:
+                    await self._on_change()
+                except Exception as exc:
+                    self._logger.error(
+                        f"Error handling change of {self.path}: {str(exc)}",
+                        exc_info=exc,
+                    )
+            if not self._recheck:
+                return
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            self._check()
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from emqx_deepstack_exhook.config.const import SHED_DROP_OLDEST
+from emqx_deepstack_exhook.cpai.admission import Admission, AdmissionRejected
+
+
+async def test_drop_oldest_skips_timed_out_waiter():
+    admission = Admission(
+        "test",
+        "evict",
+        max_concurrent=1,
+        max_queue=1,
+        queue_timeout=0.05,
+        policy=SHED_DROP_OLDEST,
+    )
+    await admission.acquire()
+    queued = asyncio.ensure_future(admission.acquire())
+    await asyncio.sleep(0)
+    assert admission.waiting == 1
+    # What wait_for does on timeout: the waiter is done but stays
+    # queued until the timed out acquire gets to run its cleanup.
+    admission._waiters[0].cancel()
+    arriving = asyncio.ensure_future(admission.acquire())
+    await asyncio.sleep(0)
+    with pytest.raises(asyncio.CancelledError):
+        await queued
+    assert not arriving.done()
+    assert admission.waiting == 1
+    admission.release()
+    await arriving
+    assert admission.active == 1
+
+
+async def test_drop_oldest_evicts_longest_waiting():
+    admission = Admission(
+        "test", "evict", max_concurrent=1, max_queue=1, policy=SHED_DROP_OLDEST
+    )
+    await admission.acquire()
+    oldest = asyncio.ensure_future(admission.acquire())
+    await asyncio.sleep(0)
+    newest = asyncio.ensure_future(admission.acquire())
+    await asyncio.sleep(0)
+    with pytest.raises(AdmissionRejected):
+        await oldest
+    admission.release()
+    await newest
+    assert admission.active == 1
@@ -0,0 +1,68 @@
+import pytest
+import voluptuous as vol
+
+from emqx_deepstack_exhook.config.schema import SCHEMA_CONFIG
+
+
+def _config(result_topic: str = "results/delivery"):
+    return {
+        "frigate": "http://127.0.0.1:5000",
+        "servers": {"cpai": {"host": "127.0.0.1", "port": 32168}},
+        "pipelines": {
+            "delivery": {
+                "type": "object",
+                "server": "cpai",
+                "result_topic": result_topic,
+            }
+        },
+        "topics": [{"subscribe": "frigate/+/car", "pipeline": "delivery"}],
+    }
+
+
+def test_result_topic_outside_subscriptions():
+    SCHEMA_CONFIG(_config("results/delivery"))
+
+
+def test_result_topic_matching_subscription_is_rejected():
+    with pytest.raises(vol.Invalid, match="result topic"):
+        SCHEMA_CONFIG(_config("frigate/driveway/car"))
+
+
+def test_partial_server_admission_keeps_defaults():
+    config = _config()
+    config["servers"]["cpai"]["admission"] = {"policy": "drop_oldest"}
+    admission = SCHEMA_CONFIG(config)["servers"]["cpai"]["admission"]
+    assert admission["policy"] == "drop_oldest"
+    assert admission["max_concurrent"] == 4
+    assert admission["queue_timeout"] == 5.0
+
+
+def _face_config(depends_on):
+    config = _config()
+    config["pipelines"] = {
+        "face": {"type": "face_detect", "server": "cpai"},
+        "recognize": {
+            "type": "face_recognize",
+            "server": "cpai",
+            "depends_on": depends_on,
+        },
+    }
+    config["topics"] = [
+        {"subscribe": "frigate/events", "pipeline": ["face", "recognize"]}
+    ]
+    return config
+
+
+def test_recognize_listed_after_face_detection_must_depend_on_it():
+    with pytest.raises(vol.Invalid, match="depends_on: face"):
+        SCHEMA_CONFIG(_face_config([]))
+    SCHEMA_CONFIG(_face_config(["face"]))
+
+
+def test_deferrable_results_need_mqtt():
+    config = _config()
+    config["topics"][0]["latency_budget"] = 0.5
+    with pytest.raises(vol.Invalid, match="mqtt"):
+        SCHEMA_CONFIG(config)
+    config["mqtt"] = {"host": "127.0.0.1"}
+    SCHEMA_CONFIG(config)
@@ -0,0 +1,60 @@
+import jq
+import pytest
+
+from emqx_deepstack_exhook.cpai.filter import EventFilter, FilterResults
+
+EVENTS = [
+    {"label": "person", "score": 0.8, "area": 30000, "sub_label": None},
+    {"label": "car", "score": 0.65, "area": 50000, "sub_label": ["ups", 0.9]},
+    {"label": "dog", "score": 0.9, "current_zones": ["yard"], "stationary": True},
+    {"label": "person", "score": "high", "snapshot": {"score": 0.7}},
+    {},
+]
+
+NATIVE = [
+    '.label == "person"',
+    '.label != "person"',
+    ".score > 0.7",
+    ".score >= 0.8 and .area < 40000",
+    '.label == "car" or .score > 0.85',
+    '.label | IN("person", "dog")',
+    'IN(.label; "car", "cat")',
+    ".stationary | not",
+    "(.score > 0.7) and (.sub_label == null)",
+    ".snapshot.score > 0.5",
+    ".area",
+    "true",
+]
+JQ_ONLY = [
+    '.current_zones | index("yard")',
+    '(.label // "") | test("^p")',
+    ".sub_label[0] == \"ups\"",
+]
+
+
+def _jq(expression, event):
+    value = jq.compile(expression).input_value(event).first()
+    return value is not None and value is not False
+
+
+@pytest.mark.parametrize("expression", NATIVE + JQ_ONLY)
+def test_native_filters_agree_with_jq(expression):
+    event_filter = EventFilter(expression)
+    assert event_filter.native == (expression in NATIVE)
+    for event in EVENTS:
+        assert event_filter.matches(event) == _jq(expression, event), event
+
+
+def test_filter_results_evaluate_each_filter_once():
+    calls = []
+
+    class Counting(EventFilter):
+        def matches(self, event):
+            calls.append(self.expression)
+            return super().matches(event)
+
+    results = FilterResults(EVENTS[0])
+    person = Counting('.label == "person"')
+    assert results.matches(person) and results.matches(person)
+    assert results.matches(None)
+    assert calls == ['.label == "person"']
@@ -0,0 +1,36 @@
+from emqx_deepstack_exhook.config import SnapshotConfig
+from emqx_deepstack_exhook.cpai.frigate import (
+    FULL_SNAPSHOT,
+    is_scaled,
+    snapshot_query,
+    snapshot_url,
+)
+
+
+def _profile(height=None, quality=None, bbox=False, timestamp=False):
+    return SnapshotConfig(
+        height=height, quality=quality, bbox=bbox, timestamp=timestamp
+    )
+
+
+def test_snapshot_query_defaults_to_the_full_snapshot():
+    assert snapshot_query(None, (1920, 1080)) == FULL_SNAPSHOT
+    assert snapshot_query(_profile(), None) == FULL_SNAPSHOT
+
+
+def test_snapshot_query_only_scales_down_from_a_known_frame():
+    profile = _profile(height=480, quality=70)
+    query = snapshot_query(profile, (1920, 1080))
+    assert query == (("crop", "0"), ("h", "480"), ("quality", "70"))
+    assert is_scaled(query)
+    assert not is_scaled(snapshot_query(profile, None))
+    assert not is_scaled(snapshot_query(profile, (640, 360)))
+
+
+def test_equal_profiles_share_a_query():
+    a = snapshot_query(_profile(height=480, bbox=True), (1920, 1080))
+    b = snapshot_query(_profile(height=480, bbox=True), (1920, 1080))
+    assert a == b and hash(a) == hash(b)
+    assert snapshot_url("http://frigate", "e", a) == (
+        "http://frigate/api/events/e/snapshot.jpg?bbox=1&crop=0&h=480"
+    )
@@ -0,0 +1,105 @@
+import asyncio
+from typing import Dict, List, Optional
+
+import pytest
+
+from emqx_deepstack_exhook.cpai.graph import PipelineGraph, PipelineGraphError
+from emqx_deepstack_exhook.cpai.inference import CPAIInference, CPAIPrediction
+from emqx_deepstack_exhook.cpai.transform import ImageContext, ImageTransformer
+from emqx_deepstack_exhook.cpai.types import CPAIPipeline, FrigateEvent
+
+DELAY = 0.05
+
+
+class _Pipeline(CPAIPipeline):
+    """Pipeline that finds label after DELAY, or nothing if label is None."""
+
+    label: Optional[str] = None
+    log: Optional[List[str]] = None
+
+    async def _detect(self, session, image, threshold) -> CPAIInference:
+        assert self.log is not None
+        self.log.append(f"start {self.name}")
+        await asyncio.sleep(DELAY)
+        self.log.append(f"end {self.name}")
+        if self.label is None:
+            return CPAIInference(predictions=[])
+        return CPAIInference(
+            predictions=[CPAIPrediction(0.9, self.label, 0, 0, 10, 10)]
+        )
+
+
+def _pipelines(log: List[str], *specs: tuple) -> Dict[str, CPAIPipeline]:
+    pipelines: Dict[str, CPAIPipeline] = {}
+    for name, label, depends_on in specs:
+        pipeline = _Pipeline(
+            name=name,
+            pipeline_type="object",
+            server=None,  # type: ignore
+            model=None,
+            threshold=0.5,
+            result_topic=None,
+            filter=None,
+            depends_on=depends_on,
+        )
+        pipeline.label = label
+        pipeline.log = log
+        pipelines[name] = pipeline
+    return pipelines
+
+
+async def _run(graph: PipelineGraph) -> Dict[str, Optional[CPAIInference]]:
+    event = FrigateEvent.from_dict({"id": "a", "camera": "front", "label": "person"})
+    images = {
+        p.name: ImageContext(ImageTransformer(workers=0), ("a",), b"")
+        for p in graph.order
+    }
+    return await graph.run(None, event, images)  # type: ignore
+
+
+def test_order_puts_dependencies_first():
+    pipelines = _pipelines(
+        [],
+        ("recognize", "alice", ["face"]),
+        ("delivery", "ups", []),
+        ("face", "face", []),
+    )
+    # face isn't listed, it's pulled in as a dependency.
+    graph = PipelineGraph([pipelines["recognize"], pipelines["delivery"]], pipelines)
+    assert [p.name for p in graph.order] == ["face", "recognize", "delivery"]
+
+
+def test_cycles_are_rejected():
+    pipelines = _pipelines([], ("a", "x", ["b"]), ("b", "y", ["a"]))
+    with pytest.raises(PipelineGraphError, match="cycle: a -> b -> a"):
+        PipelineGraph([pipelines["a"]], pipelines)
+
+
+def test_unknown_dependencies_are_rejected():
+    pipelines = _pipelines([], ("a", "x", ["missing"]))
+    with pytest.raises(PipelineGraphError, match="unknown pipeline missing"):
+        PipelineGraph([pipelines["a"]], pipelines)
+
+
+async def test_independent_pipelines_run_concurrently():
+    log: List[str] = []
+    pipelines = _pipelines(log, ("delivery", "ups", []), ("face", "face", []))
+    results = await _run(PipelineGraph(pipelines.values(), pipelines))
+    assert log[:2] == ["start delivery", "start face"]
+    assert list(results) == ["delivery", "face"]
+
+
+async def test_dependents_wait_and_skip_when_dependency_finds_nothing():
+    log: List[str] = []
+    pipelines = _pipelines(
+        log,
+        ("face", "face", []),
+        ("recognize", "alice", ["face"]),
+        ("plate", None, []),
+        ("owner", "bob", ["plate"]),
+    )
+    results = await _run(PipelineGraph(pipelines.values(), pipelines))
+    assert log.index("start recognize") > log.index("end face")
+    assert "start owner" not in log
+    assert results["recognize"] is not None
+    assert results["plate"] is None and results["owner"] is None
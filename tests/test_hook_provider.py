@@ -0,0 +1,172 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from emqx_deepstack_exhook.benchmark.upstream import Latency, Upstream, start_upstream
+from emqx_deepstack_exhook.config import Config
+from emqx_deepstack_exhook.config.schema import SCHEMA_CONFIG
+from emqx_deepstack_exhook.cpai import CPAIProcess
+from emqx_deepstack_exhook.hook_provider import HookProvider
+from emqx_deepstack_exhook.pb2.exhook_pb2 import (
+    Message,
+    MessagePublishRequest,
+    ValuedResponse,
+)
+
+TOPIC = "frigate/events"
+# Results go to a _FakePublisher, nothing connects here.
+MQTT = {"host": "127.0.0.1"}
+CPAI_LATENCY = 0.2
+
+
+def _config(
+    port: int, topic: Optional[Dict[str, Any]] = None, **options: Any
+) -> Config:
+    return Config.load(
+        SCHEMA_CONFIG(
+            {
+                "frigate": f"http://127.0.0.1:{port}",
+                "servers": {
+                    "cpai": {
+                        "host": "127.0.0.1",
+                        "port": port,
+                        "admission": {"max_concurrent": 64},
+                    }
+                },
+                "pipelines": {
+                    "delivery": {
+                        "type": "object",
+                        "server": "cpai",
+                        "threshold": 0.1,
+                        "result_topic": "results/delivery",
+                    }
+                },
+                "topics": [
+                    {"subscribe": TOPIC, "pipeline": "delivery", **(topic or {})}
+                ],
+                **options,
+            }
+        )
+    )
+
+
+def _request(index: int) -> MessagePublishRequest:
+    now = time.time()
+    event = {
+        "id": f"event-{index}",
+        "camera": "driveway",
+        "label": "car",
+        "snapshot_time": now,
+        "box": [100, 100, 300, 300],
+    }
+    payload = {"type": "new", "before": event, "after": event}
+    return MessagePublishRequest(
+        message=Message(topic=TOPIC, payload=json.dumps(payload).encode())
+    )
+
+
+class _DetectingUpstream(Upstream):
+    """Upstream whose detections always find at least one object."""
+
+    def _predictions(self, extra) -> List[Dict[str, Any]]:
+        predictions = super()._predictions(extra)
+        while len(predictions) == 0:
+            predictions = super()._predictions(extra)
+        return predictions
+
+
+class _FakePublisher:
+    def __init__(self) -> None:
+        self.results: List[Tuple[str, bytes]] = []
+        self.published = asyncio.Event()
+
+    def publish(self, topic: str, payload: bytes) -> bool:
+        self.results.append((topic, payload))
+        self.published.set()
+        return True
+
+
+async def _upstream() -> Tuple[Upstream, web.AppRunner, int]:
+    upstream = _DetectingUpstream(Latency("0"), Latency(str(CPAI_LATENCY)), seed=0)
+    runner = await start_upstream(upstream, "127.0.0.1", 0)
+    port = runner.addresses[0][1]
+    return upstream, runner, port
+
+
+async def test_concurrent_publishes_overlap():
+    count = 8
+    upstream, runner, port = await _upstream()
+    cpai = CPAIProcess(_config(port))
+    provider = HookProvider(cpai=cpai)
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[provider.OnMessagePublish(_request(i), None) for i in range(count)]
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        await cpai.close()
+        await runner.cleanup()
+    assert upstream.calls["detect"] == count
+    # Serialized calls would take count * CPAI_LATENCY.
+    assert elapsed < 3 * CPAI_LATENCY
+
+
+async def test_late_result_is_published():
+    upstream, runner, port = await _upstream()
+    cpai = CPAIProcess(
+        _config(port, {"latency_budget": CPAI_LATENCY / 4}, mqtt=MQTT)
+    )
+    publisher = _FakePublisher()
+    provider = HookProvider(cpai=cpai, publisher=publisher)  # type: ignore
+    request = _request(0)
+    original = request.message.payload
+    try:
+        response = await provider.OnMessagePublish(request, None)
+        # The hook doesn't wait past the budget and passes the message on.
+        assert response.type == ValuedResponse.CONTINUE
+        assert response.message.payload == original
+        await asyncio.wait_for(publisher.published.wait(), 2 * CPAI_LATENCY)
+    finally:
+        await cpai.close()
+        await runner.cleanup()
+    assert len(publisher.results) == 1
+    topic, payload = publisher.results[0]
+    assert topic == "results/delivery"
+    assert json.loads(payload)["after"]["sub_label"][0] == "car"
+
+
+async def test_deferred_enrichment_gives_up_after_deferred_timeout():
+    upstream, runner, port = await _upstream()
+    cpai = CPAIProcess(
+        _config(
+            port,
+            {"latency_budget": CPAI_LATENCY / 4},
+            mqtt=MQTT,
+            deferred_timeout=CPAI_LATENCY / 2,
+        )
+    )
+    publisher = _FakePublisher()
+    provider = HookProvider(cpai=cpai, publisher=publisher)  # type: ignore
+    try:
+        response = await provider.OnMessagePublish(_request(0), None)
+        assert response.type == ValuedResponse.CONTINUE
+        assert len(provider._deferred) == 1
+        await asyncio.gather(*provider._deferred, return_exceptions=True)
+        await asyncio.sleep(0)
+    finally:
+        await cpai.close()
+        await runner.cleanup()
+    assert len(provider._deferred) == 0
+    assert publisher.results == []
+
+
+async def test_transformed_images_share_snapshot_budget():
+    cpai = CPAIProcess(_config(1))
+    try:
+        assert cpai.transformer.cache is cpai.snapshot_cache
+    finally:
+        await cpai.close()
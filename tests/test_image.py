@@ -0,0 +1,175 @@
+import io
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+from emqx_deepstack_exhook.config import CropConfig, TransformConfig
+from emqx_deepstack_exhook.config.const import CROP_BOX, CROP_REGION
+from emqx_deepstack_exhook.cpai.image import (
+    ImageSpec,
+    crop_bounds,
+    jpeg_size,
+    scaled_size,
+    transform_jpeg,
+)
+from emqx_deepstack_exhook.cpai.inference import CPAIInference, CPAIPrediction
+from emqx_deepstack_exhook.cpai.transform import ImageContext, ImageTransformer
+from emqx_deepstack_exhook.cpai.types import CPAIPipeline, FrigateEvent
+
+
+def _jpeg(size: Tuple[int, int]) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", size, (128, 64, 32)).save(out, "JPEG")
+    return out.getvalue()
+
+
+class _Pipeline(CPAIPipeline):
+    """Pipeline that records the images it is sent and finds a car at box,
+    in the coordinates of the image."""
+
+    box: Tuple[int, int, int, int] = (10, 10, 20, 20)
+    images: Optional[List[bytes]] = None
+
+    async def _detect(self, session, image, threshold) -> CPAIInference:
+        assert self.images is not None
+        self.images.append(image)
+        return CPAIInference(predictions=[CPAIPrediction(0.9, "car", *self.box)])
+
+
+def _pipeline(**options) -> _Pipeline:
+    pipeline = _Pipeline(
+        name="cars",
+        pipeline_type="object",
+        server=None,  # type: ignore
+        model=None,
+        threshold=0.5,
+        result_topic=None,
+        filter=None,
+        **options,
+    )
+    pipeline.images = []
+    return pipeline
+
+
+def _event(**fields) -> FrigateEvent:
+    return FrigateEvent.from_dict({"id": "a", "camera": "front", **fields})
+
+
+async def _infer(
+    pipeline: _Pipeline,
+    event: FrigateEvent,
+    snapshot: bytes,
+    frame: Optional[Tuple[int, int]] = None,
+) -> Tuple[Optional[Tuple[int, int]], Tuple[int, int, int, int]]:
+    """The size of the image pipeline was sent and the box it found, mapped
+    back to the frame."""
+    images = ImageContext(ImageTransformer(workers=0), ("a",), snapshot, frame)
+    inference = await pipeline.infer(
+        None, event, snapshot, images=images  # type: ignore
+    )
+    assert inference is not None and pipeline.images is not None
+    p = inference.predictions[0]
+    return jpeg_size(pipeline.images[-1]), (p.x_min, p.y_min, p.x_max, p.y_max)
+
+
+def test_crop_bounds_pads_and_clamps():
+    assert crop_bounds([100, 100, 200, 150], 0.1, (400, 300)) == (90, 95, 210, 155)
+    assert crop_bounds([0, 250, 100, 300], 0.5, (400, 300)) == (0, 225, 150, 300)
+
+
+def test_crop_bounds_rejects_empty_and_whole_crops():
+    assert crop_bounds([100, 100, 100, 200], 0.1, (400, 300)) is None
+    assert crop_bounds([10, 10, 20], 0.1, (400, 300)) is None
+    assert crop_bounds([0, 0, 400, 300], 0.1, (400, 300)) is None
+
+
+def test_to_frame_maps_predictions_back():
+    inference = CPAIInference(predictions=[CPAIPrediction(0.9, "car", 10, 20, 30, 40)])
+    p = inference.to_frame(100, 50, 0.5, 0.25).predictions[0]
+    assert (p.x_min, p.y_min, p.x_max, p.y_max) == (120, 130, 160, 210)
+    assert inference.predictions[0].x_min == 10
+
+
+async def test_crop_to_box_projects_predictions_into_the_frame():
+    pipeline = _pipeline(crop=CropConfig(to=CROP_BOX, padding=0.1))
+    event = _event(box=[100, 100, 200, 200], region=[0, 0, 300, 300])
+    size, box = await _infer(pipeline, event, _jpeg((400, 300)))
+    assert size == (120, 120)
+    assert box == (100, 100, 110, 110)
+
+
+async def test_crop_to_region():
+    pipeline = _pipeline(crop=CropConfig(to=CROP_REGION, padding=0.0))
+    event = _event(box=[100, 100, 200, 200], region=[50, 40, 250, 240])
+    size, box = await _infer(pipeline, event, _jpeg((400, 300)))
+    assert size == (200, 200)
+    assert box == (60, 50, 70, 60)
+
+
+async def test_crop_without_a_box_sends_the_snapshot():
+    pipeline = _pipeline(crop=CropConfig(to=CROP_BOX, padding=0.1))
+    snapshot = _jpeg((400, 300))
+    _, box = await _infer(pipeline, _event(), snapshot)
+    assert pipeline.images == [snapshot]
+    assert box == (10, 10, 20, 20)
+
+
+def test_scaled_size_keeps_the_aspect():
+    assert scaled_size((400, 300), 200) == (200, 150)
+    assert scaled_size((400, 300), 640) == (400, 300)
+    assert scaled_size((400, 300), None) == (400, 300)
+
+
+def test_transform_jpeg_makes_every_spec_from_one_snapshot():
+    specs = [
+        ImageSpec(None, (200, 150)),
+        ImageSpec((100, 100, 200, 200), (50, 50), grayscale=True),
+    ]
+    full, crop = transform_jpeg(_jpeg((400, 300)), specs)
+    assert jpeg_size(full) == (200, 150)
+    with Image.open(io.BytesIO(crop)) as image:
+        assert image.size == (50, 50) and image.mode == "L"
+
+
+async def test_transform_projects_predictions_into_the_frame():
+    transform = TransformConfig(max_size=200, quality=80, grayscale=False)
+    pipeline = _pipeline(transform=transform)
+    pipeline.box = (50, 50, 100, 75)
+    size, box = await _infer(pipeline, _event(), _jpeg((400, 300)))
+    assert size == (200, 150)
+    assert box == (100, 100, 200, 150)
+
+
+async def test_crop_and_transform_project_predictions_into_the_frame():
+    pipeline = _pipeline(
+        crop=CropConfig(to=CROP_BOX, padding=0.1),
+        transform=TransformConfig(max_size=60, quality=80, grayscale=False),
+    )
+    event = _event(box=[100, 100, 200, 200])
+    size, box = await _infer(pipeline, event, _jpeg((400, 300)))
+    assert size == (60, 60)
+    assert box == (110, 110, 130, 130)
+
+
+def test_transform_that_changes_nothing_sends_the_snapshot():
+    transform = TransformConfig(max_size=640, quality=80, grayscale=False)
+    pipeline = _pipeline(transform=transform)
+    images = ImageContext(ImageTransformer(workers=0), ("a",), _jpeg((400, 300)))
+    assert pipeline.plan(_event(), images) is None
+
+
+async def test_crop_of_a_scaled_snapshot_projects_into_the_frame():
+    # Frigate scaled the 400x300 frame down to half, boxes stay in the frame.
+    pipeline = _pipeline(crop=CropConfig(to=CROP_BOX, padding=0.0))
+    event = _event(box=[100, 100, 200, 200])
+    size, box = await _infer(pipeline, event, _jpeg((200, 150)), frame=(400, 300))
+    assert size == (50, 50)
+    assert box == (120, 120, 140, 140)
+
+
+async def test_scaled_snapshot_projects_into_the_frame():
+    pipeline = _pipeline()
+    snapshot = _jpeg((200, 150))
+    _, box = await _infer(pipeline, _event(), snapshot, frame=(400, 300))
+    assert pipeline.images == [snapshot]
+    assert box == (20, 20, 40, 40)
@@ -0,0 +1,23 @@
+from emqx_deepstack_exhook.metrics import Counter, Gauge, Registry, merge_exposition
+
+
+def _scrape(requests: float, open_: float) -> str:
+    registry = Registry()
+    Counter("requests", "Requests", ["server"], registry=registry).labels("a").inc(
+        requests
+    )
+    Gauge("breaker_open", "Breaker open", ["server"], registry=registry).labels(
+        "a"
+    ).set(open_)
+    Gauge("uptime", "Uptime", registry=registry).labels().set(1)
+    return registry.render()
+
+
+def test_counters_sum_and_gauges_stay_per_worker():
+    merged = merge_exposition([("0", _scrape(3, 1)), ("1", _scrape(4, 1))])
+    lines = merged.splitlines()
+    assert 'requests_total{server="a"} 7' in lines
+    assert 'breaker_open{worker="0",server="a"} 1' in lines
+    assert 'breaker_open{worker="1",server="a"} 1' in lines
+    assert 'uptime{worker="0"} 1' in lines
+    assert not any(line.startswith('breaker_open{server="a"}') for line in lines)
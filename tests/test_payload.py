@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from emqx_deepstack_exhook.cpai import payload as payload_module
+from emqx_deepstack_exhook.cpai.payload import FrigatePayload
+
+BEFORE = '{"id": "a", "label": "car", "score": 0.5}'
+
+
+@pytest.fixture(params=["json", "orjson"])
+def codec(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(payload_module, "orjson", None)
+    elif payload_module.orjson is None:
+        pytest.skip("orjson is not installed")
+    return request.param
+
+
+def _enrich(raw: str) -> dict:
+    message = FrigatePayload(raw.encode("utf-8"))
+    after = dict(message.after)
+    after["sub_label"] = ["ups", 0.9]
+    return json.loads(message.encode(after))
+
+
+def test_after_is_spliced_into_the_original_bytes(monkeypatch):
+    monkeypatch.setattr(payload_module, "orjson", None)
+    raw = '{"before": %s, "after": {"id": "a", "label": "car"}, "type": "update"}'
+    message = FrigatePayload((raw % BEFORE).encode("utf-8"))
+    assert message.after == {"id": "a", "label": "car"}
+    encoded = message.encode({"id": "a", "label": "car", "sub_label": None})
+    # before is passed through untouched, spacing and all.
+    assert encoded.decode("utf-8").startswith('{"before": %s, "after": ' % BEFORE)
+    assert json.loads(encoded)["type"] == "update"
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        # after not last: the splice can't tell it's top level.
+        '{"after": {"id": "a"}, "before": %s, "type": "new"}' % BEFORE,
+        # A nested after key comes first.
+        '{"before": {"after": {"id": "x"}}, "after": {"id": "a"}, "type": "new"}',
+        # "after" inside a string value.
+        '{"before": {"note": "\\"after\\": {}"}, "after": {"id": "a"}}',
+    ],
+)
+def test_round_trip(codec, raw):
+    document = json.loads(raw)
+    enriched = _enrich(raw)
+    assert enriched["after"] == {"id": "a", "sub_label": ["ups", 0.9]}
+    assert enriched["before"] == document["before"]
+
+
+@pytest.mark.parametrize("raw", [b"[1, 2]", b'{"before": {}}', b'{"after": 1}'])
+def test_missing_after(codec, raw):
+    assert FrigatePayload(raw).after is None
+
+
+def test_invalid_json_raises(codec):
+    with pytest.raises(ValueError):
+        FrigatePayload(b"not json").after
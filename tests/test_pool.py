@@ -0,0 +1,75 @@
+import asyncio
+import random
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+from emqx_deepstack_exhook.config.const import (
+    POOL_LATENCY_WEIGHTED,
+    POOL_LEAST_OUTSTANDING,
+)
+from emqx_deepstack_exhook.cpai.pool import CPAIServerPool
+from emqx_deepstack_exhook.cpai.types import CPAIServer
+
+
+def _server(name: str, port: int = 1, outstanding: int = 0, latency=None):
+    server = CPAIServer(name=name, host="127.0.0.1", port=port)
+    server.outstanding = outstanding
+    server.latency = latency
+    return server
+
+
+def test_least_outstanding_picks_least_loaded_then_fastest():
+    busy, idle_slow, idle_fast = (
+        _server("busy", outstanding=2, latency=0.01),
+        _server("idle_slow", latency=0.2),
+        _server("idle_fast", latency=0.1),
+    )
+    pool = CPAIServerPool(
+        "pool", [busy, idle_slow, idle_fast], strategy=POOL_LEAST_OUTSTANDING
+    )
+    assert pool.select() is idle_fast
+
+
+def test_latency_weighted_favours_faster_servers():
+    fast, slow = _server("fast", latency=0.01), _server("slow", latency=0.1)
+    pool = CPAIServerPool("pool", [fast, slow], strategy=POOL_LATENCY_WEIGHTED)
+    random.seed(0)
+    picks = Counter(pool.select().name for _ in range(2000))
+    # Weights are 100 to 10.
+    assert 0.85 < picks["fast"] / 2000 < 0.95
+
+
+def test_unhealthy_servers_are_skipped_until_none_is_left():
+    a, b = _server("a"), _server("b", outstanding=5)
+    pool = CPAIServerPool("pool", [a, b])
+    a.set_healthy(False)
+    assert pool.select() is b
+    # Rather than fail, fall back to servers whose breaker is closed.
+    b.set_healthy(False)
+    assert pool.select() is a
+
+
+async def test_health_checks_take_dead_servers_out_of_rotation():
+    async def ping(request: web.Request) -> web.Response:
+        return web.json_response({"success": True})
+
+    app = web.Application()
+    app.router.add_get("/v1/server/status/ping", ping)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    alive = _server("alive", port=runner.addresses[0][1], outstanding=5)
+    # Nothing listens on port 1.
+    dead = _server("dead")
+    pool = CPAIServerPool("pool", [alive, dead], health_check_interval=0.05)
+    try:
+        async with aiohttp.ClientSession() as session:
+            pool.start_health_checks(session)
+            await asyncio.sleep(0.1)
+            assert alive.healthy and not dead.healthy
+            assert pool.select() is alive
+            await pool.stop()
+    finally:
+        await runner.cleanup()
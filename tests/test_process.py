@@ -0,0 +1,142 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, Tuple
+
+from emqx_deepstack_exhook.benchmark.upstream import Latency, Upstream, start_upstream
+from emqx_deepstack_exhook.config import Config
+from emqx_deepstack_exhook.config.schema import SCHEMA_CONFIG
+from emqx_deepstack_exhook.cpai import (
+    GENERATION_ACTIVE,
+    GENERATION_CLOSED,
+    GENERATION_DRAINING,
+    CPAIProcess,
+)
+from emqx_deepstack_exhook.pb2.exhook_pb2 import Message
+
+TOPIC = "frigate/events"
+CPAI_LATENCY = 0.2
+
+
+def _config(other_port: int = 2, **options: Any) -> Config:
+    data: Dict[str, Any] = {
+        "frigate": "http://127.0.0.1:1",
+        "servers": {
+            "cpai": {"host": "127.0.0.1", "port": 1},
+            "other": {"host": "127.0.0.1", "port": other_port},
+        },
+        "pools": {"both": {"servers": ["cpai", "other"]}},
+        "pipelines": {
+            "delivery": {"type": "object", "server": "cpai"},
+            "plates": {"type": "object", "server": "other"},
+            "spread": {"type": "object", "server": "both"},
+        },
+        "topics": [
+            {"subscribe": TOPIC, "pipeline": "delivery"},
+            {"subscribe": TOPIC, "pipeline": "plates"},
+            {"subscribe": TOPIC, "pipeline": "spread"},
+        ],
+        **options,
+    }
+    return Config.load(SCHEMA_CONFIG(data))
+
+
+async def test_reload_reuses_unchanged_components():
+    old = CPAIProcess(_config())
+    new = CPAIProcess(_config(other_port=3), previous=old)
+    try:
+        assert new.generation == old.generation + 1
+        assert new.session is old.session
+        assert new.servers["cpai"] is old.servers["cpai"]
+        assert new.servers["other"] is not old.servers["other"]
+        assert new.pools["cpai"] is old.pools["cpai"]
+        # A pool over a rebuilt server is rebuilt with it.
+        assert new.pools["both"] is not old.pools["both"]
+        assert new.pipelines["delivery"] is old.pipelines["delivery"]
+        assert new.pipelines["plates"] is not old.pipelines["plates"]
+        assert new.pipelines["spread"] is not old.pipelines["spread"]
+        assert new.sub_label_writer is old.sub_label_writer
+        assert new.transformer is old.transformer
+        assert new.reused(old) == {"servers": 1, "pools": 1, "pipelines": 1}
+        await old.close(keep=new)
+        assert old.state == GENERATION_CLOSED
+        # The session and everything carried over stay usable.
+        assert not new.session.closed
+        assert new.state == GENERATION_ACTIVE
+    finally:
+        await new.close()
+    assert new.session.closed
+
+
+async def test_reload_rebuilds_servers_when_the_breaker_changes():
+    old = CPAIProcess(_config())
+    new = CPAIProcess(_config(circuit_breaker={"failure_threshold": 2}), previous=old)
+    try:
+        assert new.reused(old) == {"servers": 0, "pools": 0, "pipelines": 0}
+    finally:
+        await old.close(keep=new)
+        await new.close()
+
+
+def _message() -> Message:
+    event = {
+        "id": "event",
+        "camera": "driveway",
+        "label": "car",
+        "snapshot_time": time.time(),
+        "box": [100, 100, 300, 300],
+    }
+    payload = {"type": "new", "before": event, "after": event}
+    return Message(topic=TOPIC, payload=json.dumps(payload).encode())
+
+
+async def _inflight(port: int) -> Tuple[CPAIProcess, asyncio.Task]:
+    cpai = CPAIProcess(
+        _config(
+            frigate=f"http://127.0.0.1:{port}",
+            servers={"cpai": {"host": "127.0.0.1", "port": port}},
+            pools={},
+            pipelines={"delivery": {"type": "object", "server": "cpai"}},
+            topics=[{"subscribe": TOPIC, "pipeline": "delivery"}],
+        )
+    )
+    task = asyncio.ensure_future(cpai.enrich_message(TOPIC, _message()))
+    while cpai.inflight == 0:
+        await asyncio.sleep(0)
+    return cpai, task
+
+
+async def test_drain_waits_for_inflight_requests_then_closes():
+    upstream = Upstream(Latency("0"), Latency(str(CPAI_LATENCY)), seed=0)
+    runner = await start_upstream(upstream, "127.0.0.1", 0)
+    try:
+        cpai, task = await _inflight(runner.addresses[0][1])
+        drain = asyncio.ensure_future(cpai.drain(timeout=10 * CPAI_LATENCY))
+        await asyncio.sleep(CPAI_LATENCY / 4)
+        assert cpai.state == GENERATION_DRAINING
+        assert not drain.done() and not cpai.session.closed
+        await task
+        await drain
+    finally:
+        await runner.cleanup()
+    assert upstream.calls["detect"] == 1
+    assert cpai.inflight == 0
+    assert cpai.state == GENERATION_CLOSED
+    assert cpai.session.closed
+
+
+async def test_drain_closes_after_timeout():
+    upstream = Upstream(Latency("0"), Latency(str(10 * CPAI_LATENCY)), seed=0)
+    runner = await start_upstream(upstream, "127.0.0.1", 0)
+    try:
+        cpai, task = await _inflight(runner.addresses[0][1])
+        start = time.perf_counter()
+        await cpai.drain(timeout=CPAI_LATENCY)
+        elapsed = time.perf_counter() - start
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    finally:
+        await runner.cleanup()
+    assert CPAI_LATENCY <= elapsed < 5 * CPAI_LATENCY
+    assert cpai.state == GENERATION_CLOSED
+    assert cpai.session.closed
@@ -0,0 +1,85 @@
+from typing import Tuple
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from emqx_deepstack_exhook.cpai.client import CPAIClient, CPAIClientError
+from emqx_deepstack_exhook.cpai.resilience import (
+    CLOSED,
+    OPEN,
+    CircuitBreaker,
+)
+
+
+def _response_error(status: int) -> aiohttp.ClientResponseError:
+    return aiohttp.ClientResponseError(None, (), status=status)  # type: ignore
+
+
+def _fail(breaker: CircuitBreaker, exc: BaseException) -> None:
+    with pytest.raises(type(exc)):
+        with breaker:
+            raise exc
+
+
+def test_client_errors_do_not_open_breaker():
+    breaker = CircuitBreaker("frigate", failure_threshold=2)
+    for _ in range(5):
+        _fail(breaker, _response_error(404))
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+
+
+def test_server_and_connection_errors_open_breaker():
+    breaker = CircuitBreaker("frigate", failure_threshold=2)
+    _fail(breaker, _response_error(503))
+    _fail(breaker, aiohttp.ClientConnectionError())
+    assert breaker.state == OPEN
+
+
+async def _cpai(app: web.Application) -> Tuple[web.AppRunner, int]:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner, runner.addresses[0][1]
+
+
+async def _detect(port: int, model: str, times: int) -> CircuitBreaker:
+    """Call a custom model times times, each one failing, behind a breaker
+    that opens after two failures."""
+    breaker = CircuitBreaker("cpai", failure_threshold=2)
+    client = CPAIClient("127.0.0.1", port)
+    async with aiohttp.ClientSession() as session:
+        for _ in range(times):
+            with pytest.raises(CPAIClientError):
+                with breaker:
+                    await client.detect(session, b"", 0.5, model)
+    return breaker
+
+
+async def test_cpai_refusals_do_not_open_breaker():
+    async def no_face(request: web.Request) -> web.Response:
+        return web.json_response({"success": False, "error": "No face found"})
+
+    app = web.Application()
+    app.router.add_post("/v1/vision/custom/faces", no_face)
+    runner, port = await _cpai(app)
+    try:
+        # An unknown model is a 404.
+        assert (await _detect(port, "missing", 5)).state == CLOSED
+        assert (await _detect(port, "faces", 5)).state == CLOSED
+    finally:
+        await runner.cleanup()
+
+
+async def test_cpai_server_errors_open_breaker():
+    async def broken(request: web.Request) -> web.Response:
+        raise web.HTTPInternalServerError()
+
+    app = web.Application()
+    app.router.add_post("/v1/vision/custom/broken", broken)
+    runner, port = await _cpai(app)
+    try:
+        assert (await _detect(port, "broken", 2)).state == OPEN
+    finally:
+        await runner.cleanup()
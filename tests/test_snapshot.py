@@ -0,0 +1,41 @@
+import io
+import time
+
+from PIL import Image
+
+from emqx_deepstack_exhook.cpai.snapshot import PublishedSnapshots
+
+FRAME = (1280, 720)
+
+
+def _jpeg(size=(640, 360)) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", size).save(out, format="JPEG")
+    return out.getvalue()
+
+
+def _published() -> PublishedSnapshots:
+    snapshots = PublishedSnapshots()
+    assert snapshots.put("frigate/front/person/snapshot", _jpeg())
+    return snapshots
+
+
+def test_published_snapshot_used_for_only_active_event():
+    snapshots = _published()
+    snapshots.observe("a", "front", "person", ended=False)
+    now = time.time()
+    assert snapshots.get("a", "front", "person", now - 1, FRAME) is not None
+    assert snapshots.hits == 1
+
+
+def test_published_snapshot_ambiguous_with_two_active_events():
+    snapshots = _published()
+    snapshots.observe("a", "front", "person", ended=False)
+    snapshots.observe("b", "front", "person", ended=False)
+    now = time.time()
+    assert snapshots.get("b", "front", "person", now - 1, FRAME) is None
+    assert snapshots.ambiguous == 1
+
+    # Once the other event ends the snapshot can only be b's.
+    snapshots.observe("a", "front", "person", ended=True)
+    assert snapshots.get("b", "front", "person", now - 1, FRAME) is not None
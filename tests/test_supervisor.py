@@ -0,0 +1,35 @@
+import shutil
+import subprocess
+import sys
+
+from emqx_deepstack_exhook.supervisor import Supervisor
+
+
+class _Process:
+    def __init__(self, child: subprocess.Popen) -> None:
+        self.pid = child.pid
+        self._child = child
+
+    def is_alive(self) -> bool:
+        return self._child.poll() is None
+
+
+def test_reload_waits_until_worker_is_ready(tmp_path):
+    supervisor = Supervisor(str(tmp_path / "config.yaml"), workers=1)
+    worker = supervisor.workers[0]
+    # Like a worker still starting up, SIGHUP would kill it.
+    child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        worker.process = _Process(child)  # type: ignore
+        supervisor.reload()
+        assert worker.reload_pending
+        assert child.poll() is None
+
+        open(worker.metrics_socket, "w").close()
+        supervisor._reload_if_ready(worker)
+        assert not worker.reload_pending
+        assert child.wait(timeout=5) != 0
+    finally:
+        child.kill()
+        child.wait()
+        shutil.rmtree(supervisor._socket_dir)
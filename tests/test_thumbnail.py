@@ -0,0 +1,130 @@
+import base64
+import io
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from emqx_deepstack_exhook.config import ThumbnailConfig
+from emqx_deepstack_exhook.cpai.graph import PipelineGraph
+from emqx_deepstack_exhook.cpai.inference import CPAIInference, CPAIPrediction
+from emqx_deepstack_exhook.cpai.transform import ImageContext, ImageTransformer
+from emqx_deepstack_exhook.cpai.types import CPAIPipeline, FrigateEvent
+
+BOX = [100, 100, 200, 200]
+
+
+def _jpeg(size) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", size).save(out, "JPEG")
+    return out.getvalue()
+
+
+THUMBNAIL = _jpeg((175, 175))
+SNAPSHOT = _jpeg((400, 300))
+
+
+class _Pipeline(CPAIPipeline):
+    """Pipeline that finds a car with confidence on the thumbnail and
+    snapshot_confidence on the snapshot, recording which it was sent."""
+
+    confidence = 0.0
+    snapshot_confidence = 0.9
+    sent: Optional[List[str]] = None
+
+    async def _detect(self, session, image, threshold) -> CPAIInference:
+        assert self.sent is not None
+        thumbnail = image == THUMBNAIL
+        self.sent.append("thumbnail" if thumbnail else "snapshot")
+        confidence = self.confidence if thumbnail else self.snapshot_confidence
+        if confidence < threshold:
+            return CPAIInference(predictions=[])
+        return CPAIInference(
+            predictions=[CPAIPrediction(confidence, "car", 1, 2, 3, 4)]
+        )
+
+
+def _pipeline(name: str, confidence: float, **options) -> _Pipeline:
+    pipeline = _Pipeline(
+        name=name,
+        pipeline_type="object",
+        server=None,  # type: ignore
+        model=None,
+        threshold=0.5,
+        result_topic=None,
+        filter=None,
+        **options,
+    )
+    pipeline.confidence = confidence
+    pipeline.sent = []
+    return pipeline
+
+
+def _thumbnail_pipeline(confidence: float) -> _Pipeline:
+    return _pipeline(
+        "cars", confidence, thumbnail=ThumbnailConfig(accept=0.8, reject=0.3)
+    )
+
+
+async def _run(
+    *pipelines: _Pipeline,
+) -> Tuple[Dict[str, Optional[CPAIInference]], List[str]]:
+    """Run pipelines on an event with a thumbnail, returning their inferences
+    and the pipelines a snapshot was fetched for."""
+    event = FrigateEvent.from_dict(
+        {
+            "id": "a",
+            "camera": "front",
+            "box": BOX,
+            "thumbnail": base64.b64encode(THUMBNAIL).decode(),
+        }
+    )
+
+    async def fetch_images(pipeline: CPAIPipeline) -> ImageContext:
+        fetches.append(pipeline.name)
+        return ImageContext(ImageTransformer(workers=0), ("a",), SNAPSHOT)
+
+    fetches: List[str] = []
+    graph = PipelineGraph(pipelines, {p.name: p for p in pipelines})
+    inferences = await graph.run(
+        None, event, {}, fetch_images=fetch_images  # type: ignore
+    )
+    return inferences, fetches
+
+
+async def test_confident_thumbnail_is_accepted_without_a_snapshot():
+    pipeline = _thumbnail_pipeline(0.9)
+    inferences, fetches = await _run(pipeline)
+    assert fetches == []
+    assert pipeline.sent == ["thumbnail"]
+    inference = inferences["cars"]
+    assert inference is not None
+    p = inference.predictions[0]
+    # The thumbnail's coordinates mean nothing in the frame.
+    assert [p.x_min, p.y_min, p.x_max, p.y_max] == BOX
+
+
+async def test_empty_thumbnail_is_rejected_without_a_snapshot():
+    pipeline = _thumbnail_pipeline(0.1)
+    inferences, fetches = await _run(pipeline)
+    assert fetches == []
+    assert pipeline.sent == ["thumbnail"]
+    assert inferences["cars"] is None
+
+
+async def test_uncertain_thumbnail_escalates_to_the_snapshot():
+    pipeline = _thumbnail_pipeline(0.5)
+    inferences, fetches = await _run(pipeline)
+    assert fetches == ["cars"]
+    assert pipeline.sent == ["thumbnail", "snapshot"]
+    inference = inferences["cars"]
+    assert inference is not None
+    assert inference.predictions[0].confidence == 0.9
+
+
+async def test_dependents_of_a_rejected_thumbnail_never_fetch():
+    cars = _thumbnail_pipeline(0.1)
+    plates = _pipeline("plates", 0.9, depends_on=["cars"])
+    inferences, fetches = await _run(cars, plates)
+    assert fetches == []
+    assert plates.sent == []
+    assert inferences["plates"] is None
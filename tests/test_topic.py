@@ -0,0 +1,62 @@
+import pytest
+
+from emqx_deepstack_exhook.benchmark.topics import RegexSubscription
+from emqx_deepstack_exhook.topic import TopicTrie
+
+FILTERS = [
+    "frigate/events",
+    "frigate/+/person",
+    "frigate/#",
+    "frigate/+/+/snapshot",
+    "+/front/#",
+    "#",
+    "$SYS/#",
+]
+
+
+def _trie() -> TopicTrie[str]:
+    trie: TopicTrie[str] = TopicTrie()
+    for topic_filter in FILTERS:
+        trie.insert(topic_filter, topic_filter)
+    return trie
+
+
+@pytest.mark.parametrize(
+    "topic, expected",
+    [
+        ("frigate/events", ["frigate/events", "frigate/#", "#"]),
+        (
+            "frigate/front/person",
+            ["frigate/+/person", "frigate/#", "+/front/#", "#"],
+        ),
+        # '#' also matches the level it follows.
+        ("frigate", ["frigate/#", "#"]),
+        # '+' matches exactly one level.
+        (
+            "frigate/front/car/snapshot",
+            ["frigate/#", "frigate/+/+/snapshot", "+/front/#", "#"],
+        ),
+        ("frigate/front/person/extra", ["frigate/#", "+/front/#", "#"]),
+        # Wildcards at the first level don't match '$' topics.
+        ("$SYS/brokers", ["$SYS/#"]),
+        ("", []),
+    ],
+)
+def test_match_in_insertion_order(topic, expected):
+    assert _trie().match(topic) == sorted(expected, key=FILTERS.index)
+
+
+def test_match_agrees_with_regex_reference():
+    # The regex matcher never escaped '$', so '$' topics are left out.
+    trie = _trie()
+    subscriptions = [RegexSubscription(f) for f in FILTERS]
+    for topic in [
+        "frigate/events",
+        "frigate/front/person",
+        "frigate/back/dog/snapshot",
+        "other/front/thing",
+        "a/b/c/d",
+    ]:
+        assert trie.match(topic) == [
+            s.subscribe for s in subscriptions if s.matches(topic)
+        ]
@@ -0,0 +1,68 @@
+import asyncio
+import io
+from typing import List
+
+from PIL import Image
+
+from emqx_deepstack_exhook.cpai.image import ImageSpec, jpeg_size
+from emqx_deepstack_exhook.cpai.transform import ImageContext, ImageTransformer
+
+SMALL = ImageSpec(None, (100, 75))
+CROP = ImageSpec((0, 0, 200, 200), (50, 50))
+GRAY = ImageSpec(None, (200, 150), grayscale=True)
+
+
+class _CountingTransformer(ImageTransformer):
+    def __init__(self) -> None:
+        super().__init__(workers=0)
+        self.batches: List[List[ImageSpec]] = []
+
+    async def run(self, snapshot: bytes, specs: List[ImageSpec]) -> List[bytes]:
+        self.batches.append(specs)
+        return await super().run(snapshot, specs)
+
+
+def _snapshot() -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (400, 300)).save(out, "JPEG")
+    return out.getvalue()
+
+
+async def test_prepared_specs_are_made_in_one_transform():
+    transformer = _CountingTransformer()
+    images = ImageContext(transformer, ("a",), _snapshot())
+    images.prepare([SMALL, CROP, SMALL, GRAY])
+    small, crop, gray = await asyncio.gather(
+        images.get(SMALL), images.get(CROP), images.get(GRAY)
+    )
+    assert transformer.batches == [[SMALL, CROP, GRAY]]
+    assert [jpeg_size(i) for i in (small, crop, gray)] == [
+        (100, 75),
+        (50, 50),
+        (200, 150),
+    ]
+    # Asking again, one at a time, reuses the batch.
+    assert await images.get(CROP) == crop
+    assert len(transformer.batches) == 1
+
+
+async def test_cached_images_are_shared_between_messages():
+    transformer = _CountingTransformer()
+    snapshot = _snapshot()
+    first = ImageContext(transformer, ("a",), snapshot)
+    first.prepare([SMALL, CROP])
+    await asyncio.gather(first.get(SMALL), first.get(CROP))
+    second = ImageContext(transformer, ("a",), snapshot)
+    second.prepare([SMALL, CROP, GRAY])
+    await asyncio.gather(second.get(SMALL), second.get(GRAY))
+    # Only the image nobody made yet is transformed.
+    assert transformer.batches == [[SMALL, CROP], [GRAY]]
+
+
+async def test_undeclared_specs_get_their_own_transform():
+    transformer = _CountingTransformer()
+    images = ImageContext(transformer, ("a",), _snapshot())
+    images.prepare([SMALL])
+    await images.get(SMALL)
+    await images.get(CROP)
+    assert transformer.batches == [[SMALL], [CROP]]
@@ -0,0 +1,51 @@
+from emqx_deepstack_exhook.cpai.types import CPAIPrediction, FrigateEvent
+
+
+def _prediction(label: str, confidence: float) -> CPAIPrediction:
+    return CPAIPrediction(
+        label=label, confidence=confidence, x_min=10, y_min=20, x_max=30, y_max=40
+    )
+
+
+def test_merge_keeps_labels_sharing_a_box():
+    event = FrigateEvent.from_dict(
+        {"id": "a", "camera": "front", "label": "car", "current_attributes": []}
+    )
+    event.merge_predictions([_prediction("ups", 0.9), _prediction("fedex", 0.7)])
+    event.merge_predictions([_prediction("ups", 0.8)])
+    labels = [a["label"] for a in event.current_attributes]
+    assert labels == ["ups", "fedex"]
+
+
+def test_from_dict_keeps_unknown_fields_as_extras():
+    data = {
+        "id": "a",
+        "camera": "front",
+        "label": "car",
+        "recognized_license_plate": "ABC123",
+        "data": {"type": "object"},
+    }
+    event = FrigateEvent.from_dict(data)
+    assert event.extras == {
+        "recognized_license_plate": "ABC123",
+        "data": {"type": "object"},
+    }
+    view = event.as_mapping()
+    assert view["label"] == "car"
+    assert view["recognized_license_plate"] == "ABC123"
+    assert set(view) >= set(data)
+
+
+def test_to_dict_updates_source_and_keeps_extras():
+    data = {"id": "a", "camera": "front", "new_field": 1}
+    event = FrigateEvent.from_dict(data)
+    event.merge_predictions([_prediction("ups", 0.9)])
+    out = event.to_dict()
+    assert out is data
+    assert list(out)[:3] == ["id", "camera", "new_field"]
+    assert out["sub_label"] == ("ups", 0.9)
+    assert out["attributes"] == {"ups": 0.9}
+
+    built = FrigateEvent(id="b", camera="back").to_dict()
+    assert built["id"] == "b" and built["sub_label"] is None
+    assert "extras" not in built
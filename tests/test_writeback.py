@@ -0,0 +1,80 @@
+import asyncio
+from typing import Awaitable, Callable, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from emqx_deepstack_exhook.cpai.writeback import SUB_LABEL_UPDATES, SubLabelWriter
+
+
+async def _frigate(
+    sub_label: Callable[[web.Request], Awaitable[web.Response]]
+) -> Tuple[web.AppRunner, str]:
+    app = web.Application()
+    app.router.add_post("/api/events/{id}/sub_label", sub_label)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner, f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+
+async def test_stop_flushes_pending_writes():
+    written = []
+    failures = {"b": 1}
+
+    async def sub_label(request: web.Request) -> web.Response:
+        event_id = request.match_info["id"]
+        await asyncio.sleep(0.05)
+        if failures.get(event_id, 0) > 0:
+            failures[event_id] -= 1
+            raise web.HTTPServiceUnavailable()
+        written.append(event_id)
+        return web.json_response({})
+
+    runner, frigate = await _frigate(sub_label)
+    try:
+        async with aiohttp.ClientSession() as session:
+            writer = SubLabelWriter(session, frigate, backoff=0.05)
+            assert writer.submit("a", "ups", 0.9)
+            assert writer.submit("b", "fedex", 0.8)
+            await writer.stop(timeout=5)
+            assert len(writer) == 0
+    finally:
+        await runner.cleanup()
+    assert sorted(written) == ["a", "b"]
+
+
+async def test_client_errors_are_not_retried():
+    calls = []
+
+    async def sub_label(request: web.Request) -> web.Response:
+        calls.append(request.match_info["id"])
+        raise web.HTTPNotFound()
+
+    runner, frigate = await _frigate(sub_label)
+    try:
+        async with aiohttp.ClientSession() as session:
+            writer = SubLabelWriter(session, frigate, backoff=0.01)
+            assert writer.submit("expired", "ups", 0.9)
+            await writer.stop(timeout=5)
+    finally:
+        await runner.cleanup()
+    assert calls == ["expired"]
+
+
+async def test_stop_abandons_scheduled_retries():
+    async def sub_label(request: web.Request) -> web.Response:
+        raise web.HTTPServiceUnavailable()
+
+    runner, frigate = await _frigate(sub_label)
+    try:
+        async with aiohttp.ClientSession() as session:
+            writer = SubLabelWriter(session, frigate, backoff=10)
+            abandoned = SUB_LABEL_UPDATES.labels("abandoned")
+            before = abandoned.value
+            assert writer.submit("a", "ups", 0.9)
+            await writer.stop(timeout=0.2)
+            assert len(writer) == 0
+            assert abandoned.value == before + 1
+    finally:
+        await runner.cleanup()